@@ -13,6 +13,7 @@ export interface OrganizationDTOBasic {
     desc: string
     image: string
     owner_id: number
+    image_variants: Record<string, string> // Thumbnails of `image` by size, e.g. "64". May not exist yet.
 }
 
 export interface OrganizationRepoDTO {
@@ -36,6 +37,16 @@ export class OrganizationService {
         return await axiosInstance.post(`/organizations`, dto);
     }
 
+    /**
+     * Replaces the image of an organization. The file is sent as it is, as
+     * multipart/form-data, instead of base64 in `OrganizationCreateDTO.image`.
+     */
+    static async UploadOrganizationImage(orgId: number, image: File): Promise<AxiosResponse<OrganizationDTOBasic>> {
+        const form = new FormData();
+        form.append("image", image);
+        return await axiosInstance.put(`/organizations/${orgId}/image`, form);
+    }
+
     static async GetMyOrganizations(): Promise<AxiosResponse<OrganizationDTOBasic[]>> {
         return await axiosInstance.get(`/organizations/my`);
     }
@@ -43,4 +54,14 @@ export class OrganizationService {
     static GetImageURI = (filename: string): string => {
         return `${ENV.IMG}${filename}`;
     }
+
+    /**
+     * URI of the smallest thumbnail of the organization's image which is at least `size` pixels, or of the image itself.
+     * Thumbnails are made in the background, so fall back to `GetImageURI(org.image)` if it fails to load.
+     */
+    static GetThumbnailURI = (org: OrganizationDTOBasic, size: number): string => {
+        const variants = org.image_variants ?? {};
+        const sizes = Object.keys(variants).map(Number).filter(s => s >= size).sort((a, b) => a - b);
+        return OrganizationService.GetImageURI(sizes.length > 0 ? variants[sizes[0]] : org.image);
+    }
 }
\ No newline at end of file
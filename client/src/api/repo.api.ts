@@ -33,6 +33,7 @@ export interface ReposOfUserDTO {
     user_name: string,
     repos: RepoDTO[],
     organization_names: { [key: number]: string };
+    next: string | null, // Cursor of the next page, when paginating.
 }
 
 export interface RepoExtDTO extends RepoDTO {
@@ -40,6 +41,16 @@ export interface RepoExtDTO extends RepoDTO {
     org_name: string | null,
 }
 
+export interface RepoSearchDTO {
+    repos: RepoDTO[],
+    next: string | null, // Cursor of the next page.
+}
+
+export interface PopularReposDTO {
+    repos: RepoDTO[],
+    next: string | null, // Cursor of the next page.
+}
+
 export class RepositoryService {
     static BadgeToHumanText(badge: RepositoryBadge): string {
         switch (badge) {
@@ -83,6 +94,13 @@ export class RepositoryService {
         return await axiosInstance.get(`/repositories/u/${username}`);
     }
 
+    static async SearchRepositories(q: string, cursor: string | null = null): Promise<AxiosResponse<RepoSearchDTO>> {
+        return await axiosInstance.get(`/repositories/search`, { params: { q, cursor } });
+    }
+
+    static async GetPopularRepositories(badge: RepositoryBadge | null = null, cursor: string | null = null): Promise<AxiosResponse<PopularReposDTO>> {
+        return await axiosInstance.get(`/repositories/popular`, { params: { badge, cursor } });
+    }
 
     static async GetRepoByCanonicalName(name: string): Promise<AxiosResponse<RepoExtDTO>> {
         return await axiosInstance.get(`/repositories/${name}`);
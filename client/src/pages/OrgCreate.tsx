@@ -1,7 +1,6 @@
 import React, { useRef, useState } from 'react';
 import { Form, Button, Alert, Row, Col, Spinner } from 'react-bootstrap';
 import './OrgCreate.css';
-import { fileToBase64 } from '../util/image';
 import { OrganizationCreateDTO, OrganizationService } from '../api/org.api';
 import { AxiosError } from 'axios';
 import { ToastType, useToastStore } from '../util/toastStore';
@@ -36,22 +35,21 @@ export const OrganizationCreate = () => {
         e.preventDefault();
         const formErrors = validateForm();
         if (Object.keys(formErrors).length === 0) {
-            let base64: string | null = null;
-            if (image) {
-                base64 = await fileToBase64(image);
-            }
-
+            // The image is uploaded after the organization is created, which gets an identicon until then.
             const dto: OrganizationCreateDTO = {
                 name: name,
                 desc: description,
-                image: base64,
+                image: null,
             };
 
             setError('');
             setErrors({});
             setLoading(true);
-            OrganizationService.CreateOrganization(dto).then((res) => {
-                const org = res.data;
+            OrganizationService.CreateOrganization(dto).then(async (res) => {
+                let org = res.data;
+                if (image) {
+                    org = (await OrganizationService.UploadOrganizationImage(org.id, image)).data;
+                }
                 addToast(`Created organization ${org.name}`, ToastType.success);
                 navigate(`/o/${org.name}`);
             }).catch((err: AxiosError) => {
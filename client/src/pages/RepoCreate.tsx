@@ -13,6 +13,7 @@ interface Owner {
     user_id: number | null;
     organization_id: number | null;
     image_path: string | null;
+    thumbnail_uri: string | null;
 }
 
 export const RepoCreate = () => {
@@ -41,13 +42,14 @@ export const RepoCreate = () => {
                     user_id: null,
                     organization_id: o.id,
                     image_path: o.image,
+                    thumbnail_uri: OrganizationService.GetThumbnailURI(o, 50),
                 };
             });
 
             // Create list of "owners" (the user himself + all the organizations above).
 
             const all_possible_owners: Owner[] = [
-                { name: "user 1", user_id: getJwtId(), organization_id: null, image_path: null },
+                { name: "user 1", user_id: getJwtId(), organization_id: null, image_path: null, thumbnail_uri: null },
                 ...organizations_i_can_make_repos_in
             ]
             setOwners(all_possible_owners);
@@ -145,7 +147,8 @@ export const RepoCreate = () => {
                                 <Dropdown.Item key={o.name} eventKey={o.name}>
                                     {o.image_path !== null && (
                                         <img
-                                            src={`${OrganizationService.GetImageURI(o.image_path)}`}
+                                            src={o.thumbnail_uri ?? OrganizationService.GetImageURI(o.image_path)}
+                                            onError={(e) => { e.currentTarget.onerror = null; e.currentTarget.src = OrganizationService.GetImageURI(o.image_path!); }}
                                             style={{ width: '50px', height: '50px', objectFit: 'cover', marginRight: '10px' }}
                                         />
                                     )}
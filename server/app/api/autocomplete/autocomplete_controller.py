@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Query
+
+from app.api.autocomplete.autocomplete_dto import AutocompleteDTO, AutocompleteItemDTO
+from app.api.autocomplete.autocomplete_index import AUTOCOMPLETE_TOP_K, PrefixIndex, autocomplete_index
+
+router = APIRouter(prefix="/autocomplete", tags=["autocomplete"])
+
+@router.get("", response_model=AutocompleteDTO, status_code=200, summary="Repositories, users and organizations whose name starts with `q`, most popular first")
+def autocomplete(
+    q: str = Query(min_length=1, max_length=255),
+    limit: int = Query(default=5, ge=1, le=AUTOCOMPLETE_TOP_K),
+):
+    def suggest(index: PrefixIndex) -> list:
+        return [AutocompleteItemDTO(name=name, popularity=popularity) for name, popularity in index.search(q, limit)]
+
+    return AutocompleteDTO(
+        repositories=suggest(autocomplete_index.repositories),
+        users=suggest(autocomplete_index.users),
+        organizations=suggest(autocomplete_index.organizations),
+    )
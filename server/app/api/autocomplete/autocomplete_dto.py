@@ -0,0 +1,14 @@
+from typing import List
+from pydantic import BaseModel
+
+class AutocompleteItemDTO(BaseModel):
+    name: str
+    popularity: int
+
+class AutocompleteDTO(BaseModel):
+    repositories: List[AutocompleteItemDTO]
+    """
+    By canonical name. Only public repositories.
+    """
+    users: List[AutocompleteItemDTO]
+    organizations: List[AutocompleteItemDTO]
@@ -0,0 +1,292 @@
+# ----------------------------------------------
+# Autocomplete
+# ----------------------------------------------
+#
+# `GET /autocomplete?q=` suggests repositories (by canonical name), users and
+# organizations whose name starts with `q`, case insensitive, most popular
+# first. It's called on every keystroke, so it never touches the database.
+#
+# Popularity is:
+#   - for repositories, their downloads,
+#   - for users and organizations, the number of public repositories they own.
+# Private repositories are never suggested and don't count.
+#
+# Every worker process keeps an `AutocompleteIndex` in memory:
+#
+# - `PrefixIndex` is a trie over lowercase names in which every node keeps the
+#   top AUTOCOMPLETE_TOP_K names below it, so a lookup is a walk of len(q)
+#   nodes. To bound memory, the trie is only AUTOCOMPLETE_MAX_DEPTH levels deep.
+#   The deepest nodes keep all names below them, which are filtered and sorted
+#   for longer queries. There are few of those per node at that point.
+#
+# - It's built on startup from a streamed query (`init_autocomplete`) and
+#   updated right away when this worker adds a repository, user or
+#   organization, or flushes downloads (see repo_downloads.py).
+#
+# - Every AUTOCOMPLETE_REFRESH_SECONDS, it picks up what other workers added.
+#   Downloads counted by other workers are not picked up until a restart, but
+#   since requests are spread evenly across workers, the order is about the same.
+
+import bisect
+import heapq
+import os
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.api.config.database import SessionLocal
+from app.api.org.org_model import Organization
+from app.api.repo.repo_model import Repository
+from app.api.user.user_model import User
+
+AUTOCOMPLETE_TOP_K = int(os.getenv('AUTOCOMPLETE_TOP_K', '10'))
+AUTOCOMPLETE_MAX_DEPTH = int(os.getenv('AUTOCOMPLETE_MAX_DEPTH', '12'))
+AUTOCOMPLETE_REFRESH_SECONDS = float(os.getenv('AUTOCOMPLETE_REFRESH_SECONDS', '30'))
+
+# IDs aren't always committed in order, so each refresh looks this far back
+# for rows committed after ones with higher IDs.
+AUTOCOMPLETE_REFRESH_LOOKBACK = 1000
+
+
+class _Node:
+    __slots__ = ("children", "top", "deep")
+
+    def __init__(self):
+        self.children: Dict[str, _Node] = {}
+        self.top: List[Tuple[int, str]] = []
+        """
+        (-popularity, name) of the most popular names below this node, sorted.
+        """
+        self.deep: set[str] | None = None
+        """
+        At AUTOCOMPLETE_MAX_DEPTH, all names below this node which are longer than it.
+        """
+
+
+class PrefixIndex:
+    """
+    Names with their popularity, searchable by prefix. Popularity is expected
+    to only grow: a name whose popularity drops may still be suggested ahead
+    of others until the index is rebuilt.
+    """
+
+    def __init__(self, top_k: int, max_depth: int):
+        self.top_k = top_k
+        self.max_depth = max_depth
+        self._root = _Node()
+        self._popularity: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._popularity)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._popularity
+
+    def add(self, name: str, popularity: int = 0):
+        """
+        Adds `name`, unless it's already there.
+        """
+        with self._lock:
+            if name not in self._popularity:
+                self._set(name, popularity)
+
+    def incr(self, name: str, delta: int):
+        """
+        Adds `delta` to the popularity of `name`, if it's there.
+        """
+        with self._lock:
+            if name in self._popularity:
+                self._set(name, self._popularity[name] + delta)
+
+    def popularity(self, name: str) -> int | None:
+        return self._popularity.get(name)
+
+    def _set(self, name: str, popularity: int):
+        old = self._popularity.get(name)
+        self._popularity[name] = popularity
+
+        key = name.lower()
+        node = self._root
+        self._offer(node, name, old, popularity)
+        for char in key[:self.max_depth]:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+            self._offer(node, name, old, popularity)
+
+        if len(key) > self.max_depth:
+            if node.deep is None:
+                node.deep = set()
+            node.deep.add(name)
+
+    def _offer(self, node: _Node, name: str, old: int | None, popularity: int):
+        top = node.top
+        if old is not None:
+            i = bisect.bisect_left(top, (-old, name))
+            if i < len(top) and top[i] == (-old, name):
+                del top[i]
+
+        entry = (-popularity, name)
+        if len(top) < self.top_k or entry < top[-1]:
+            top.insert(bisect.bisect_left(top, entry), entry)
+            del top[self.top_k:]
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """
+        Up to `limit` (at most `top_k`) names starting with `prefix`, as (name, popularity), most popular first.
+        """
+        key = prefix.lower()
+
+        with self._lock:
+            node = self._root
+            for char in key[:self.max_depth]:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+
+            if len(key) <= self.max_depth:
+                return [(name, -negative) for negative, name in node.top[:limit]]
+
+            if node.deep is None:
+                return []
+            matches = ((-self._popularity[name], name) for name in node.deep if name.lower().startswith(key))
+            return [(name, -negative) for negative, name in heapq.nsmallest(limit, matches)]
+
+
+class AutocompleteIndex:
+    def __init__(self, top_k: int, max_depth: int):
+        self.top_k = top_k
+        self.max_depth = max_depth
+        self._reset()
+        self._refresh_lock = threading.Lock()
+
+    def _reset(self):
+        self.repositories = PrefixIndex(self.top_k, self.max_depth)
+        self.users = PrefixIndex(self.top_k, self.max_depth)
+        self.organizations = PrefixIndex(self.top_k, self.max_depth)
+        self._repo_names: Dict[int, str] = {}
+        """
+        Canonical names of the indexed repositories, by ID.
+        """
+        self._last_repo_id = 0
+        self._last_user_id = 0
+        self._last_org_id = 0
+
+    def rebuild(self, session: Session):
+        with self._refresh_lock:
+            self._reset()
+        self.refresh(session)
+
+    def refresh(self, session: Session):
+        """
+        Adds repositories, users and organizations created since the last refresh.
+        """
+        with self._refresh_lock:
+            owned_by_user = Counter()
+            owned_by_org = Counter()
+
+            query = (
+                select(Repository.id, Repository.canonical_name, Repository.downloads, User.username, Organization.name.label("org_name"))
+                .join(User, Repository.owner_id == User.id)
+                .outerjoin(Organization, Repository.organization_id == Organization.id)
+                .where(Repository.public, Repository.id > self._last_repo_id - AUTOCOMPLETE_REFRESH_LOOKBACK)
+                .order_by(Repository.id)
+            )
+            for row in session.exec(query.execution_options(yield_per=1000)):
+                self._last_repo_id = max(self._last_repo_id, row.id)
+                if row.id in self._repo_names:
+                    continue
+                self._repo_names[row.id] = row.canonical_name
+                self.repositories.add(row.canonical_name, row.downloads)
+                if row.org_name is None:
+                    owned_by_user[row.username] += 1
+                else:
+                    owned_by_org[row.org_name] += 1
+
+            query = select(User.id, User.username).where(User.id > self._last_user_id - AUTOCOMPLETE_REFRESH_LOOKBACK).order_by(User.id)
+            for row in session.exec(query.execution_options(yield_per=1000)):
+                self._last_user_id = max(self._last_user_id, row.id)
+                if row.username not in self.users:
+                    self.users.add(row.username, owned_by_user.pop(row.username, 0))
+
+            query = select(Organization.id, Organization.name).where(Organization.id > self._last_org_id - AUTOCOMPLETE_REFRESH_LOOKBACK).order_by(Organization.id)
+            for row in session.exec(query.execution_options(yield_per=1000)):
+                self._last_org_id = max(self._last_org_id, row.id)
+                if row.name not in self.organizations:
+                    self.organizations.add(row.name, owned_by_org.pop(row.name, 0))
+
+            # Owners which were indexed before.
+            for username, count in owned_by_user.items():
+                self.users.incr(username, count)
+            for org_name, count in owned_by_org.items():
+                self.organizations.incr(org_name, count)
+
+    def add_repository(self, repo: Repository, owner_username: str, org_name: str | None):
+        if not repo.public:
+            return
+        with self._refresh_lock:
+            if repo.id in self._repo_names:
+                return
+            self._repo_names[repo.id] = repo.canonical_name
+        self.repositories.add(repo.canonical_name, repo.downloads)
+        if org_name is None:
+            self.users.incr(owner_username, 1)
+        else:
+            self.organizations.incr(org_name, 1)
+
+    def add_user(self, user: User):
+        self.users.add(user.username)
+
+    def add_organization(self, org: Organization):
+        self.organizations.add(org.name)
+
+    def add_downloads(self, deltas: Dict[int, int]):
+        for id, delta in deltas.items():
+            name = self._repo_names.get(id)
+            if name is not None:
+                self.repositories.incr(name, delta)
+
+
+class AutocompleteRefresher:
+    def __init__(self, index: AutocompleteIndex, session_factory: Callable[[], Session], interval: float):
+        self.index = index
+        self.session_factory = session_factory
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="autocomplete-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.session_factory() as session:
+                    self.index.refresh(session)
+            except Exception as e:
+                print(f"[!] Refreshing the autocomplete index failed, will retry: {e}")
+
+
+def init_autocomplete(engine: Engine):
+    with Session(engine) as session:
+        autocomplete_index.rebuild(session)
+
+
+autocomplete_index = AutocompleteIndex(AUTOCOMPLETE_TOP_K, AUTOCOMPLETE_MAX_DEPTH)
+autocomplete_refresher = AutocompleteRefresher(autocomplete_index, SessionLocal, AUTOCOMPLETE_REFRESH_SECONDS)
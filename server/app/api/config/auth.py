@@ -4,11 +4,15 @@
 # 
 # There are two important definitions in this module:
 #
-# JWTDep - Used as a dependency for FastAPI routes expecting a JWT.
+# ClaimsDep - Used as a dependency for FastAPI routes expecting a JWT.
+#             Resolves to the already verified `JWTClaims` of the request.
 # pre_authorize - Decorator function similar to Spring Boot.
 #
+# JWTDep (the raw token) is still available for older code, but every
+# `get_*_from_jwt(jwt)` call decodes the token again, so prefer claims.
 #
 
+from dataclasses import dataclass
 from functools import wraps
 import inspect
 from fastapi import Depends, Request, HTTPException
@@ -18,6 +22,7 @@ from typing import Callable, List, get_type_hints
 import jwt
 from fastapi import HTTPException
 from app.api.user.user_model import User, UserRole
+from app.api.config.token_cache import VerifiedTokenCache
 from typing import Annotated
 from functools import wraps
 from typing import List, Callable
@@ -31,34 +36,56 @@ else:
     JWT_SECRET = os.environ['JWT_SECRET']
     JWT_ALGORITHM = os.environ['JWT_ALGORITHM']
 
+# Claims of recently verified tokens, see token_cache.py.
+# JWT_CACHE_SIZE=0 disables the cache.
+token_cache = VerifiedTokenCache(
+    max_size=int(os.getenv('JWT_CACHE_SIZE', 4096)),
+    ttl=float(os.getenv('JWT_CACHE_TTL', 300)),
+)
+
+
+@dataclass(frozen=True)
+class JWTClaims:
+    """
+    Claims of a JWT which has already been decoded and verified.
+
+    Handlers should receive this object through `ClaimsDep` (or `ClaimsDepOptional`)
+    instead of decoding the raw token themselves. FastAPI caches dependencies per
+    request, so the signature is checked exactly once no matter how many times
+    the claims are used.
+    """
+    id: int
+    role: str
+    sub: str
+    must_change_password: bool
+    token: str
+
+    @staticmethod
+    def from_token(token: str) -> "JWTClaims":
+        """
+        Returns the claims of `token`, verifying it only if it isn't in `token_cache`.
+        """
+        claims = token_cache.get(token)
+        if claims is not None:
+            return claims
+
+        payload = decode_jwt(token)
+        claims = JWTClaims(
+            id=payload["id"],
+            role=payload["role"],
+            sub=payload["sub"],
+            must_change_password=payload["must_change_password"],
+            token=token,
+        )
+        token_cache.put(token, claims, payload.get("exp"))
+        return claims
 
-class JWTBearer(HTTPBearer):
-    def __init__(self, auto_error: bool = True):
-        super(JWTBearer, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
-        credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
-        if credentials:
-            if not credentials.scheme == "Bearer":
-                raise HTTPException(status_code=403, detail="Invalid authentication scheme.")
-            if not self.verify_jwt(credentials.credentials):
-                raise HTTPException(status_code=403, detail="Invalid token or expired token.")
-            return credentials.credentials
-        else:
-            raise HTTPException(status_code=403, detail="Invalid authorization code.")
-        
-    def verify_jwt(self, jwtoken: str) -> bool:
-        try:
-            decode_jwt(jwtoken)
-        except Exception:
-            return False
-        return True
-    
 class JWTBearerOptional(HTTPBearer):
     def __init__(self, auto_error: bool = False):
         super(JWTBearerOptional, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request) -> JWTClaims | None:
         credentials: HTTPAuthorizationCredentials = await super(JWTBearerOptional, self).__call__(request)
         if credentials is None:
             return None
@@ -66,26 +93,52 @@ class JWTBearerOptional(HTTPBearer):
         if credentials:
             if credentials.scheme != "Bearer":
                 raise HTTPException(status_code=403, detail="Invalid authentication scheme.")
-            if not self.verify_jwt(credentials.credentials):
+            claims = self.verify_jwt(credentials.credentials)
+            if claims is None:
                 raise HTTPException(status_code=403, detail="Invalid token or expired token.")
-            return credentials.credentials
+            return claims
 
         return None
 
-    def verify_jwt(self, jwtoken: str) -> bool:
+    def verify_jwt(self, jwtoken: str) -> JWTClaims | None:
         try:
-            decode_jwt(jwtoken)
+            return JWTClaims.from_token(jwtoken)
         except Exception:
-            return False
-        return True
+            return None
 
  
+# Every dependency below goes through this one bearer instance: FastAPI
+# caches a dependency's result per request *by callable*, so `ClaimsDep`,
+# `ClaimsDepOptional` and `JWTDep` used together in one request (e.g. by an
+# endpoint and by `get_read_database`) still decode the token only once.
+_jwt_bearer_optional = JWTBearerOptional()
 
-JWTDep = Annotated[str, Depends(JWTBearer())]
-JWTDepOptional = Annotated[str, Depends(JWTBearerOptional())]
+ClaimsDepOptional = Annotated[JWTClaims | None, Depends(_jwt_bearer_optional)]
+
+
+def _required_claims(claims: ClaimsDepOptional) -> JWTClaims:
+    if claims is None:
+        raise HTTPException(status_code=403, detail="Invalid authorization code.")
+    return claims
+
+
+ClaimsDep = Annotated[JWTClaims, Depends(_required_claims)]
+
+
+def _token_of(claims: ClaimsDep) -> str:
+    return claims.token
+
+
+def _token_of_optional(claims: ClaimsDepOptional) -> str | None:
+    return None if claims is None else claims.token
+
+
+JWTDep = Annotated[str, Depends(_token_of)]
+JWTDepOptional = Annotated[str, Depends(_token_of_optional)]
 
 
 def sign_jwt(user: User) -> str:
+    # No `exp`: a token stays valid until JWT_SECRET changes, even after a password change.
     payload = {
         "id": user.id,
         "role": user.role.value,
@@ -123,10 +176,12 @@ def get_id_from_jwt_optional(jwt: JWTDepOptional) -> int | None:
 
 
 def validate_jwt_or_raise_exceptions(jwt: JWTDep, expected_roles: List[str] | List[UserRole] | None, ignore_password_change_requirement: bool):
-    token = decode_jwt(jwt)
+    validate_claims_or_raise_exceptions(JWTClaims.from_token(jwt), expected_roles, ignore_password_change_requirement)
+
 
-    password_needs_change = token["must_change_password"]
-    role_from_jwt = token["role"]
+def validate_claims_or_raise_exceptions(claims: JWTClaims, expected_roles: List[str] | List[UserRole] | None, ignore_password_change_requirement: bool):
+    password_needs_change = claims.must_change_password
+    role_from_jwt = claims.role
     
     # If password needs change, pre_authorize must fail.
     # Unless ignore_password_change_requirement is True.
@@ -158,17 +213,35 @@ def pre_authorize(roles: List[str] | List[UserRole] | None, ignore_password_chan
     ## Usage
 
     - `@pre_authorize` must go after `@router.foo`.
-    - The endpoint function you're wrapping must have a parameter `jwt: JWTDep` or `jwt: JWTDepOptional`. It must be called `jwt`.
+    - The endpoint function you're wrapping must have a parameter `claims: ClaimsDep`. It must be called `claims`.
+    - Older endpoints may instead have a parameter `jwt: JWTDep`, but then the token is decoded again.
     """
 
+    def authorize(kwargs):
+        claims = kwargs.get('claims')
+        if claims is not None:
+            validate_claims_or_raise_exceptions(claims, roles, ignore_password_change_requirement)
+            return
+
+        jwt_dep = kwargs.get('jwt')
+        if not jwt_dep:
+            # TODO: Change error message in production.
+            raise Exception("Cannot perform authorization without a JWT. Your router endpoint function MUST have a parameter named `claims: ClaimsDep`")
+        validate_jwt_or_raise_exceptions(jwt_dep, roles, ignore_password_change_requirement)
+
     def decorator(func: Callable):
+        # FastAPI runs `def` endpoints in a thread pool and awaits `async def` ones,
+        # so the wrapper must be the same kind of function as the endpoint.
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                authorize(kwargs)
+                return await func(*args, **kwargs)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            jwt_dep = kwargs.get('jwt')
-            if not jwt_dep:
-                # TODO: Change error message in production.
-                raise Exception("Cannot perform authorization without a JWT. Your router endpoint function MUST have a parameter named `jwt: JWTDep`")
-            validate_jwt_or_raise_exceptions(jwt_dep, roles, ignore_password_change_requirement)
+            authorize(kwargs)
             return func(*args, **kwargs)
         return wrapper
     return decorator
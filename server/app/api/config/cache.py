@@ -1,40 +1,164 @@
 import os
+import time
+from typing import Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
 from fastapi_cache import FastAPICache
+from fastapi_cache.backends import Backend
 from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache as _cache
 from redis import asyncio as aioredis
+import redis as redis_sync
+
+from app.api.config.read_cache import (
+    InvalidationBus,
+    LocalLRU,
+    MemoryReadCache,
+    ReadCache,
+    RedisReadCache,
+    TwoTierReadCache,
+)
 
 # When you want to use cache, you just import the decorator:
 #
-# from fastapi_cache.decorator import cache
+# from app.api.config.cache import cache
 #
-# @cache
+# @cache(expire=10)
 # def f(...)
 #
-# But when calling `f`, an exception will be raised in case Redis
-# isn't set up. When we're doing e.g. integration tests, we don't
-# have Redis set up, so we have to mock `cache` into a no-op.
+# `init_cache()` (called on startup) decides where cached values live:
 #
-# This means that you have to import `cache` from _here_, and not
-# from `fastapi_cache.decorator`.
-if os.getenv('mocker_hub_TEST_ENV') is not None:
-    print("[!] Detected environment variable mocker_hub_TEST_ENV -> not using cache")
+# - Normally, in Redis, with a small per-worker LRU in front of it (see
+#   `TwoTierBackend`). A hit in the LRU costs no network round trip.
+#   Clearing the cache is broadcast to every worker over Redis pub/sub.
+# - When we're doing e.g. integration tests, we don't have Redis set up, so
+#   everything is kept in process memory instead. Caching behaves the same way,
+#   just not across workers.
+#
+# ---
+#
+# The decorator caches whole responses, which doesn't work for data that
+# depends on who's asking, or that must be invalidated precisely when it
+# changes. For that, services use the `ReadCache` returned by `get_read_cache()`,
+# see config/read_cache.py.
+#
+# The size and TTL of the per-worker LRU are set with CACHE_LOCAL_SIZE (number
+# of entries) and CACHE_LOCAL_TTL (seconds). The TTL bounds how long a worker
+# may serve a stale value if an invalidation message gets lost.
+
+CACHE_LOCAL_SIZE = int(os.getenv('CACHE_LOCAL_SIZE', '10000'))
+CACHE_LOCAL_TTL = float(os.getenv('CACHE_LOCAL_TTL', '5'))
+
+
+class MemoryBackend(Backend):
+    """
+    fastapi-cache backend that keeps everything in a `LocalLRU`.
+    """
+    def __init__(self, local: LocalLRU):
+        self.local = local
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        ttl, value = self.local.get_with_ttl(key)
+        return int(ttl), value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.local.get(key)
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        self.local.set(key, value, expire or CACHE_LOCAL_TTL)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        if namespace:
+            return self.local.delete_prefix(namespace)
+        if key:
+            return self.local.delete(key)
+        return 0
+
+
+class TwoTierBackend(Backend):
+    """
+    fastapi-cache backend: `LocalLRU` in front of `RedisBackend`.
+
+    Local entries live for at most `local_ttl` seconds, but remember when the
+    Redis entry expires so that the TTL reported to the decorator (and thus
+    Cache-Control: max-age) stays correct.
+    """
+    def __init__(self, remote: RedisBackend, local: LocalLRU, bus: InvalidationBus, local_ttl: float):
+        self.remote = remote
+        self.local = local
+        self.bus = bus
+        self.local_ttl = local_ttl
+
+    def _remember(self, key: str, value: bytes, ttl: float):
+        if ttl > 0:
+            self.local.set(key, (value, time.monotonic() + ttl), min(self.local_ttl, ttl))
 
-    def no_op(expire=None):
-        def decorator(func):
-            return func
-        return decorator
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        entry = self.local.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            return max(0, int(expires_at - time.monotonic())), value
+
+        ttl, value = await self.remote.get_with_ttl(key)
+        if value is not None:
+            self._remember(key, value, ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_with_ttl(key))[1]
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        # Not broadcast: a local copy elsewhere expires with the Redis entry it
+        # came from, and that entry has expired or been cleared, or this is a fill.
+        await self.remote.set(key, value, expire)
+        self._remember(key, value, expire or self.local_ttl)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        count = await self.remote.clear(namespace, key)
+        # The bus talks to Redis with the blocking client.
+        if namespace:
+            await run_in_threadpool(self.bus.publish, prefixes=[namespace])
+        elif key:
+            await run_in_threadpool(self.bus.publish, keys=[key])
+        return count
+
+
+_read_cache: ReadCache = ReadCache()
+
+def get_read_cache() -> ReadCache:
+    return _read_cache
+
+
+cache = _cache
+
+if os.getenv('mocker_hub_TEST_ENV') is not None:
+    print("[!] Detected environment variable mocker_hub_TEST_ENV -> using in-memory cache")
 
-    def cache(expire=None):
-        return no_op(expire)
-    
     def init_cache():
-        ...
+        """
+        Every call starts with an empty cache, so that tests don't see each other's entries.
+        """
+        global _read_cache
+
+        FastAPICache.init(MemoryBackend(LocalLRU(CACHE_LOCAL_SIZE)), prefix="fastapi-cache")
+        _read_cache = MemoryReadCache(CACHE_LOCAL_SIZE)
 else:
-    from fastapi_cache.decorator import cache as _cache
-    cache = _cache
+    _invalidation_bus: InvalidationBus | None = None
 
     def init_cache():
+        global _read_cache, _invalidation_bus
+
         hostname = os.environ['REDIS_HOST']
         port = os.environ['REDIS_PORT']
+        client = redis_sync.Redis.from_url(f"redis://{hostname}:{port}")
+
+        # One LRU (and one pub/sub subscription) per worker, shared by both caches.
+        # Their keys don't collide because of the prefixes.
+        if _invalidation_bus is not None:
+            _invalidation_bus.stop()
+        local = LocalLRU(CACHE_LOCAL_SIZE)
+        _invalidation_bus = InvalidationBus(client, local)
+
         redis = aioredis.from_url(f"redis://{hostname}:{port}")
-        FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
\ No newline at end of file
+        FastAPICache.init(TwoTierBackend(RedisBackend(redis), local, _invalidation_bus, CACHE_LOCAL_TTL), prefix="fastapi-cache")
+
+        _read_cache = TwoTierReadCache(RedisReadCache(client, prefix="read-cache"), local, _invalidation_bus, CACHE_LOCAL_TTL)
@@ -3,25 +3,68 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import Session as SQLModelSession
 from sqlalchemy.pool import StaticPool
+from app.api.config.pool_metrics import InstrumentedAsyncQueuePool, InstrumentedQueuePool
+
+# Opt-in async mode: with DATABASE_ASYNC=1, the read endpoints listed in
+# repo/repo_controller.py run on the event loop with an `AsyncSession`
+# (asyncpg for Postgres, aiosqlite for the test SQLite database) instead of on
+# the thread pool. Everything else keeps using the sync engine below.
+# See app/benchmarks/bench_database.py to compare both modes.
+DATABASE_ASYNC = os.getenv('DATABASE_ASYNC') is not None
 
 if os.getenv('mocker_hub_TEST_ENV') is not None:
     print("[!] Detected environment variable mocker_hub_TEST_ENV -> using SQLite")
 
+    if DATABASE_ASYNC:
+        # The sync and the async engine open separate connections, so a plain
+        # `sqlite://` would give each of them its own empty database. A named,
+        # shared-cache in-memory database is visible to both.
+        database_url = "sqlite:///file:mocker_hub?mode=memory&cache=shared&uri=true"
+        async_database_url = "sqlite+aiosqlite:///file:mocker_hub?mode=memory&cache=shared&uri=true"
+    else:
+        database_url = "sqlite://"
+        async_database_url = None
+
     # To make the database truly in-memory, you need to specify a static 
     # pool which uses only one connection, shared between all requests.
     engine = create_engine(
-        "sqlite://", 
+        database_url, 
         connect_args={"check_same_thread": False}, 
         poolclass=StaticPool
     )
+    replica_engines = []
+    replica_async_urls = []
+    async_engine_kwargs = dict(connect_args={"check_same_thread": False}, poolclass=StaticPool)
 else:
-    postgre_hostname = "db"
+    postgre_hostname = os.environ.get('POSTGRES_HOST', "db")
     postgre_db = os.environ.get('POSTGRES_DATABASE', None)
     postgre_user = os.environ.get('POSTGRES_USER', None)
     postgre_password = os.environ.get('POSTGRES_PASSWORD', None)
     database_url = f"postgresql://{postgre_user}:{postgre_password}@{postgre_hostname}/{postgre_db}"
+    async_database_url = f"postgresql+asyncpg://{postgre_user}:{postgre_password}@{postgre_hostname}/{postgre_db}"
+
+    # Each worker process gets its own pool, so the database must accept
+    # workers * (POSTGRES_POOL_SIZE + POSTGRES_POOL_MAX_OVERFLOW) connections.
+    # Live statistics are available at /internal/stats.
+    pool_kwargs = dict(
+        pool_size=int(os.getenv('POSTGRES_POOL_SIZE', 5)),
+        max_overflow=int(os.getenv('POSTGRES_POOL_MAX_OVERFLOW', 10)),
+        pool_timeout=float(os.getenv('POSTGRES_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.getenv('POSTGRES_POOL_RECYCLE', -1)),
+        pool_pre_ping=os.getenv('POSTGRES_POOL_PRE_PING', '1') != '0',
+    )
+
+    engine = create_engine(database_url, poolclass=InstrumentedQueuePool, **pool_kwargs)
 
-    engine = create_engine(database_url)
+    # Comma-separated hostnames of read replicas, with the same credentials as the primary.
+    replica_hostnames = [h.strip() for h in os.environ.get('POSTGRES_REPLICA_HOSTS', "").split(",") if h.strip()]
+    replica_engines = [
+        create_engine(f"postgresql://{postgre_user}:{postgre_password}@{hostname}/{postgre_db}", poolclass=InstrumentedQueuePool, **pool_kwargs)
+        for hostname in replica_hostnames
+    ]
+    replica_async_urls = [f"postgresql+asyncpg://{postgre_user}:{postgre_password}@{hostname}/{postgre_db}" for hostname in replica_hostnames]
+    # The async engines get pools of their own, of the same size.
+    async_engine_kwargs = dict(poolclass=InstrumentedAsyncQueuePool, **pool_kwargs)
 
 SessionLocal = sessionmaker(
     # https://github.com/fastapi/sqlmodel/issues/75#issuecomment-2109911909
@@ -42,4 +85,15 @@ def get_database():
         db.rollback()
         raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async_engine = None
+async_replica_engines = []
+
+if DATABASE_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    async_engine = create_async_engine(async_database_url, **async_engine_kwargs)
+    # Same order as `replica_engines`, see `async_read_session` in config/replicas.py.
+    async_replica_engines = [create_async_engine(url, **async_engine_kwargs) for url in replica_async_urls]
@@ -0,0 +1,47 @@
+# ----------------------------------------------
+# ETags and conditional GETs
+# ----------------------------------------------
+#
+# Polling clients send back the ETag of the last response in `If-None-Match`
+# and get an empty 304 if nothing changed.
+#
+# The ETag is a hash of the JSON body. Endpoints that use this get the body
+# as bytes straight from the cache (see `ReadCache.get_or_load`), so a 304 costs
+# neither a query nor serialization. And when the body did change, it's sent
+# as-is, without being parsed and validated by FastAPI again.
+
+import hashlib
+
+from fastapi import Request, Response
+
+
+def compute_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison (RFC 9110 13.1.2), so W/ is ignored.
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return etag in candidates
+
+
+def conditional_json_response(request: Request, body: bytes, private: bool) -> Response:
+    """
+    `body` is the JSON of the response. `private`: whether it depends on who's asking.
+    """
+    etag = compute_etag(body)
+    headers = {
+        "ETag": etag,
+        # Clients may keep it, but must revalidate it every time.
+        "Cache-Control": "private, no-cache" if private else "no-cache",
+        "Vary": "Authorization",
+    }
+
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -32,6 +32,26 @@ class AccessDeniedException(UserException):
         return self.message
 
 
+class PayloadTooLargeException(UserException):
+    def __init__(self, msg: str):
+        self.message = f"{msg}"
+
+    def __str__(self):
+        return self.message
+
+
+class ServiceUnavailableException(Exception):
+    """
+    The server is temporarily overloaded. Not the user's fault, so it's not a `UserException`.
+    """
+    def __init__(self, msg: str, retry_after: int = 1):
+        self.message = f"{msg}"
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return self.message
+
+
 def register_exception_handler(app: FastAPI):
     @app.exception_handler(NotFoundException)
     def _NotFoundException(r: Request, e: NotFoundException):
@@ -41,6 +61,14 @@ def register_exception_handler(app: FastAPI):
     def _UserException(r: Request, e: UserException):
         raise HTTPException(400, detail={"message": str(e)}) 
     
+    @app.exception_handler(PayloadTooLargeException)
+    def _PayloadTooLargeException(r: Request, e: PayloadTooLargeException):
+        raise HTTPException(413, detail={"message": str(e)})
+    
+    @app.exception_handler(ServiceUnavailableException)
+    def _ServiceUnavailableException(r: Request, e: ServiceUnavailableException):
+        raise HTTPException(503, detail={"message": str(e)}, headers={"Retry-After": str(e.retry_after)})
+    
     @app.exception_handler(RequestValidationError)
     def _ValidationError(r: Request, e: RequestValidationError):
         raise HTTPException(400, detail={"message": str(e.errors())})
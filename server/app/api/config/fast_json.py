@@ -0,0 +1,61 @@
+# ----------------------------------------------
+# Fast JSON responses
+# ----------------------------------------------
+#
+# When an endpoint returns a DTO, FastAPI:
+#   1) dumps it to a dict,
+#   2) validates that dict against `response_model` (building the DTO again),
+#   3) serializes that to JSON-compatible Python objects,
+#   4) encodes those with the default response class.
+# On top of that, controllers usually build the DTOs with `model_validate`,
+# which validates every field of every row coming from the database.
+#
+# Validating rows from our own database again is wasted work, but skipping
+# validation with `model_construct` is no faster: it's a Python loop, while
+# validation runs in pydantic-core. What's worth skipping is everything after
+# the DTOs exist. Endpoints with big listings can opt in to a fast path:
+#
+#   repos = to_dtos(RepositoryDTO, repos)     # One validation pass over the whole list.
+#   return json_response(RepositorySearchDTO.model_construct(repos=repos))
+#
+# `to_dtos` takes ORM objects or rows of a column query (which are cheaper to
+# load). `json_response` serializes the DTO once, in pydantic-core, and FastAPI
+# sends the bytes as they are. Keep `response_model=` on the route: it's still
+# used for the OpenAPI docs.
+#
+# Everything else goes through `ORJSONResponse`, the default response class
+# (see main.py), which at least makes step 4 cheaper.
+#
+# See app/benchmarks/bench_serialization.py for the numbers.
+
+from functools import lru_cache
+from typing import Any, Iterable, List, Type, TypeVar
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+M = TypeVar("M", bound=BaseModel)
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[M]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def to_dtos(model: Type[M], items: Iterable[Any]) -> List[M]:
+    """
+    Builds a `model` from each item: an ORM object, or a row of a column query.
+    """
+    items = list(items)
+    if items and hasattr(items[0], "_mapping"):
+        # Validating dicts is faster than reading attributes of rows.
+        return _list_adapter(model).validate_python([dict(row._mapping) for row in items])
+    return _list_adapter(model).validate_python(items, from_attributes=True)
+
+
+def json_response(content: BaseModel | bytes, status_code: int = 200) -> Response:
+    """
+    Sends `content` (a DTO, or JSON that's ready to go) without validating it against `response_model`.
+    """
+    body = content if isinstance(content, bytes) else content.__pydantic_serializer__.to_json(content)
+    return Response(content=body, status_code=status_code, media_type="application/json")
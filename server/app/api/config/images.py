@@ -1,54 +1,97 @@
 import base64
-import os
-import random
-from typing import Tuple
-from PIL import Image, ImageDraw, ImageFont
+import binascii
+from functools import lru_cache
+from PIL import Image
 import hashlib
-import base64
 from io import BytesIO
+from app.api.config.exception_handler import UserException
 
 
-def save_image(inline_image_base64: str, filename_without_path_or_extension: str) -> Tuple[str, str]:
+def decode_inline_image(inline_image_base64: str) -> bytes:
     """
-    Returns: `(file_path, file_name)`
-    e.g. `(C:/.../images/abc.png, abc.png)`
+    Bytes of a data URL, e.g. `data:image/png;base64,iVBOR...`. Raises `UserException` if it's not one.
     """
-    header, encoded = inline_image_base64.split(",", 1)
-    file_format = header.split("/")[1].split(";")[0]
+    try:
+        _, encoded = inline_image_base64.split(",", 1)
+        return base64.b64decode(encoded, validate=True)
+    except (ValueError, binascii.Error):
+        raise UserException("Image must be a base64 data URL")
 
-    image_bytes = base64.b64decode(encoded)
 
-    filename = f"{filename_without_path_or_extension}.{file_format}"
-    filepath = f"./images/{filename}"
+def detect_image_format(data: bytes) -> str | None:
+    """
+    `png`, `jpeg`, `gif` or `webp`, judging by the first bytes, or None if it's none of them.
+    The format a client claims is not trusted.
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data[0:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
 
-    if os.getenv('mocker_hub_TEST_ENV') is None:
-        with open(filepath, "wb") as f:
-            f.write(image_bytes)
 
-    return (filepath, filename)
+# Identicons
+#
+# An organization without an image gets an identicon: a symmetric pattern of
+# blocks in a color taken from the MD5 of its name. Each half-row is read off
+# the hex digits of the hash (a block is filled if its digit is even), then
+# mirrored.
+#
+# The pattern is computed on the digits as a whole (`bytes.translate`) and
+# drawn one pixel per block; PIL scales that up in one go. The PNG is a
+# two-color palette image, a couple hundred bytes. Rendered PNGs are cached
+# by hash and size, so the same name never costs more than one render.
 
+IDENTICON_CACHE_SIZE = 4096
 
-def generate_inline_image(text: str, size: int=128, block_size=16) -> str:
-    image = Image.new('RGB', (size, size), 'white')
-    draw = ImageDraw.Draw(image)
+_EVEN_HEX_DIGITS = bytes.maketrans(b"0123456789abcdef", b"\1\0\1\0\1\0\1\0\1\0\1\0\1\0\1\0")
 
-    hash_object = hashlib.md5(text.encode())
-    hash_hex = hash_object.hexdigest()
-    color = '#' + hash_hex[:6]
-    num_blocks = size // block_size
+
+def identicon_bitmask(hash_hex: str, num_blocks: int) -> bytes:
+    """
+    `num_blocks` rows of `num_blocks` bytes, 1 where a block is filled.
+    """
+    digits = hash_hex.encode().translate(_EVEN_HEX_DIGITS)
+    half = num_blocks // 2
+    middle = b"\0" * (num_blocks % 2)
+
+    # Row `y` starts at digit `y * num_blocks`, wrapping around.
+    needed = (num_blocks - 1) * num_blocks + half
+    digits = digits * (needed // len(digits) + 1)
+
+    rows = []
     for y in range(num_blocks):
-        for x in range(num_blocks // 2):
-            if int(hash_hex[(x + y * num_blocks) % len(hash_hex)], 16) % 2 == 0:
-                draw.rectangle(
-                    [x * block_size, y * block_size, (x + 1) * block_size, (y + 1) * block_size],
-                    fill=color
-                )
-                draw.rectangle(
-                    [(num_blocks - x - 1) * block_size, y * block_size, (num_blocks - x) * block_size, (y + 1) * block_size],
-                    fill=color
-                )
-                
+        left = digits[y * num_blocks:y * num_blocks + half]
+        rows.append(left + middle + left[::-1])
+    return b"".join(rows)
+
+
+@lru_cache(maxsize=IDENTICON_CACHE_SIZE)
+def _render_identicon(hash_hex: str, size: int, block_size: int) -> bytes:
+    num_blocks = size // block_size
+    color = bytes.fromhex(hash_hex[:6])
+
+    grid = Image.frombytes("P", (num_blocks, num_blocks), identicon_bitmask(hash_hex, num_blocks))
+    grid.putpalette(b"\xff\xff\xff" + color)
+    image = grid.resize((num_blocks * block_size, num_blocks * block_size), Image.NEAREST)
+    if image.size != (size, size):
+        # Blocks don't fill the image, the rest is white.
+        canvas = Image.new("P", (size, size), 0)
+        canvas.putpalette(b"\xff\xff\xff" + color)
+        canvas.paste(image, (0, 0))
+        image = canvas
+
     buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
\ No newline at end of file
+    image.save(buffered, format="PNG", optimize=True)
+    return buffered.getvalue()
+
+
+def generate_identicon(text: str, size: int=128, block_size: int=16) -> bytes:
+    """
+    PNG identicon of `text`.
+    """
+    return _render_identicon(hashlib.md5(text.encode()).hexdigest(), size, block_size)
@@ -10,10 +10,20 @@ from app.api.repo.repo_service import RepositoryService
 from app.api.org.org_service import OrganizationService
 from app.api.repo.repo_dto import RepositoryCreateDTO
 from app.api.org.org_dto import OrganizationCreateDTO
+from app.api.repo.repo_search import init_postgres_search, uses_postgres_search
 
 def init_create_tables():
     SQLModel.metadata.create_all(engine)
 
+    # create_all() skips tables that already exist, so indexes added to
+    # existing tables later on have to be created separately.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    if uses_postgres_search(engine):
+        init_postgres_search(engine)
+
 def configure_cors(app: FastAPI):
     origins = [
         "http://localhost:5173",
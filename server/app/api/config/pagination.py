@@ -0,0 +1,34 @@
+# ----------------------------------------------
+# Opaque cursors for keyset pagination
+# ----------------------------------------------
+#
+# A cursor is the sort key of the last item of a page, e.g. `(last_updated, id)`,
+# encoded as URL-safe base64 JSON. Clients must treat it as an opaque string
+# and pass it back as-is to get the next page.
+
+import base64
+import binascii
+import json
+from typing import Any, List
+
+from app.api.config.exception_handler import UserException
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """
+    `values` must be JSON serializable.
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise UserException("Invalid cursor")
+
+    if not isinstance(values, list):
+        raise UserException("Invalid cursor")
+    return values
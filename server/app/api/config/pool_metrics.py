@@ -0,0 +1,106 @@
+# ----------------------------------------------
+# Connection pool instrumentation
+# ----------------------------------------------
+#
+# SQLAlchemy's QueuePool doesn't tell us how long requests wait for a
+# connection, which is exactly what we need to know to size the pool against
+# the number of workers. The pools below time every checkout and keep a
+# histogram of the wait times, see `pool_stats`.
+
+import threading
+import time
+from typing import List
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class WaitHistogram:
+    # Upper bounds of the buckets, in milliseconds. The last bucket is unbounded.
+    BUCKETS_MS: List[float] = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        index = len(self.BUCKETS_MS)
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if ms <= bound:
+                index = i
+                break
+
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            buckets = {f"le_{bound:g}ms": count for bound, count in zip(self.BUCKETS_MS, self.counts)}
+            buckets["le_inf"] = self.counts[-1]
+            return {
+                "count": self.total,
+                "sum_ms": round(self.sum_ms, 3),
+                "max_ms": round(self.max_ms, 3),
+                "timeouts": self.timeouts,
+                "buckets": buckets,
+            }
+
+
+class InstrumentedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_histogram = WaitHistogram()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_histogram.observe_timeout()
+            raise
+        self.wait_histogram.observe(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    ...
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    ...
+
+
+def pool_stats(engine: Engine) -> dict:
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # Negative while the pool hasn't opened `size` connections yet.
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    else:
+        stats["status"] = pool.status()
+
+    if isinstance(pool, InstrumentedPoolMixin):
+        stats["wait"] = pool.wait_histogram.snapshot()
+
+    return stats
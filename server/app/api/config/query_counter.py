@@ -0,0 +1,59 @@
+# ----------------------------------------------
+# Per-request SQL query counter
+# ----------------------------------------------
+#
+# With QUERY_COUNTER=1 (and always in tests), every response carries an
+# `X-Query-Count` header with the number of SQL statements executed while
+# handling the request. It makes N+1 query problems visible, and lets tests
+# assert that an endpoint costs a constant number of queries. It's off by
+# default, so production responses don't tell clients how the backend works.
+#
+# The counter lives in a context variable. Starlette copies the context into
+# the threadpool that runs sync endpoints, and since the counter is a mutable
+# object, increments made there are visible to the middleware.
+
+import os
+from contextvars import ContextVar
+from typing import List
+
+from fastapi import FastAPI, Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+if os.getenv('mocker_hub_TEST_ENV') is not None:
+    QUERY_COUNTER = True
+else:
+    QUERY_COUNTER = os.getenv('QUERY_COUNTER', '0') != '0'
+
+_query_count: ContextVar[List[int] | None] = ContextVar("query_count", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def current_query_count() -> int | None:
+    """
+    Returns the number of queries executed so far in the current request, or None outside of a request.
+    """
+    counter = _query_count.get()
+    return None if counter is None else counter[0]
+
+
+def register_query_counter(app: FastAPI):
+    if not QUERY_COUNTER:
+        return
+
+    @app.middleware("http")
+    async def count_queries(request: Request, call_next):
+        counter = [0]
+        token = _query_count.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            _query_count.reset(token)
+        response.headers["X-Query-Count"] = str(counter[0])
+        return response
@@ -0,0 +1,455 @@
+# ----------------------------------------------
+# Key-value caches for services
+# ----------------------------------------------
+#
+# See config/cache.py for how these are wired up and get_read_cache().
+#
+# - Values are bytes (usually a DTO's JSON) with an expiration time.
+# - Invalidation is done with version counters: a key embeds the current
+#   version of everything it depends on, e.g. `repos-of:7:v3`, and a write
+#   bumps the version (`bump_versions`) instead of hunting down every key.
+#   Old keys simply expire.
+# - Errors talking to Redis are treated as cache misses.
+# - `get_or_load` is the read-through way to use it: on a miss, only one
+#   request per worker (and optionally, with a Redis lock, one across all
+#   workers) loads the value, the others wait and share it. Values can also
+#   be served for a while after they're due for a refresh (stale-while-
+#   revalidate), while a single request refreshes them. Keys used with
+#   `get_or_load` must not be read with `get`, because of the envelope.
+#
+# There are three implementations besides the no-op `ReadCache`:
+#
+# RedisReadCache     Redis only.
+# MemoryReadCache    Process memory only. Used by the integration tests.
+# TwoTierReadCache   A small per-worker LRU with a short TTL in front of Redis,
+#                    so hot keys don't cost a network round trip. Deletes and
+#                    version bumps are broadcast over Redis pub/sub so that
+#                    other workers drop their local copies right away; the
+#                    short local TTL bounds staleness if a message is lost.
+#                    Plain writes aren't: keys embed versions, so a key that's
+#                    written again gets an equivalent value.
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import redis as redis_sync
+
+from app.api.config.single_flight import SingleFlight
+
+# One per worker, shared by all caches.
+_flights = SingleFlight()
+
+
+class ReadCache:
+    """
+    Does nothing. Used until `init_cache()` runs.
+    """
+    def get(self, key: str) -> bytes | None:
+        return None
+
+    def set(self, key: str, value: bytes, expire: int):
+        ...
+
+    def delete(self, *keys: str):
+        ...
+
+    def get_many(self, keys: List[str]) -> List[bytes | None]:
+        return [self.get(key) for key in keys]
+
+    def set_many(self, values: Dict[str, bytes], expire: int):
+        for key, value in values.items():
+            self.set(key, value, expire)
+
+    def get_versions(self, names: List[str]) -> Dict[str, int]:
+        return {name: 0 for name in names}
+
+    def bump_versions(self, names: Iterable[str]):
+        ...
+
+    def acquire_lock(self, key: str, ttl: float) -> str | None:
+        """
+        Returns a token for `release_lock`, or None if someone else holds the lock.
+        Locks are only needed across workers, within a worker `SingleFlight` takes care of it.
+        """
+        return "local"
+
+    def release_lock(self, key: str, token: str):
+        ...
+
+    LOCK_SECONDS = 5
+    LOCK_POLL_SECONDS = 0.05
+
+    def get_or_load(self, key: str, load: Callable[[], bytes | None], expire: int, stale: int = 0, lock: bool = False) -> bytes | None:
+        """
+        Returns the cached value of `key`, or calls `load` to get it and caches it for `expire` seconds.
+        If `load` returns None, nothing is cached. Exceptions of `load` are raised, and not cached.
+
+        - Concurrent misses within the worker call `load` only once.
+        - `lock`: concurrent misses across workers call `load` only once (as long as it takes less than `LOCK_SECONDS`
+          and returns a value; after a None, the waiting workers call `load` one at a time).
+        - `stale`: for this many seconds after expiring, the old value is still returned while one request refreshes it.
+        """
+        raw = self.get(key)
+        if raw is not None:
+            fresh_until, value = _unwrap(raw)
+            if time.time() < fresh_until:
+                return value
+
+            def refresh():
+                token = self.acquire_lock(key, self.LOCK_SECONDS) if lock else None
+                if lock and token is None:
+                    return None
+                try:
+                    return self._load_and_set(key, load, expire, stale)
+                finally:
+                    if token is not None:
+                        self.release_lock(key, token)
+
+            refreshed, called = _flights.do_unless_in_flight(key, refresh)
+            return refreshed if called and refreshed is not None else value
+
+        return _flights.do(key, lambda: self._load_on_miss(key, load, expire, stale, lock))[0]
+
+    def _load_on_miss(self, key: str, load: Callable[[], bytes | None], expire: int, stale: int, lock: bool) -> bytes | None:
+        if not lock:
+            return self._load_and_set(key, load, expire, stale)
+
+        token = self.acquire_lock(key, self.LOCK_SECONDS)
+        if token is None:
+            # Another worker is loading it, wait for it to show up. If the lock
+            # is released without a value (its `load` returned None), don't
+            # wait any longer and load it ourselves.
+            deadline = time.monotonic() + self.LOCK_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(self.LOCK_POLL_SECONDS)
+                token = self.acquire_lock(key, self.LOCK_SECONDS)
+                raw = self.get(key)
+                if raw is not None:
+                    if token is not None:
+                        self.release_lock(key, token)
+                    return _unwrap(raw)[1]
+                if token is not None:
+                    break
+            # Took too long, load it ourselves.
+
+        try:
+            return self._load_and_set(key, load, expire, stale)
+        finally:
+            if token is not None:
+                self.release_lock(key, token)
+
+    def _load_and_set(self, key: str, load: Callable[[], bytes | None], expire: int, stale: int) -> bytes | None:
+        value = load()
+        if value is not None:
+            self.set(key, _wrap(value, time.time() + expire), expire + stale)
+        return value
+
+
+def _wrap(value: bytes, fresh_until: float) -> bytes:
+    return f"{fresh_until:.3f}\n".encode() + value
+
+
+def _unwrap(raw: bytes) -> Tuple[float, bytes]:
+    fresh_until, _, value = raw.partition(b"\n")
+    return float(fresh_until), value
+
+
+class LocalLRU:
+    """
+    Thread-safe, bounded LRU map with a TTL per entry.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, Tuple[object, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_with_ttl(self, key: str) -> Tuple[float, object | None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return 0, None
+            value, expires_at = entry
+            ttl = expires_at - time.monotonic()
+            if ttl <= 0:
+                del self._entries[key]
+                return 0, None
+            self._entries.move_to_end(key)
+            return ttl, value
+
+    def set(self, key: str, value, ttl: float):
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> int:
+        count = 0
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    count += 1
+        return count
+
+    def delete_prefix(self, prefix: str) -> int:
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryReadCache(ReadCache):
+    def __init__(self, max_size: int):
+        self.local = LocalLRU(max_size)
+        # Versions must not be evicted: an evicted version would restart at 0
+        # and bring outdated keys back to life.
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        return self.local.get(key)
+
+    def set(self, key: str, value: bytes, expire: int):
+        self.local.set(key, value, expire)
+
+    def delete(self, *keys: str):
+        self.local.delete(*keys)
+
+    def get_versions(self, names: List[str]) -> Dict[str, int]:
+        with self._lock:
+            return {name: self._versions.get(name, 0) for name in names}
+
+    def bump_versions(self, names: Iterable[str]):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+
+class RedisReadCache(ReadCache):
+    def __init__(self, client: redis_sync.Redis, prefix: str):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self.client.get(f"{self.prefix}:{key}")
+        except redis_sync.RedisError:
+            return None
+
+    def set(self, key: str, value: bytes, expire: int):
+        try:
+            self.client.set(f"{self.prefix}:{key}", value, ex=expire)
+        except redis_sync.RedisError:
+            pass
+
+    def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            self.client.delete(*[f"{self.prefix}:{key}" for key in keys])
+        except redis_sync.RedisError:
+            pass
+
+    def get_many(self, keys: List[str]) -> List[bytes | None]:
+        if not keys:
+            return []
+        try:
+            return self.client.mget([f"{self.prefix}:{key}" for key in keys])
+        except redis_sync.RedisError:
+            return [None] * len(keys)
+
+    def set_many(self, values: Dict[str, bytes], expire: int):
+        if not values:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in values.items():
+                pipe.set(f"{self.prefix}:{key}", value, ex=expire)
+            pipe.execute()
+        except redis_sync.RedisError:
+            pass
+
+    def get_versions(self, names: List[str]) -> Dict[str, int]:
+        try:
+            values = self.client.mget([f"{self.prefix}:version:{name}" for name in names])
+        except redis_sync.RedisError:
+            values = [None] * len(names)
+        return {name: int(value or 0) for name, value in zip(names, values)}
+
+    def bump_versions(self, names: Iterable[str]):
+        names = list(names)
+        if not names:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for name in names:
+                pipe.incr(f"{self.prefix}:version:{name}")
+            pipe.execute()
+        except redis_sync.RedisError:
+            pass
+
+    _RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def acquire_lock(self, key: str, ttl: float) -> str | None:
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.client.set(f"{self.prefix}:lock:{key}", token, nx=True, px=int(ttl * 1000))
+        except redis_sync.RedisError:
+            # Better to load the value in every worker than in none.
+            return token
+        return token if acquired else None
+
+    def release_lock(self, key: str, token: str):
+        try:
+            self.client.eval(self._RELEASE_LOCK, 1, f"{self.prefix}:lock:{key}", token)
+        except redis_sync.RedisError:
+            pass
+
+
+class InvalidationBus:
+    """
+    Broadcasts "drop these local keys" to every worker over Redis pub/sub.
+    Every worker subscribes in a background thread and applies the messages to its `LocalLRU`.
+    A worker applies its own messages when it publishes them, and skips them when they come back.
+    """
+    CHANNEL = "mocker-hub:cache-invalidation"
+
+    def __init__(self, client: redis_sync.Redis, local: LocalLRU):
+        self.client = client
+        self.local = local
+        self.origin = uuid.uuid4().hex
+
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.CHANNEL: self._on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._on_error)
+
+    def publish(self, keys: List[str] | None = None, prefixes: List[str] | None = None):
+        keys = keys or []
+        prefixes = prefixes or []
+        self._apply(keys, prefixes)
+        try:
+            self.client.publish(self.CHANNEL, json.dumps({"origin": self.origin, "keys": keys, "prefixes": prefixes}))
+        except redis_sync.RedisError:
+            pass
+
+    def stop(self):
+        self._thread.stop()
+
+    def _on_message(self, message):
+        try:
+            payload = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        if payload.get("origin") == self.origin:
+            return
+        self._apply(payload.get("keys", []), payload.get("prefixes", []))
+
+    def _on_error(self, e: Exception, pubsub, thread):
+        # Keep listening. Until we're reconnected, local entries go stale for at most their TTL.
+        print(f"[!] Cache invalidation listener: {e}")
+        time.sleep(1)
+
+    def _apply(self, keys: List[str], prefixes: List[str]):
+        self.local.delete(*keys)
+        for prefix in prefixes:
+            self.local.delete_prefix(prefix)
+
+
+class TwoTierReadCache(ReadCache):
+    def __init__(self, remote: RedisReadCache, local: LocalLRU, bus: InvalidationBus, local_ttl: float):
+        self.remote = remote
+        self.local = local
+        self.bus = bus
+        self.local_ttl = local_ttl
+
+    def _local_key(self, key: str) -> str:
+        return f"{self.remote.prefix}:{key}"
+
+    def get(self, key: str) -> bytes | None:
+        value = self.local.get(self._local_key(key))
+        if value is not None:
+            return value
+
+        value = self.remote.get(key)
+        if value is not None:
+            self.local.set(self._local_key(key), value, self.local_ttl)
+        return value
+
+    def set(self, key: str, value: bytes, expire: int):
+        self.remote.set(key, value, expire)
+        self.local.set(self._local_key(key), value, min(self.local_ttl, expire))
+
+    def delete(self, *keys: str):
+        self.remote.delete(*keys)
+        self.bus.publish(keys=[self._local_key(key) for key in keys])
+
+    def get_many(self, keys: List[str]) -> List[bytes | None]:
+        values = [self.local.get(self._local_key(key)) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            for i, value in zip(missing, self.remote.get_many([keys[i] for i in missing])):
+                if value is not None:
+                    self.local.set(self._local_key(keys[i]), value, self.local_ttl)
+                    values[i] = value
+        return values
+
+    def set_many(self, values: Dict[str, bytes], expire: int):
+        self.remote.set_many(values, expire)
+        for key, value in values.items():
+            self.local.set(self._local_key(key), value, min(self.local_ttl, expire))
+
+    def get_versions(self, names: List[str]) -> Dict[str, int]:
+        result = {}
+        missing = []
+        for name in names:
+            version = self.local.get(self._local_key(f"version:{name}"))
+            if version is None:
+                missing.append(name)
+            else:
+                result[name] = version
+
+        if missing:
+            for name, version in self.remote.get_versions(missing).items():
+                self.local.set(self._local_key(f"version:{name}"), version, self.local_ttl)
+                result[name] = version
+
+        return result
+
+    def bump_versions(self, names: Iterable[str]):
+        names = list(names)
+        if not names:
+            return
+        self.remote.bump_versions(names)
+        self.bus.publish(keys=[self._local_key(f"version:{name}") for name in names])
+
+    def acquire_lock(self, key: str, ttl: float) -> str | None:
+        return self.remote.acquire_lock(key, ttl)
+
+    def release_lock(self, key: str, token: str):
+        self.remote.release_lock(key, token)
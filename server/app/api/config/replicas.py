@@ -0,0 +1,218 @@
+# ----------------------------------------------
+# Routing of read-only sessions to read replicas
+# ----------------------------------------------
+#
+# Read-only endpoints get their session from `get_read_database`, which asks
+# `read_router` which engine to use:
+#
+# - Without replicas, everything goes to the primary.
+# - Otherwise, replicas are used round-robin.
+# - Replicas lag behind the primary. A user who has just written something
+#   would not see it on a replica, so for `sticky_seconds` after a write
+#   (see `mark_write`) that user's reads go to the primary too.
+#
+# Stickiness is tracked per worker process, which is fine as long as the load
+# balancer doesn't hop between workers within a few seconds more often than not.
+#
+# Cache fills are the exception: they're stored under the versions bumped by
+# the write (see repo/repo_cache.py), so a fill read from a lagging replica
+# would keep serving the old data to everyone until it expires. Loads wrapped
+# in `from_primary` run the queries of read sessions on the primary:
+#
+#   get_read_cache().get_or_load(key, from_primary(load), ...)
+#
+# With DATABASE_ASYNC (see config/database.py), async read endpoints get an
+# `AsyncSession` from `get_async_read_database`, routed the same way: the same
+# replica index, the same stickiness, and `from_primary` works for them too.
+# The read cache is synchronous, so it's called from the thread pool, with
+# async loads wrapped in `blocking`:
+#
+#   await run_in_threadpool(get_read_cache().get_or_load, key, from_primary(blocking(load)), ...)
+
+import itertools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Awaitable, Callable, Dict, List, TypeVar
+
+import anyio.from_thread
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import Session as SQLModelSession
+
+from app.api.config.auth import ClaimsDepOptional
+from app.api.config.database import SessionLocal, async_engine, async_replica_engines, engine, replica_engines
+
+T = TypeVar("T")
+
+_on_primary: ContextVar[bool] = ContextVar("read_on_primary", default=False)
+
+
+class ReadRouter:
+    def __init__(self, primary: Engine, replicas: List[Engine], sticky_seconds: float):
+        self.primary = primary
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+
+        self._next_replica = itertools.count()
+        self._recent_writes: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def mark_write(self, user_id: int | None):
+        """
+        Call after `user_id` committed a write, so that their reads stay on the primary for a while.
+        """
+        if user_id is None or not self.replicas:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._recent_writes[user_id] = now + self.sticky_seconds
+
+            # Don't let the map grow forever.
+            if len(self._recent_writes) > 10_000:
+                self._recent_writes = {k: v for k, v in self._recent_writes.items() if v > now}
+
+    def is_sticky(self, user_id: int | None) -> bool:
+        if user_id is None:
+            return False
+        with self._lock:
+            until = self._recent_writes.get(user_id)
+        return until is not None and until > time.monotonic()
+
+    def replica_index_for(self, user_id: int | None) -> int | None:
+        """
+        Index in `replicas` of the replica to read from, None for the primary.
+        """
+        if not self.replicas or self.is_sticky(user_id):
+            return None
+        return next(self._next_replica) % len(self.replicas)
+
+    def engine_for(self, user_id: int | None) -> Engine:
+        index = self.replica_index_for(user_id)
+        return self.primary if index is None else self.replicas[index]
+
+
+read_router = ReadRouter(
+    primary=engine,
+    replicas=replica_engines,
+    sticky_seconds=float(os.getenv('POSTGRES_REPLICA_STICKY_SECONDS', 5)),
+)
+
+
+class ReadSession(SQLModelSession):
+    """
+    Session bound to the engine picked by `read_router`, except within `from_primary`.
+    """
+    def get_bind(self, mapper=None, **kwargs):
+        if _on_primary.get():
+            return self.primary()
+        return super().get_bind(mapper, **kwargs)
+
+    def primary(self) -> Engine:
+        return read_router.primary
+
+
+ReadSessionLocal = sessionmaker(**{**SessionLocal.kw, "class_": ReadSession})
+
+
+def read_session(user_id: int | None) -> ReadSession:
+    """
+    New read-only session for `user_id` (None if signed out). Never write through it.
+    """
+    return ReadSessionLocal(bind=read_router.engine_for(user_id))
+
+
+def from_primary(load: Callable[[], T]) -> Callable[[], T]:
+    """
+    Wraps a cache fill, so that the read sessions it uses query the primary.
+    """
+    @wraps(load)
+    def load_from_primary() -> T:
+        token = _on_primary.set(True)
+        try:
+            return load()
+        finally:
+            _on_primary.reset(token)
+    return load_from_primary
+
+
+def get_read_database(claims: ClaimsDepOptional):
+    """
+    Session for read-only endpoints. It may be bound to a read replica, so never write through it.
+    The viewer comes from the same `ClaimsDepOptional` as the endpoint's, so the token is decoded once.
+    """
+    db = read_session(None if claims is None else claims.id)
+    try:
+        yield db
+    except:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class _AsyncReadSyncSession(ReadSession):
+    """
+    What the `AsyncSession`s of `async_read_session` run on.
+    """
+    def primary(self) -> Engine:
+        return async_engine.sync_engine
+
+
+AsyncReadSessionLocal = None
+
+if async_engine is not None:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    AsyncReadSessionLocal = async_sessionmaker(
+        class_=AsyncSession,
+        sync_session_class=_AsyncReadSyncSession,
+        autoflush=False,
+
+        # Unlike the sync session, attributes can't be lazily re-loaded after a
+        # commit (that would be implicit IO), so don't expire them.
+        expire_on_commit=False,
+    )
+
+
+def async_read_session(user_id: int | None):
+    """
+    Async counterpart of `read_session`. Requires DATABASE_ASYNC.
+    """
+    if AsyncReadSessionLocal is None:
+        raise RuntimeError("Async database support is disabled. Set the DATABASE_ASYNC environment variable.")
+
+    index = read_router.replica_index_for(user_id)
+    return AsyncReadSessionLocal(bind=async_engine if index is None else async_replica_engines[index])
+
+
+def blocking(load: Callable[..., Awaitable[T]]) -> Callable[..., T]:
+    """
+    Wraps an async load for the read cache, which must be called from the thread pool
+    (`run_in_threadpool`). The load itself runs back on the event loop.
+    """
+    @wraps(load)
+    def load_on_event_loop(*args) -> T:
+        return anyio.from_thread.run(load, *args)
+    return load_on_event_loop
+
+
+async def get_async_read_database(claims: ClaimsDepOptional):
+    """
+    Async counterpart of `get_read_database`.
+
+    Objects loaded through an async session cannot lazy-load relationships,
+    so async repositories must load everything the caller needs up front.
+    """
+    db = async_read_session(None if claims is None else claims.id)
+    try:
+        yield db
+    except:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
@@ -1,10 +1,86 @@
+import os
+import threading
+import anyio.to_thread
 import bcrypt
+from app.api.config.exception_handler import ServiceUnavailableException
 
-def hash_password(password_plaintext: str) -> str:
+# bcrypt is slow on purpose (hundreds of milliseconds per call). Our endpoints
+# are sync, so a password operation holds one of the threads of AnyIO's pool,
+# which all sync endpoints share (40 threads by default), for its whole
+# duration. A burst of logins would take all of them and starve everything else.
+#
+# So at most `workers` operations run at a time, and at most `max_queue` more
+# wait for their turn; anything above that fails fast with a 503 instead of
+# piling up. bcrypt runs in the request's own thread (it releases the GIL),
+# so password endpoints hold at most `workers + max_queue` threads of the
+# pool: 8 by default, which leaves 32 for all other requests. Keep it well
+# below the size of the pool, see `check_password_thread_budget`.
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.rejected = 0
+
+        self._running = threading.Semaphore(workers)
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ServiceUnavailableException("Too many password operations in progress, try again later")
+
+        with self._lock:
+            self.in_flight += 1
+        try:
+            with self._running:
+                return fn(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.workers),
+                "rejected": self.rejected,
+            }
+
+
+password_hasher = PasswordHasher(
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', 4)),
+    max_queue=int(os.getenv('PASSWORD_HASH_QUEUE', 4)),
+)
+
+
+def check_password_thread_budget():
+    """
+    Call on startup, from the event loop. Warns if password endpoints may hold more than a quarter of the threads of sync endpoints.
+    """
+    total = anyio.to_thread.current_default_thread_limiter().total_tokens
+    held = password_hasher.workers + password_hasher.max_queue
+    if held > total // 4:
+        print(f"[!] Password operations may hold {held} of the {total} threads of sync endpoints, lower PASSWORD_HASH_WORKERS or PASSWORD_HASH_QUEUE")
+
+
+def _hash_password(password_plaintext: str) -> str:
     pw = str.encode(password_plaintext)
     return bytes.decode(bcrypt.hashpw(pw, bcrypt.gensalt()))
 
-def verify_password(password_plaintext: str, password_hashed: str) -> bool:
+def _verify_password(password_plaintext: str, password_hashed: str) -> bool:
     pw_1 = str.encode(password_plaintext)
     pw_2 = str.encode(password_hashed)
-    return bcrypt.checkpw(pw_1, pw_2)
\ No newline at end of file
+    return bcrypt.checkpw(pw_1, pw_2)
+
+def hash_password(password_plaintext: str) -> str:
+    return password_hasher.run(_hash_password, password_plaintext)
+
+def verify_password(password_plaintext: str, password_hashed: str) -> bool:
+    return password_hasher.run(_verify_password, password_plaintext, password_hashed)
@@ -0,0 +1,76 @@
+# ----------------------------------------------
+# Request coalescing
+# ----------------------------------------------
+#
+# When a hot key falls out of the cache, every request that wants it at that
+# moment would go to the database. `SingleFlight` makes sure that only one of
+# them (per worker) does the work, and that the others wait for and share its
+# result, or its exception.
+#
+# See `ReadCache.get_or_load` for how it's combined with caching.
+
+import threading
+from typing import Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Calls `fn` unless a call for `key` is already in flight, in which case its outcome is shared.
+        Returns the result and whether it was shared.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._run(key, call, fn)
+        return call.result, False
+
+    def do_unless_in_flight(self, key: str, fn: Callable[[], T]) -> Tuple[T | None, bool]:
+        """
+        Calls `fn` unless a call for `key` is already in flight, in which case nothing happens.
+        Returns the result and whether `fn` was called.
+        """
+        with self._lock:
+            if key in self._calls:
+                return None, False
+            call = self._calls[key] = _Call()
+
+        self._run(key, call, fn)
+        return call.result, True
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def _run(self, key: str, call: _Call, fn: Callable[[], T]):
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,104 @@
+# ----------------------------------------------
+# Cache of already verified JWTs
+# ----------------------------------------------
+#
+# Clients send the same bearer token over and over again, and checking the
+# HMAC signature + parsing the payload every time is wasted work. This cache
+# remembers the claims of tokens that have already been verified.
+#
+# - Keys are SHA-256 digests of the token, so the raw tokens aren't kept around.
+# - The cache is a bounded LRU. Entries also expire after `ttl` seconds, or
+#   earlier if the token itself has an `exp` claim.
+#
+# The cache doesn't change which tokens are accepted: a cached token is one
+# that would verify again. Tokens are signed without `exp` (see `sign_jwt`)
+# and aren't revoked, so they stay valid after a password change, whether
+# they're cached or not. Revoking them would need a per-user check on every
+# request, e.g. a token version stored with the user.
+#
+# The cache is per-process and guarded by a lock, since sync endpoints run in
+# a threadpool.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Tuple
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[bytes, Tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Any | None:
+        """
+        Returns the cached claims of `token` or None if it's not cached (or expired).
+        """
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            claims, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: Any, exp: float | None = None):
+        """
+        `exp` is the token's own expiration time as a UNIX timestamp, if any.
+        """
+        if self.max_size <= 0:
+            return
+
+        ttl = self.ttl
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+            if ttl <= 0:
+                return
+
+        key = self._key(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (claims, time.monotonic() + ttl)
+
+            while len(self._entries) > self.max_size:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, key: bytes):
+        # Caller must hold the lock.
+        del self._entries[key]
@@ -0,0 +1,24 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel
+
+# All times here are naive UTC.
+
+
+class StoredImage(SQLModel, table=True):
+    """
+    A file of the content-addressed image store (see image_store.py) and how
+    many rows (e.g. `Organization.image`) refer to it.
+    """
+    __tablename__ = "stored_image"
+
+    digest: str = Field(primary_key=True, max_length=64)
+    """
+    SHA-256 of the file, in hex.
+    """
+    ext: str = Field()
+    size: int = Field()
+    refcount: int = Field(default=0, index=True)
+    updated_at: datetime = Field()
+    """
+    Last time `refcount` changed. Unreferenced images are deleted some time after that.
+    """
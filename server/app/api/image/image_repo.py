@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import List
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+from app.api.image.image_model import StoredImage
+
+# NOTE: Nothing here commits. References are added and released in the
+# transaction of whatever refers to the image, e.g. creating an organization.
+
+class ImageRepo:
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add_ref(self, digest: str, ext: str, size: int, now: datetime):
+        """
+        Creates the image with one reference, or adds one. Locks its row until the end of the transaction.
+        """
+        table = StoredImage.__table__
+        dialect = postgresql if self.session.get_bind().dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(table).values(digest=digest, ext=ext, size=size, refcount=1, updated_at=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.digest],
+            set_={"refcount": table.c.refcount + 1, "updated_at": now},
+        )
+        self.session.connection().execute(statement)
+
+    def release_ref(self, digest: str, now: datetime):
+        self.session.exec(
+            update(StoredImage)
+            .where(StoredImage.digest == digest)
+            .where(StoredImage.refcount > 0)
+            .values(refcount=StoredImage.refcount - 1, updated_at=now)
+        )
+
+    def find(self, digest: str) -> StoredImage | None:
+        return self.session.get(StoredImage, digest)
+
+    def lock_garbage(self, unused_since: datetime, limit: int) -> List[StoredImage]:
+        """
+        Images without references since before `unused_since`. Their rows stay
+        locked until the end of the transaction, so no one can add a reference
+        to them in the meantime. Rows locked by someone else are skipped.
+        """
+        query = (
+            select(StoredImage)
+            .where(StoredImage.refcount == 0)
+            .where(StoredImage.updated_at < unused_since)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return self.session.exec(query).all()
+
+    def delete(self, digests: List[str]):
+        if digests:
+            self.session.exec(delete(StoredImage).where(StoredImage.digest.in_(digests)))
@@ -0,0 +1,155 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+from sqlmodel import Session
+from app.api.config.database import SessionLocal
+from app.api.config.exception_handler import UserException
+from app.api.config.images import detect_image_format
+from app.api.image.image_repo import ImageRepo
+from app.api.image.image_thumbnails import ThumbnailWorker, thumbnail_worker
+from app.api.image.image_upload import ImageUpload
+from app.api.image.image_store import IMAGES_GARBAGE_BATCH, IMAGES_GARBAGE_GRACE_SECONDS, IMAGES_GARBAGE_SECONDS, ImageStore, digest_of, image_key, image_store
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ImageService:
+    """
+    Adds and releases references to images of the store (see image_store.py).
+    Nothing is committed: references are part of the caller's transaction.
+    """
+    def __init__(self, session: Session, store: ImageStore = image_store, thumbnails: ThumbnailWorker = thumbnail_worker):
+        self.session = session
+        self.store = store
+        self.thumbnails = thumbnails
+        self.image_repo = ImageRepo(session)
+
+    def add(self, data: bytes) -> str:
+        """
+        Stores the image (unless it's there already) and returns its key. Raises `UserException` if it's not an image.
+        Its thumbnails are made in the background.
+        """
+        ext = detect_image_format(data)
+        if ext is None:
+            raise UserException("Unsupported image format, use PNG, JPEG, GIF or WebP")
+
+        digest = digest_of(data)
+        key = image_key(digest, ext)
+
+        # The row stays locked until the caller commits, so garbage collection
+        # can't delete the file between here and then.
+        self.image_repo.add_ref(digest, ext, len(data), _utcnow())
+        self.store.write(key, data)
+        self.thumbnails.submit(key)
+        return key
+
+    def add_upload(self, upload: ImageUpload) -> str:
+        """
+        Same as `add`, for an image received with `receive_image`, except that the file
+        isn't stored yet: call `store_upload` once the caller has committed.
+        """
+        self.image_repo.add_ref(upload.digest, upload.ext, upload.size, _utcnow())
+        return image_key(upload.digest, upload.ext)
+
+    def store_upload(self, upload: ImageUpload):
+        """
+        Moves an image added with `add_upload` into the store. If the transaction failed
+        instead, the file is never moved and goes away with the upload.
+        The committed reference keeps garbage collection away from it.
+        """
+        key = image_key(upload.digest, upload.ext)
+        self.store.move_in(key, upload.path)
+        self.thumbnails.submit(key)
+
+    def release(self, key: str):
+        """
+        Call when something stops referring to the image with `key`.
+        """
+        digest = key.rsplit("/", 1)[-1].split(".", 1)[0]
+        self.image_repo.release_ref(digest, _utcnow())
+
+    def collect_garbage(self, grace_seconds: float = IMAGES_GARBAGE_GRACE_SECONDS, limit: int = 1000) -> int:
+        """
+        Deletes images which haven't been referred to for `grace_seconds`, and commits. Returns how many were deleted.
+        """
+        garbage = self.image_repo.lock_garbage(_utcnow() - timedelta(seconds=grace_seconds), limit)
+        # Deleted while the rows are still locked: a new reference would wait,
+        # then find no row and write the file again.
+        for image in garbage:
+            self.store.delete(image_key(image.digest, image.ext))
+        self.image_repo.delete([image.digest for image in garbage])
+        self.session.commit()
+        return len(garbage)
+
+
+class ImageGarbageCollector:
+    """
+    Deletes unused images in the background: on start, then every `interval` seconds.
+    """
+    def __init__(self, session_factory: Callable[[], Session], interval: float, batch_size: int,
+                 store: ImageStore = image_store, thumbnails: ThumbnailWorker = thumbnail_worker):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.store = store
+        self.thumbnails = thumbnails
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.runs = 0
+        self.failures = 0
+        self.deleted = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="image-garbage-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.collect()
+            if self._stop.wait(self.interval):
+                return
+
+    def collect(self, grace_seconds: float = IMAGES_GARBAGE_GRACE_SECONDS) -> int:
+        """
+        Deletes batches of unused images until there are none left. Returns how many were deleted.
+        """
+        deleted = 0
+        try:
+            with self.session_factory() as session:
+                service = ImageService(session, self.store, self.thumbnails)
+                while not self._stop.is_set():
+                    count = service.collect_garbage(grace_seconds, self.batch_size)
+                    deleted += count
+                    # A short batch means nothing's left, apart from rows someone else has locked.
+                    if count < self.batch_size:
+                        break
+        except Exception as e:
+            print(f"[!] Deleting unused images failed: {e}")
+            self.failures += 1
+
+        self.runs += 1
+        self.deleted += deleted
+        return deleted
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "deleted": self.deleted,
+        }
+
+
+image_garbage_collector = ImageGarbageCollector(SessionLocal, IMAGES_GARBAGE_SECONDS, IMAGES_GARBAGE_BATCH)
@@ -0,0 +1,103 @@
+# ----------------------------------------------
+# Content-addressed image store
+# ----------------------------------------------
+#
+# Every image is stored once, under the SHA-256 of its bytes:
+#
+#   images/ab/cd/abcd1234...(64 hex digits).png
+#
+# The first two pairs of hex digits are directories, so that no directory ends
+# up with more than a few thousand files. `Organization.image` holds the path
+# relative to `images/` (the "key"), which nginx serves as `/img/{key}`.
+#
+# - The same image uploaded twice is the same file, written once.
+# - A file never changes, so nginx tells browsers to cache it forever.
+# - Renaming an organization doesn't touch its image.
+#
+# `StoredImage` rows count the references to every file (see ImageService).
+# Files without references are deleted IMAGES_GARBAGE_GRACE_SECONDS after
+# their last reference went away, by `ImageService.collect_garbage`, which
+# `ImageGarbageCollector` runs every IMAGES_GARBAGE_SECONDS.
+#
+# Thumbnails are stored next to the images, see image_thumbnails.py.
+#
+# Older images (`org-{name}.png`) are plain files in `images/` and keep working.
+
+import glob
+import hashlib
+import os
+import tempfile
+
+
+def image_key(digest: str, ext: str) -> str:
+    return f"{digest[0:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+class ImageStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_of(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path_of(key))
+
+    def write(self, key: str, data: bytes):
+        """
+        Writes the file unless it's already there. Readers never see a partially written file.
+        """
+        path = self.path_of(key)
+        if os.path.exists(path):
+            return
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def move_in(self, key: str, path: str):
+        """
+        Moves the file at `path`, which must be on the same file system (see `ImageUpload`), to `key`.
+        Does nothing if there's a file with `key` already.
+        """
+        dest = self.path_of(key)
+        if os.path.exists(dest):
+            return
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(path, dest)
+
+    def delete(self, key: str):
+        """
+        Deletes the file with `key`, and its thumbnails (`{key}.*`, see image_thumbnails.py).
+        """
+        path = self.path_of(key)
+        for file in [path, *glob.glob(glob.escape(path) + ".*")]:
+            try:
+                os.unlink(file)
+            except FileNotFoundError:
+                pass
+
+
+def digest_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+if os.getenv('mocker_hub_TEST_ENV') is not None:
+    # Tests write images too, but not next to the real ones.
+    IMAGES_DIR = tempfile.mkdtemp(prefix="mocker-hub-images-")
+else:
+    IMAGES_DIR = os.getenv('IMAGES_DIR', './images')
+
+IMAGES_GARBAGE_GRACE_SECONDS = float(os.getenv('IMAGES_GARBAGE_GRACE_SECONDS', '3600'))
+IMAGES_GARBAGE_SECONDS = float(os.getenv('IMAGES_GARBAGE_SECONDS', '600'))
+IMAGES_GARBAGE_BATCH = int(os.getenv('IMAGES_GARBAGE_BATCH', '1000'))
+
+image_store = ImageStore(IMAGES_DIR)
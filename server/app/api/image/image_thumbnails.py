@@ -0,0 +1,185 @@
+# ----------------------------------------------
+# Thumbnails
+# ----------------------------------------------
+#
+# The UI shows images at a few small sizes, so every image of the store gets
+# a thumbnail for each of IMAGES_THUMBNAIL_SIZES, next to the original:
+#
+#   images/ab/cd/abcd1234....png            the original (see image_store.py)
+#   images/ab/cd/abcd1234....png.32.webp    fits in 32x32
+#   images/ab/cd/abcd1234....png.64.webp    fits in 64x64
+#
+# Thumbnails are never bigger than the original, and keep its aspect ratio.
+# They're WebP (or PNG, if Pillow was built without WebP support).
+# Images of more than IMAGES_THUMBNAIL_MAX_PIXELS pixels get none: a few MB of
+# PNG can decode to GBs of memory, so their size is checked before decoding.
+#
+# `thumbnail_worker` makes them in background threads (IMAGES_THUMBNAIL_WORKERS),
+# after `ImageService` stores an image. Until they exist, their URLs are 404
+# and clients show the original instead. On startup, the worker also makes
+# the ones that are missing, e.g. for images stored before this existed, or
+# for newly configured sizes.
+#
+# Keys of the thumbnails are derived from the key of the image, so DTOs list
+# them (`thumbnail_keys`) without asking the database or the file system.
+# They're deleted together with the image (`ImageStore.delete`).
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List
+
+from PIL import Image, features
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.api.image.image_model import StoredImage
+from app.api.image.image_store import ImageStore, image_key, image_store
+
+IMAGES_THUMBNAIL_SIZES = [int(size) for size in os.getenv('IMAGES_THUMBNAIL_SIZES', '32,64,128').split(",") if size.strip()]
+
+if os.getenv('mocker_hub_TEST_ENV') is not None:
+    # Made right away, so that tests can check them.
+    IMAGES_THUMBNAIL_WORKERS = 0
+else:
+    IMAGES_THUMBNAIL_WORKERS = int(os.getenv('IMAGES_THUMBNAIL_WORKERS', '2'))
+
+# 4096 x 4096, well below Pillow's own limit (`Image.MAX_IMAGE_PIXELS`).
+IMAGES_THUMBNAIL_MAX_PIXELS = int(os.getenv('IMAGES_THUMBNAIL_MAX_PIXELS', str(4096 * 4096)))
+
+THUMBNAIL_FORMAT = "webp" if features.check("webp") else "png"
+
+
+def thumbnail_key(key: str, size: int) -> str:
+    return f"{key}.{size}.{THUMBNAIL_FORMAT}"
+
+
+def thumbnail_keys(key: str) -> Dict[int, str]:
+    """
+    Keys of the thumbnails of the image with `key`, by size. Empty for older images, which aren't in the store.
+    """
+    if "/" not in key:
+        return {}
+    return {size: thumbnail_key(key, size) for size in IMAGES_THUMBNAIL_SIZES}
+
+
+def make_thumbnails(store: ImageStore, key: str, sizes: List[int]) -> int:
+    """
+    Writes the thumbnails of the image with `key` which don't exist yet. Returns how many were written.
+    """
+    missing = [size for size in sizes if not store.exists(thumbnail_key(key, size))]
+    if not missing:
+        return 0
+
+    try:
+        with Image.open(store.path_of(key)) as original:
+            # Known from the header, before anything is decoded.
+            width, height = original.size
+            if width * height > IMAGES_THUMBNAIL_MAX_PIXELS:
+                print(f"[!] Not making thumbnails of image '{key}': {width}x{height} is too big")
+                return 0
+
+            # The first frame of animated images.
+            original.seek(0)
+            if original.mode in ("1", "P"):
+                # Palettes can only be resized nearest-neighbour.
+                original = original.convert("RGBA")
+            # Scaled down before anything else. JPEGs are even decoded at a
+            # fraction of their size (see `Image.draft`), which `thumbnail` asks for.
+            original.thumbnail((max(missing), max(missing)), Image.LANCZOS)
+            original = original.convert("RGBA")
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        print(f"[!] Not making thumbnails of image '{key}': {e}")
+        return 0
+
+    # Biggest first: each one is scaled down from the previous one, which is
+    # cheaper than from the original.
+    image = original
+    for size in sorted(missing, reverse=True):
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        buffered = BytesIO()
+        if THUMBNAIL_FORMAT == "webp":
+            image.save(buffered, format="WEBP", quality=85, method=4)
+        else:
+            image.save(buffered, format="PNG", optimize=True)
+        store.write(thumbnail_key(key, size), buffered.getvalue())
+
+    return len(missing)
+
+
+class ThumbnailWorker:
+    def __init__(self, store: ImageStore, sizes: List[int], workers: int):
+        self.store = store
+        self.sizes = sizes
+        self.workers = workers
+
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: set[str] = set()
+        """
+        Keys which are queued, so that an image uploaded many times at once is only done once.
+        """
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        if self._executor is None and self.workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnails")
+
+    def stop(self):
+        """
+        Waits for the thumbnails which are being made, drops the rest. Whatever is missing is made on the next startup.
+        """
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._pending.clear()
+
+    def submit(self, key: str):
+        """
+        Makes the thumbnails of the image with `key`, in the background if the worker is started.
+        """
+        if self.workers == 0:
+            self._make(key)
+            return
+
+        with self._lock:
+            if self._executor is None or key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._run, key)
+
+    def submit_missing(self, engine: Engine):
+        """
+        Makes the thumbnails of all referenced images which are missing some, in the background.
+        """
+        if self._executor is None:
+            self._make_missing(engine)
+        else:
+            self._executor.submit(self._make_missing, engine)
+
+    def _run(self, key: str):
+        with self._lock:
+            self._pending.discard(key)
+        self._make(key)
+
+    def _make(self, key: str):
+        try:
+            make_thumbnails(self.store, key, self.sizes)
+        except Exception as e:
+            print(f"[!] Making thumbnails of image '{key}' failed: {e}")
+
+    def _make_missing(self, engine: Engine):
+        query = select(StoredImage.digest, StoredImage.ext).where(StoredImage.refcount > 0)
+        with Session(engine) as session:
+            for row in session.exec(query.execution_options(yield_per=1000)):
+                if self._stop.is_set():
+                    return
+                self._make(image_key(row.digest, row.ext))
+
+
+thumbnail_worker = ThumbnailWorker(image_store, IMAGES_THUMBNAIL_SIZES, IMAGES_THUMBNAIL_WORKERS)
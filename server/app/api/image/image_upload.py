@@ -0,0 +1,215 @@
+# ----------------------------------------------
+# Receiving images
+# ----------------------------------------------
+#
+# Images used to arrive base64-encoded inside JSON: a third bigger, held in
+# memory as one string by pydantic, then decoded into another copy.
+#
+# `receive_image(request)` reads the body of an upload as it arrives, either
+# `multipart/form-data` with the image in a file field, or the bare image
+# (any other content type). Every chunk is:
+#   - counted: past IMAGES_MAX_UPLOAD_BYTES the upload stops with a 413, and
+#     a `Content-Length` that's too big is refused before reading anything,
+#   - checked: the first bytes must be a PNG, JPEG, GIF or WebP,
+#   - hashed, so the key in the image store is known at the end,
+#   - written to a temporary file next to the image store, which
+#     `ImageService.store_upload` then moves into place.
+# So an upload holds a chunk in memory at a time, whatever the size of the image.
+# Hashing and writing happen in the thread pool, not on the event loop.
+#
+#   with await receive_image(request) as upload:
+#       org = await run_in_threadpool(org_service.set_image, user_id, org_id, upload)
+#
+# where `set_image` adds a reference with `ImageService.add_upload`, commits,
+# then moves the file in with `ImageService.store_upload`.
+# The temporary file is deleted when the `with` block ends, unless it was moved.
+
+import hashlib
+import os
+import tempfile
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.api.config.exception_handler import PayloadTooLargeException, UserException
+from app.api.config.images import detect_image_format
+from app.api.image.image_store import ImageStore, image_store
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:
+    # Older versions of python-multipart.
+    import multipart
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import parse_options_header
+
+IMAGES_MAX_UPLOAD_BYTES = int(os.getenv('IMAGES_MAX_UPLOAD_BYTES', str(5 * 1024 * 1024)))
+
+# Room for the boundaries, headers and other fields of a multipart body.
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+# Enough to tell the formats apart, see `detect_image_format`.
+_HEAD_SIZE = 12
+
+
+class ImageUpload:
+    """
+    An image being written to a temporary file as it arrives, hashed and checked on the way.
+    """
+    def __init__(self, store: ImageStore, max_size: int):
+        os.makedirs(store.root, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=store.root, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self._head = b""
+
+        self.max_size = max_size
+        self.size = 0
+        self.ext: str | None = None
+        self.digest: str | None = None
+        """
+        SHA-256 of the image, once `finish` is called.
+        """
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise PayloadTooLargeException(f"Image must not be bigger than {self.max_size} bytes")
+
+        if self.ext is None:
+            self._head += chunk[:_HEAD_SIZE - len(self._head)]
+            if len(self._head) == _HEAD_SIZE:
+                self._check_format()
+
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self):
+        if self.ext is None:
+            # Shorter than `_HEAD_SIZE`.
+            self._check_format()
+        self._file.close()
+        self.digest = self._hash.hexdigest()
+
+    def _check_format(self):
+        self.ext = detect_image_format(self._head)
+        if self.ext is None:
+            raise UserException("Unsupported image format, use PNG, JPEG, GIF or WebP")
+
+    def __enter__(self) -> "ImageUpload":
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _ImagePart:
+    """
+    `MultipartParser` callbacks which send the file field `field` to `upload`, and skip other fields.
+    """
+    def __init__(self, upload: ImageUpload, field: str):
+        self.upload = upload
+        self.field = field.encode()
+        self.found = False
+
+        self._in_field = False
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers.clear()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_field = options.get(b"name") == self.field
+        if self._in_field and self.found:
+            raise UserException(f"Only one file may be sent in '{self.field.decode()}'")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_field:
+            self.upload.write(data[start:end])
+
+    def on_part_end(self):
+        if self._in_field:
+            self.found = True
+            self._in_field = False
+
+
+async def receive_image(request: Request, field: str = "image", store: ImageStore = image_store, max_size: int | None = None) -> ImageUpload:
+    """
+    Receives the image in the body of `request`: the file field `field` of a multipart form, or the whole body.
+    Raises `UserException` if it's not an image, `PayloadTooLargeException` if it's bigger than `max_size`
+    (IMAGES_MAX_UPLOAD_BYTES by default).
+    """
+    if max_size is None:
+        max_size = IMAGES_MAX_UPLOAD_BYTES
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    is_multipart = content_type == b"multipart/form-data"
+    max_body_size = max_size + MULTIPART_OVERHEAD_BYTES if is_multipart else max_size
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_body_size:
+        raise PayloadTooLargeException(f"Image must not be bigger than {max_size} bytes")
+
+    upload = ImageUpload(store, max_size)
+    try:
+        if is_multipart:
+            boundary = options.get(b"boundary")
+            if not boundary:
+                raise UserException("Missing multipart boundary")
+
+            part = _ImagePart(upload, field)
+            parser = multipart.MultipartParser(boundary, part.callbacks())
+            received = 0
+            async for chunk in request.stream():
+                # Without a `Content-Length`, the body is only limited here.
+                received += len(chunk)
+                if received > max_body_size:
+                    raise PayloadTooLargeException(f"Image must not be bigger than {max_size} bytes")
+                await run_in_threadpool(parser.write, chunk)
+            parser.finalize()
+
+            if not part.found:
+                raise UserException(f"Missing file field '{field}'")
+        else:
+            async for chunk in request.stream():
+                await run_in_threadpool(upload.write, chunk)
+
+        await run_in_threadpool(upload.finish)
+    except MultipartParseError:
+        upload.__exit__(None, None, None)
+        raise UserException("Malformed multipart body")
+    except BaseException:
+        upload.__exit__(None, None, None)
+        raise
+
+    return upload
@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+from app.api.config.auth import ClaimsDep, pre_authorize, token_cache
+from app.api.config.database import async_engine, async_replica_engines, engine, replica_engines
+from app.api.config.pool_metrics import pool_stats
+from app.api.config.security import password_hasher
+from app.api.image.image_service import image_garbage_collector
+from app.api.repo.repo_downloads import download_flusher
+from app.api.user.user_model import UserRole
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+@router.get("/stats", status_code=200, summary="Runtime statistics of this worker process")
+@pre_authorize([UserRole.superadmin])
+def get_stats(claims: ClaimsDep):
+    database = {"primary": pool_stats(engine)}
+    for i, replica_engine in enumerate(replica_engines):
+        database[f"replica_{i}"] = pool_stats(replica_engine)
+    if async_engine is not None:
+        database["async_primary"] = pool_stats(async_engine.sync_engine)
+        for i, replica_engine in enumerate(async_replica_engines):
+            database[f"async_replica_{i}"] = pool_stats(replica_engine.sync_engine)
+
+    return {
+        "database": database,
+        "password_hashing": password_hasher.stats(),
+        "jwt_cache": token_cache.stats(),
+        "downloads": download_flusher.stats(),
+        "image_garbage": image_garbage_collector.stats(),
+    }
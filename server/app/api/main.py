@@ -1,16 +1,34 @@
 from fastapi import APIRouter, FastAPI
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
 from app.api.config.initialize import init_create_tables, configure_cors, init_dummy_data, init_superadmin
 from app.api.config.exception_handler import register_exception_handler
+from app.api.config.query_counter import register_query_counter
+from app.api.config.security import check_password_thread_budget
 import app.api.user.user_controller
 import app.api.repo.repo_controller
 import app.api.org.org_controller
+import app.api.internal.internal_controller
+import app.api.stats.stats_controller
+import app.api.autocomplete.autocomplete_controller
 from app.api.config.cache import init_cache
+from app.api.config.database import engine
+from app.api.repo.repo_downloads import download_flusher
+from app.api.repo.repo_search import init_search
+from app.api.image.image_service import image_garbage_collector
+from app.api.image.image_thumbnails import thumbnail_worker
+from app.api.repo.repo_leaderboard import init_leaderboard, record_leaderboard_scores
+from app.api.stats.stats_rollup import stats_rollup
+from app.api.stats.stats_service import record_pull_events
+from app.api.autocomplete.autocomplete_index import autocomplete_index, autocomplete_refresher, init_autocomplete
 
 the_router = APIRouter()
 the_router.include_router(app.api.user.user_controller.router)
 the_router.include_router(app.api.repo.repo_controller.router)
 the_router.include_router(app.api.org.org_controller.router)
+the_router.include_router(app.api.internal.internal_controller.router)
+the_router.include_router(app.api.stats.stats_controller.router)
+the_router.include_router(app.api.autocomplete.autocomplete_controller.router)
 
 # TODO: Remove in production, this is for development purposes only.
 # This is slightly easier to deal with than environment variables.
@@ -21,12 +39,33 @@ def add_dummy_data():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_create_tables()
+    check_password_thread_budget()
+    thumbnail_worker.start()
+    thumbnail_worker.submit_missing(engine)
+    init_search(engine)
+    init_autocomplete(engine)
+    init_leaderboard(engine)
     init_cache()
     init_superadmin()
+    download_flusher.start()
+    stats_rollup.start()
+    autocomplete_refresher.start()
+    image_garbage_collector.start()
     yield
+    image_garbage_collector.stop()
+    autocomplete_refresher.stop()
+    stats_rollup.stop()
+    download_flusher.stop()
+    thumbnail_worker.stop()
 
-app = FastAPI(lifespan=lifespan)
+# See config/fast_json.py.
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(the_router, prefix="/api/v1")
 
+download_flusher.listeners.append(record_pull_events)
+download_flusher.listeners.append(record_leaderboard_scores)
+download_flusher.commit_listeners.append(autocomplete_index.add_downloads)
+
 register_exception_handler(app)
+register_query_counter(app)
 configure_cors(app)
\ No newline at end of file
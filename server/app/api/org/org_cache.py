@@ -0,0 +1,53 @@
+# ----------------------------------------------
+# Cache of organization reads
+# ----------------------------------------------
+#
+# Organizations of a user (`GET /organizations/my`) change when the user joins
+# an organization, which bumps the user's version (see repo/repo_cache.py).
+# The version is part of the key, so old entries are never read again.
+#
+# The same goes for the IDs of those organizations, which decide access to
+# private organization repositories. With the user's version and snapshot in
+# the worker's LRU, an access check doesn't leave the process.
+# Anything that takes away memberships (e.g. deleting an organization) must
+# bump the versions of the affected users, like joining does.
+
+import json
+from typing import Callable, FrozenSet, Iterable, List
+
+from pydantic import TypeAdapter
+
+from app.api.config.cache import get_read_cache
+from app.api.config.replicas import from_primary
+from app.api.org.org_dto import OrganizationDTOBasic
+
+_orgs_adapter = TypeAdapter(List[OrganizationDTOBasic])
+
+
+class OrganizationCache:
+    EXPIRE_SECONDS = 60
+    STALE_SECONDS = 30
+    # Never stale: the key changes whenever the memberships do.
+    MEMBERSHIP_EXPIRE_SECONDS = 600
+
+    def load_orgs_of_user_json(self, user_id: int, load: Callable[[], List[OrganizationDTOBasic]]) -> bytes:
+        """
+        Returns the cached JSON of the organizations, or calls `load` and caches what it returns.
+        """
+        version = get_read_cache().get_versions([f"user:{user_id}"])[f"user:{user_id}"]
+        key = f"orgs-of:{user_id}:v{version}"
+
+        return get_read_cache().get_or_load(key, from_primary(lambda: _orgs_adapter.dump_json(load())), self.EXPIRE_SECONDS, self.STALE_SECONDS)
+
+    def load_org_ids_of_user(self, user_id: int, load: Callable[[], Iterable[int]]) -> FrozenSet[int]:
+        """
+        Returns the cached IDs of the organizations `user_id` is a member of, or calls `load` and caches what it returns.
+        """
+        version = get_read_cache().get_versions([f"user:{user_id}"])[f"user:{user_id}"]
+        key = f"org-ids-of:{user_id}:v{version}"
+
+        body = get_read_cache().get_or_load(key, from_primary(lambda: json.dumps(sorted(load())).encode()), self.MEMBERSHIP_EXPIRE_SECONDS, lock=True)
+        return frozenset(json.loads(body))
+
+
+org_cache = OrganizationCache()
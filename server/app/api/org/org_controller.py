@@ -1,25 +1,42 @@
 from typing import List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 
-from app.api.config.auth import get_id_from_jwt, pre_authorize
+from app.api.config.auth import pre_authorize
 from app.api.user.user_model import UserRole
-from app.api.config.auth import JWTDep
+from app.api.config.auth import ClaimsDep
 from app.api.org.org_dto import OrganizationCreateDTO, OrganizationDTOBasic
-from app.api.org.org_service import OrganizationService, get_org_service
+from app.api.config.etag import conditional_json_response
+from app.api.image.image_upload import receive_image
+from app.api.org.org_service import OrganizationService, get_org_read_service, get_org_service
 
 router = APIRouter(prefix="/organizations", tags=["organizations"])
 
 @router.post("/", response_model=OrganizationDTOBasic, status_code=200, summary="Create a new organization")
 @pre_authorize([UserRole.user, UserRole.admin])
-def create_org(jwt: JWTDep, dto: OrganizationCreateDTO, org_service: OrganizationService = Depends(get_org_service)):
-    user_id = get_id_from_jwt(jwt)
-    repo = org_service.add(user_id, dto)
+def create_org(claims: ClaimsDep, dto: OrganizationCreateDTO, org_service: OrganizationService = Depends(get_org_service)):
+    repo = org_service.add(claims.id, dto)
     return repo
 
 
-@router.get("/my", response_model=List[OrganizationDTOBasic], status_code=200, summary="Find all organizations that I am a member of")
+@router.put("/{org_id}/image", response_model=OrganizationDTOBasic, status_code=200, summary="Upload a new image of an organization", openapi_extra={
+    "requestBody": {"content": {
+        "multipart/form-data": {"schema": {"type": "object", "properties": {"image": {"type": "string", "format": "binary"}}, "required": ["image"]}},
+        "image/*": {"schema": {"type": "string", "format": "binary"}},
+    }},
+})
 @pre_authorize([UserRole.user, UserRole.admin])
-def find_my_orgs(jwt: JWTDep, org_service: OrganizationService = Depends(get_org_service)):
-    user_id = get_id_from_jwt(jwt)
-    orgs = org_service.find_orgs_that_user_is_member_of(user_id)
-    return orgs
\ No newline at end of file
+async def upload_org_image(org_id: int, request: Request, claims: ClaimsDep, org_service: OrganizationService = Depends(get_org_service)):
+    # Before a single byte of the body is read.
+    await run_in_threadpool(org_service.check_can_set_image, claims.id, org_id)
+
+    # The body is read here, as it arrives, instead of being parsed by FastAPI up front.
+    with await receive_image(request) as upload:
+        return await run_in_threadpool(org_service.set_image, claims.id, org_id, upload)
+
+
+@router.get("/my", response_model=List[OrganizationDTOBasic], status_code=200, summary="Find all organizations that I am a member of", responses={304: {"description": "Not modified since `If-None-Match`"}})
+@pre_authorize([UserRole.user, UserRole.admin])
+def find_my_orgs(request: Request, claims: ClaimsDep, org_service: OrganizationService = Depends(get_org_read_service)):
+    body = org_service.find_orgs_json_that_user_is_member_of(claims.id)
+    return conditional_json_response(request, body, private=True)
\ No newline at end of file
@@ -1,10 +1,15 @@
-from typing import List
-from pydantic import BaseModel
+from typing import Dict, List
+from pydantic import BaseModel, computed_field
+
+from app.api.image.image_thumbnails import thumbnail_keys
 
 class OrganizationCreateDTO(BaseModel):
     name: str
     desc: str
     image: str | None = None
+    """
+    Base64 data URL. Prefer uploading with `PUT /organizations/{id}/image` after creating the organization.
+    """
 
 class OrganizationDTOBasic(BaseModel):
     id: int
@@ -13,6 +18,14 @@ class OrganizationDTOBasic(BaseModel):
     image: str
     owner_id: int
 
+    @computed_field
+    @property
+    def image_variants(self) -> Dict[int, str]:
+        """
+        Thumbnails of `image` by size (see image/image_thumbnails.py). Fall back to `image` if one isn't there (yet).
+        """
+        return thumbnail_keys(self.image)
+
 class OrganizationRepoDTO(BaseModel):
     id: int
     name: str
@@ -9,6 +9,9 @@ if TYPE_CHECKING:
 class OrganizationMembers(SQLModel, table=True):
     __tablename__ = "organization_members"
 
+    # The composite primary key (user_id, organization_id) doubles as the index for
+    # "is user X a member of org Y" and "which orgs is user X in", so keep user_id first.
+
     user_id: int | None = Field(default=None, foreign_key="user.id", primary_key=True)
     organization_id: int | None = Field(default=None, foreign_key="organization.id", primary_key=True)
 
@@ -24,6 +27,7 @@ class Organization(SQLModel, table=True):
     image: str = Field(default="")
     """
     Path to the image, relative to the internal `/images/` folder.
+    For images of the image store (see image/image_store.py), it's the key of the image.
     """
 
     owner_id: int = Field(default=None, foreign_key="user.id")
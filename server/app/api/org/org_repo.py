@@ -1,9 +1,18 @@
-from typing import Dict, List
+from typing import Dict, List, Set
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.api.org.org_model import Organization, OrganizationMembers
 from app.api.repo.repo_model import Repository
 from app.api.user.user_model import User
 
+def _org_ids_of_user_query(user_id: int):
+    return select(OrganizationMembers.organization_id).where(OrganizationMembers.user_id == user_id)
+
+
+def _orgs_by_ids_query(ids: list[int]):
+    return select(Organization.id, Organization.name).where(Organization.id.in_(ids))
+
+
 class OrganizationRepo:
     def __init__(self, session: Session):
         self.session = session
@@ -20,6 +29,13 @@ class OrganizationRepo:
     def find_by_name(self, name: str) -> Organization | None:
         return self.session.exec(select(Organization).where(Organization.name == name)).first()
     
+    def set_image(self, org: Organization, image: str) -> Organization:
+        org.sqlmodel_update({"image": image})
+        self.session.add(org)
+        self.session.commit()
+        self.session.refresh(org)
+        return org
+
     def add_user_to_org(self, org_id: int, user_id: int) -> OrganizationMembers:
         orgmember = OrganizationMembers(user_id=user_id, organization_id=org_id)
 
@@ -36,6 +52,13 @@ class OrganizationRepo:
         )
         return self.session.exec(query).first() is not None
 
+    def find_member_ids(self, org_id: int) -> List[int]:
+        query = select(OrganizationMembers.user_id).where(OrganizationMembers.organization_id == org_id)
+        return list(self.session.exec(query).all())
+
+    def find_org_ids_of_user(self, user_id: int) -> Set[int]:
+        return set(self.session.exec(_org_ids_of_user_query(user_id)).all())
+
     def find_orgs_that_user_is_member_of(self, user_id: int) -> List[Organization]:
         return self.session.exec(
             select(Organization)
@@ -44,6 +67,20 @@ class OrganizationRepo:
         ).all()
     
     def find_orgs_by_ids(self, ids: list[int]) -> Dict[int, str]:
-        query = select(Organization.id, Organization.name).where(Organization.id.in_(ids))
-        result = self.session.exec(query).all()
-        return {org.id: org.name for org in result}
\ No newline at end of file
+        result = self.session.exec(_orgs_by_ids_query(ids)).all()
+        return {org.id: org.name for org in result}
+
+
+class AsyncOrganizationRepo:
+    """
+    The queries of `OrganizationRepo` which async read endpoints need, for an `AsyncSession` (see `get_async_read_database`).
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def find_org_ids_of_user(self, user_id: int) -> Set[int]:
+        return set((await self.session.exec(_org_ids_of_user_query(user_id))).all())
+
+    async def find_orgs_by_ids(self, ids: list[int]) -> Dict[int, str]:
+        result = (await self.session.exec(_orgs_by_ids_query(ids))).all()
+        return {org.id: org.name for org in result}
@@ -2,16 +2,23 @@ from typing import Dict, List
 from fastapi import Depends
 from sqlmodel import Session
 from app.api.config.database import get_database
-from app.api.org.org_dto import OrganizationCreateDTO
+from app.api.config.replicas import get_read_database, read_router
+from app.api.org.org_dto import OrganizationCreateDTO, OrganizationDTOBasic
+from app.api.org.org_cache import org_cache
 from app.api.org.org_model import Organization, OrganizationMembers
 from app.api.org.org_repo import OrganizationRepo
-from app.api.config.exception_handler import FieldTakenException
-from app.api.config.images import generate_inline_image, save_image
+from app.api.config.exception_handler import AccessDeniedException, FieldTakenException, NotFoundException
+from app.api.config.images import decode_inline_image, generate_identicon
+from app.api.image.image_service import ImageService
+from app.api.image.image_upload import ImageUpload
+from app.api.repo.repo_cache import repo_cache
+from app.api.autocomplete.autocomplete_index import autocomplete_index
  
 class OrganizationService:
     def __init__(self, session: Session):
         self.session = session
         self.org_repo = OrganizationRepo(session)
+        self.image_service = ImageService(session)
 
     def add(self, user_id: int, dto: OrganizationCreateDTO) -> Organization:
         # Check if the name is available.
@@ -19,20 +26,23 @@ class OrganizationService:
         if self.org_repo.find_by_name(dto.name) is not None:
             raise FieldTakenException("Organization name")
         
-        # Save the image.
+        # Save the image. Its reference is committed together with the organization.
 
         if dto.image is None:
-            dto.image = generate_inline_image(dto.name)
-        image_fname = save_image(dto.image, f"org-{dto.name}")[1]
+            image = generate_identicon(dto.name)
+        else:
+            image = decode_inline_image(dto.image)
+        image_key = self.image_service.add(image)
 
         # Create the organization.
 
         new_org = Organization.model_validate(dto, update={
             "owner_id": user_id,
-            "image": image_fname,
+            "image": image_key,
         })
 
         org = self.org_repo.add(new_org)
+        autocomplete_index.add_organization(org)
 
         # Add user to his own organization.
 
@@ -67,15 +77,70 @@ class OrganizationService:
 
         return org
     
+    def check_can_set_image(self, user_id: int, org_id: int):
+        """
+        Raises unless `user_id` may change the image of the organization, i.e. is its owner.
+        Call before receiving the upload, so that nobody else gets to send a whole image for nothing.
+        """
+        self._find_org_to_set_image(user_id, org_id)
+        # The upload can take a while to arrive: end the transaction, so that the
+        # connection goes back to the pool instead of sitting idle in it meanwhile.
+        self.session.rollback()
+
+    def set_image(self, user_id: int, org_id: int, upload: ImageUpload) -> Organization:
+        """
+        Replaces the image of the organization with an uploaded one. Only its owner may do that.
+        """
+        org = self._find_org_to_set_image(user_id, org_id)
+
+        # Released even if it's the same image: `add_upload` added a reference.
+        old_image = org.image
+        image_key = self.image_service.add_upload(upload)
+        self.image_service.release(old_image)
+        org = self.org_repo.set_image(org, image_key)
+        # Only once committed, so a failed commit doesn't leave a file nothing refers to.
+        self.image_service.store_upload(upload)
+
+        # Cached organization lists of the members have the old image.
+        repo_cache.invalidate_users(self.org_repo.find_member_ids(org_id))
+        return org
+
+    def _find_org_to_set_image(self, user_id: int, org_id: int) -> Organization:
+        org = self.org_repo.find_by_id(org_id)
+        if org is None:
+            raise NotFoundException(Organization, org_id)
+        if org.owner_id != user_id:
+            raise AccessDeniedException(f"User {user_id} cannot change the image of organization {org_id}")
+        return org
+
     def add_user_to_org(self, org_id: int, user_id: int) -> OrganizationMembers:
-        return self.org_repo.add_user_to_org(org_id, user_id)
+        member = self.org_repo.add_user_to_org(org_id, user_id)
+        read_router.mark_write(user_id)
+        repo_cache.invalidate_users([user_id])
+        return member
     
     def find_orgs_that_user_is_member_of(self, user_id: int) -> List[Organization]:
         return self.org_repo.find_orgs_that_user_is_member_of(user_id)
     
+    def find_orgs_json_that_user_is_member_of(self, user_id: int) -> bytes:
+        """
+        JSON of `find_orgs_that_user_is_member_of` as a list of `OrganizationDTOBasic`, cached.
+        """
+        def load():
+            orgs = self.org_repo.find_orgs_that_user_is_member_of(user_id)
+            return [OrganizationDTOBasic.model_validate(org, from_attributes=True) for org in orgs]
+
+        return org_cache.load_orgs_of_user_json(user_id, load)
+    
     def find_org_names_by_ids(self, ids: List[int]) -> Dict[int, str]:
         return self.org_repo.find_orgs_by_ids(ids)
 
 
 def get_org_service(session: Session = Depends(get_database)) -> OrganizationService:
+    return OrganizationService(session)
+
+def get_org_read_service(session: Session = Depends(get_read_database)) -> OrganizationService:
+    """
+    Read-only service, may be backed by a read replica.
+    """
     return OrganizationService(session)
\ No newline at end of file
@@ -0,0 +1,127 @@
+# ----------------------------------------------
+# Cache of repository reads
+# ----------------------------------------------
+#
+# Three things are cached (see `ReadCache` in config/cache.py):
+#
+# 1) `RepositoryExtDTO` of *public* repositories, by canonical name.
+#    Anyone may see a public repository, so one entry serves every viewer.
+#    Private repositories are never cached here.
+#
+# 2) Repository listings of a user (`ReposOfUserDTO`). What a listing contains
+#    depends on who's asking, so the key contains the viewer's visibility class:
+#       - `anon`       signed out, sees public repositories only
+#       - `self`       the user themself, sees everything
+#       - `u{id}v{n}`  another user, sees public repositories + private
+#                      repositories of organizations they're a member of,
+#                      so the key depends on their version too.
+#    Listings are cached without download counts, which change all the time.
+#
+# 3) Download counts of repositories, by ID, for a few seconds. They fill in
+#    listings on the way out. A download flush drops the counts it changed, so
+#    a count read after the flush includes it (see repo/repo_downloads.py).
+#
+# Every user has a version counter which is bumped when their listing or their
+# memberships may have changed:
+#   - a repository is added to their account or to one of their organizations,
+#   - they join an organization,
+#   - a repository they can see changes its badge/visibility.
+#
+# The first two are read through `ReadCache.get_or_load`, so a hot repository falling
+# out of the cache costs one query per worker (public repositories: one query
+# in total), not one per concurrent request. Loads run on the primary, not on
+# a replica which may not have the write yet (see `from_primary` in config/replicas.py).
+
+from typing import Callable, Dict, Iterable, List
+
+from app.api.config.cache import get_read_cache
+from app.api.config.replicas import from_primary
+from app.api.repo.repo_dto import ReposOfUserDTO, RepositoryExtDTO
+
+
+class RepositoryCache:
+    EXPIRE_SECONDS = 60
+    STALE_SECONDS = 30
+    DOWNLOADS_EXPIRE_SECONDS = 10
+
+    def load_public_repo(self, canonical_name: str, load: Callable[[], RepositoryExtDTO | None]) -> RepositoryExtDTO | None:
+        """
+        Returns the cached repository, or calls `load`. What `load` returns is cached only if it's a public repository.
+        Returns None if the repository isn't public (or doesn't exist).
+        """
+        cached = self.load_public_repo_json(canonical_name, load)
+        return None if cached is None else RepositoryExtDTO.model_validate_json(cached)
+
+    def load_public_repo_json(self, canonical_name: str, load: Callable[[], RepositoryExtDTO | None]) -> bytes | None:
+        """
+        Same as `load_public_repo`, but returns the JSON.
+        """
+        def load_public():
+            dto = load()
+            return dto.model_dump_json().encode() if dto is not None and dto.public else None
+
+        return get_read_cache().get_or_load(f"repo:{canonical_name}", from_primary(load_public), self.EXPIRE_SECONDS, self.STALE_SECONDS, lock=True)
+
+    def _listing_key(self, user_id: int, viewer_id: int | None, limit: int | None, cursor: str | None) -> str:
+        names = [f"user:{user_id}"]
+        if viewer_id is not None and viewer_id != user_id:
+            names.append(f"user:{viewer_id}")
+        versions = get_read_cache().get_versions(names)
+
+        if viewer_id is None:
+            viewer_class = "anon"
+        elif viewer_id == user_id:
+            viewer_class = "self"
+        else:
+            viewer_class = f"u{viewer_id}v{versions[f'user:{viewer_id}']}"
+
+        return f"repos-of:{user_id}:v{versions[f'user:{user_id}']}:{viewer_class}:{limit}:{cursor}"
+
+    def load_listing_json(self, user_id: int, viewer_id: int | None, limit: int | None, cursor: str | None, load: Callable[[], ReposOfUserDTO]) -> bytes:
+        """
+        Returns the cached JSON of the listing, or calls `load` and caches what it returns.
+        The repositories in it have no `downloads`, see `load_downloads`.
+        """
+        key = self._listing_key(user_id, viewer_id, limit, cursor)
+        dump = lambda: load().model_dump_json(exclude={"repos": {"__all__": {"downloads"}}}).encode()
+        return get_read_cache().get_or_load(key, from_primary(dump), self.EXPIRE_SECONDS, self.STALE_SECONDS)
+
+    def load_downloads(self, repo_ids: List[int], load: Callable[[List[int]], Dict[int, int]]) -> Dict[int, int]:
+        """
+        Returns the persisted download counts of the repositories. Those which aren't cached
+        are loaded with one call of `load`, which may leave out repositories that don't exist.
+        """
+        keys = [f"downloads:{id}" for id in repo_ids]
+        counts = {id: int(value) for id, value in zip(repo_ids, get_read_cache().get_many(keys)) if value is not None}
+
+        missing = [id for id in repo_ids if id not in counts]
+        if missing:
+            loaded = from_primary(lambda: load(missing))()
+            for id in missing:
+                counts[id] = loaded.get(id, 0)
+            get_read_cache().set_many({f"downloads:{id}": str(counts[id]).encode() for id in missing}, self.DOWNLOADS_EXPIRE_SECONDS)
+
+        return counts
+
+    def invalidate_repo(self, canonical_name: str, affected_user_ids: Iterable[int]):
+        """
+        Call when a repository is added or its badge/visibility changes.
+        `affected_user_ids` are the users whose listings contain it: the owner, or all members of its organization.
+        """
+        get_read_cache().delete(f"repo:{canonical_name}")
+        self.invalidate_users(affected_user_ids)
+
+    def invalidate_downloads(self, repo_ids: Iterable[int], canonical_names: Iterable[str]):
+        """
+        Call when download counts of repositories change.
+        """
+        get_read_cache().delete(*[f"repo:{name}" for name in canonical_names], *[f"downloads:{id}" for id in repo_ids])
+
+    def invalidate_users(self, user_ids: Iterable[int]):
+        """
+        Call when the memberships of users change.
+        """
+        get_read_cache().bump_versions(f"user:{id}" for id in user_ids)
+
+
+repo_cache = RepositoryCache()
@@ -1,62 +1,174 @@
 from typing import List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
-from app.api.repo.repo_dto import ReposOfUserDTO, RepositoryCreateDTO, RepositoryDTO, RepositoryExtDTO
-from app.api.repo.repo_service import RepositoryService, get_repo_service
-from app.api.config.auth import get_id_from_jwt, get_id_from_jwt_optional, pre_authorize
+from app.api.repo.repo_dto import PopularRepositoriesDTO, ReposOfUserDTO, RepositoryCreateDTO, RepositoryDTO, RepositoryExtDTO, RepositorySearchDTO
+from app.api.repo.repo_service import AsyncRepositoryService, RepositoryService, get_async_repo_read_service, get_repo_read_service, get_repo_service
+from app.api.config.auth import pre_authorize
 from app.api.user.user_model import UserRole
-from app.api.config.auth import JWTBearer, JWTDep, JWTDepOptional
-from app.api.user.user_service import UserService, get_user_service
-from app.api.org.org_service import OrganizationService, get_org_service
+from app.api.config.auth import ClaimsDep, ClaimsDepOptional
+from app.api.config.database import DATABASE_ASYNC
+from app.api.config.replicas import blocking, read_session
+from app.api.user.user_service import UserService, get_user_read_service
+from app.api.org.org_service import OrganizationService, get_org_read_service
 from app.api.config.exception_handler import NotFoundException
-from app.api.repo.repo_model import Repository
+from app.api.repo.repo_model import Repository, RepositoryBadge
+from app.api.repo.repo_cache import repo_cache
+from app.api.config.etag import conditional_json_response
+from app.api.config.fast_json import json_response, to_dtos
 
 router = APIRouter(prefix="/repositories", tags=["repositories"])
 
+# With DATABASE_ASYNC (see config/database.py), `get_repositories_of_user` and
+# `get_repo_by_canonical_name` are replaced by their `_async` versions, which
+# answer the same requests the same way, with their queries on the event loop.
+
 @router.post("/", response_model=RepositoryDTO, status_code=200, summary="Create a new repository")
 @pre_authorize([UserRole.user, UserRole.admin])
-def register_repo(jwt: JWTDep, dto: RepositoryCreateDTO, repo_service: RepositoryService = Depends(get_repo_service)):
-    user_id = get_id_from_jwt(jwt)
-    repo = repo_service.add(user_id, dto)
+def register_repo(claims: ClaimsDep, dto: RepositoryCreateDTO, repo_service: RepositoryService = Depends(get_repo_service)):
+    repo = repo_service.add(claims.id, dto)
     return repo
 
-@router.get("/u/{username}", response_model=ReposOfUserDTO, status_code=200, summary="Get repositories of suer")
 def get_repositories_of_user(
-    jwt: JWTDepOptional, 
+    request: Request,
+    claims: ClaimsDepOptional, 
     username: str, 
-    repo_service: RepositoryService = Depends(get_repo_service), 
-    user_service: UserService = Depends(get_user_service),
-    org_service: OrganizationService = Depends(get_org_service)
+    limit: int | None = Query(default=None, ge=1, le=1000, description="Page size. Without it, all repositories are returned at once."),
+    cursor: str | None = Query(default=None, description="`next` of the previous page."),
+    repo_service: RepositoryService = Depends(get_repo_read_service), 
+    user_service: UserService = Depends(get_user_read_service),
+    org_service: OrganizationService = Depends(get_org_read_service)
+):
+    me_id = None if claims is None else claims.id
+
+    user_id = user_service.find_id_by_username(username)
+
+    if _wants_ndjson(request):
+        return _repositories_of_user_ndjson(user_id, me_id)
+
+    def load() -> ReposOfUserDTO:
+        # NOTE: I had to convert Repository -> RepositoryDTO manually here,
+        # because FastAPI does automatic conversion ONLY if the DTO is the
+        # response_model (@router.get(..., response_model=...)). If the DTO
+        # is nested, it won't work.
+        next_cursor = None
+        if limit is None:
+            repos = repo_service.get_repositories_of_user(user_id, me_id)
+        else:
+            repos, next_cursor = repo_service.get_repositories_of_user_page(user_id, me_id, limit, cursor)
+        repos = to_dtos(RepositoryDTO, repos)
+
+        org_names = org_service.find_org_names_by_ids([r.organization_id for r in repos if r.organization_id is not None])
+
+        return ReposOfUserDTO.model_construct(user_id=user_id, user_name=username, repos=repos, organization_names=org_names, next=next_cursor)
+
+    # Cached as JSON without download counts, which are filled in on the way out.
+    body = repo_cache.load_listing_json(user_id, me_id, limit, cursor, load)
+    return json_response(repo_service.add_downloads_json(body))
+
+
+async def get_repositories_of_user_async(
+    request: Request,
+    claims: ClaimsDepOptional, 
+    username: str, 
+    limit: int | None = Query(default=None, ge=1, le=1000, description="Page size. Without it, all repositories are returned at once."),
+    cursor: str | None = Query(default=None, description="`next` of the previous page."),
+    repo_service: AsyncRepositoryService = Depends(get_async_repo_read_service),
+):
+    me_id = None if claims is None else claims.id
+
+    user_id = await repo_service.find_user_id_by_username(username)
+
+    if _wants_ndjson(request):
+        return _repositories_of_user_ndjson(user_id, me_id)
+
+    async def load() -> ReposOfUserDTO:
+        next_cursor = None
+        if limit is None:
+            repos = await repo_service.get_repositories_of_user(user_id, me_id)
+        else:
+            repos, next_cursor = await repo_service.get_repositories_of_user_page(user_id, me_id, limit, cursor)
+        repos = to_dtos(RepositoryDTO, repos)
+
+        org_names = await repo_service.find_org_names_by_ids([r.organization_id for r in repos if r.organization_id is not None])
+
+        return ReposOfUserDTO.model_construct(user_id=user_id, user_name=username, repos=repos, organization_names=org_names, next=next_cursor)
+
+    body = await run_in_threadpool(repo_cache.load_listing_json, user_id, me_id, limit, cursor, blocking(load))
+    return json_response(await repo_service.add_downloads_json(body))
+
+
+router.get(
+    "/u/{username}", name="get_repositories_of_user", response_model=ReposOfUserDTO, status_code=200, summary="Get repositories of suer",
+)(get_repositories_of_user_async if DATABASE_ASYNC else get_repositories_of_user)
+
+
+def _wants_ndjson(request: Request) -> bool:
+    return "application/x-ndjson" in request.headers.get("accept", "")
+
+
+def _repositories_of_user_ndjson(user_id: int, me_id: int | None) -> StreamingResponse:
+    # Bulk consumers can ask for newline-delimited JSON: one RepositoryDTO per
+    # line, streamed as the repositories are read from the database.
+    def ndjson():
+        # The session of the endpoint is closed before the body is sent,
+        # so the stream has its own, closed when the stream ends.
+        with read_session(me_id) as session:
+            for repo in RepositoryService(session).iter_repositories_of_user(user_id, me_id):
+                yield RepositoryDTO.model_validate(repo, from_attributes=True).model_dump_json() + "\n"
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+# Must come before the routes that take any canonical name. Official repositories can't be called "search".
+@router.get("/search", response_model=RepositorySearchDTO, status_code=200, summary="Search repositories by name and description")
+def search_repositories(
+    claims: ClaimsDepOptional,
+    q: str = Query(min_length=1, max_length=100),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None, description="`next` of the previous page."),
+    repo_service: RepositoryService = Depends(get_repo_read_service),
+):
+    user_id = None if claims is None else claims.id
+    repos, next_cursor = repo_service.search(q, user_id, limit, cursor)
+    repos = to_dtos(RepositoryDTO, repos)
+    repo_service.add_pending_downloads(repos)
+    return json_response(RepositorySearchDTO.model_construct(repos=repos, next=next_cursor))
+
+
+# Must come before the routes that take any canonical name. Official repositories can't be called "popular".
+@router.get("/popular", response_model=PopularRepositoriesDTO, status_code=200, summary="Public repositories, most downloaded first")
+def find_popular_repositories(
+    badge: RepositoryBadge | None = Query(default=None, description="Only repositories with this badge."),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None, description="`next` of the previous page."),
+    repo_service: RepositoryService = Depends(get_repo_read_service),
 ):
-    me_id = get_id_from_jwt_optional(jwt)
+    repos, next_cursor = repo_service.find_popular(badge, limit, cursor)
+    repos = to_dtos(RepositoryDTO, repos)
+    repo_service.add_pending_downloads(repos)
+    return json_response(PopularRepositoriesDTO.model_construct(repos=repos, next=next_cursor))
 
-    user = user_service.find_by_username(username)
-    user_id = user.id
 
-    # NOTE: I had to convert Repository -> RepositoryDTO manually here,
-    # because FastAPI does automatic conversion ONLY if the DTO is the
-    # response_model (@router.get(..., response_model=...)). If the DTO
-    # is nested, it won't work.
-    repos = repo_service.get_repositories_of_user(user_id, me_id)
-    repos = [RepositoryDTO.model_validate(repo.model_dump()) for repo in repos]
+@router.post("/{repo_canonical_name:path}/pulls", status_code=204, summary="Count a download of the repository")
+def count_repo_pull(claims: ClaimsDepOptional, repo_canonical_name: str, repo_service: RepositoryService = Depends(get_repo_read_service)):
+    user_id = None if claims is None else claims.id
+    repo_service.count_pull(repo_canonical_name, user_id)
 
-    user = user_service.find_by_id(user_id)
-    org_names = org_service.find_org_names_by_ids([r.organization_id for r in repos if r.organization_id is not None])
 
-    return ReposOfUserDTO(user_id=user_id, user_name=user.username, repos=repos, organization_names=org_names)
+def get_repo_by_canonical_name(request: Request, claims: ClaimsDepOptional, repo_canonical_name: str, repo_service: RepositoryService = Depends(get_repo_read_service)):
+    user_id = None if claims is None else claims.id
+    body = repo_service.find_ext_json_by_canonical_name(repo_canonical_name, user_id)
+    return conditional_json_response(request, body, private=claims is not None)
 
 
-@router.get("/{repo_canonical_name:path}", response_model=RepositoryExtDTO, status_code=200, summary="Find repository by its full name")
-def get_repo_by_canonical_name(jwt: JWTDepOptional, repo_canonical_name: str, repo_service: RepositoryService = Depends(get_repo_service)):
-    user_id = get_id_from_jwt_optional(jwt)
-    repo = repo_service.find_by_canonical_name(repo_canonical_name)
+async def get_repo_by_canonical_name_async(request: Request, claims: ClaimsDepOptional, repo_canonical_name: str, repo_service: AsyncRepositoryService = Depends(get_async_repo_read_service)):
+    user_id = None if claims is None else claims.id
+    body = await repo_service.find_ext_json_by_canonical_name(repo_canonical_name, user_id)
+    return conditional_json_response(request, body, private=claims is not None)
 
-    if not repo_service.user_has_read_access_to_repo(repo, user_id):
-        raise NotFoundException(Repository, repo_canonical_name)
-    
-    result = repo.model_dump()
-    result["owner_name"] = repo.owner.username
-    result["org_name"] = None if (repo.organization is None) else repo.organization.name
-    result = RepositoryExtDTO.model_validate(result)
 
-    return result
\ No newline at end of file
+router.get(
+    "/{repo_canonical_name:path}", name="get_repo_by_canonical_name", response_model=RepositoryExtDTO, status_code=200, summary="Find repository by its full name",
+    responses={304: {"description": "Not modified since `If-None-Match`"}},
+)(get_repo_by_canonical_name_async if DATABASE_ASYNC else get_repo_by_canonical_name)
@@ -0,0 +1,226 @@
+# ----------------------------------------------
+# Download counting
+# ----------------------------------------------
+#
+# Every pull of a repository increments its `downloads`. Doing that with one
+# UPDATE per pull would make all pulls of a hot repository (e.g. `python`)
+# wait for each other on its row lock. Instead:
+#
+# - `DownloadCounter` keeps pending increments in memory. It's split into
+#   shards, each with its own lock, and every thread sticks to one shard, so
+#   concurrent pulls of the same repository don't contend on a single lock.
+#   Counting a pull is a dict increment.
+#
+# - `DownloadFlusher` is a background thread which, every
+#   DOWNLOADS_FLUSH_SECONDS, takes all pending increments and writes them as
+#   `downloads = downloads + delta`, one batched UPDATE per DOWNLOADS_FLUSH_BATCH
+#   repositories, in a single transaction. If that fails, the increments are put
+#   back and retried on the next flush. On shutdown, whatever's pending is flushed.
+#   `listeners` are called within the same transaction, e.g. to log the
+#   downloads for statistics, and `commit_listeners` after it's committed.
+#
+# - Reads add the pending increments of this worker to the persisted value
+#   (see `RepositoryService.find_ext_json_by_canonical_name`). Other workers'
+#   increments show up after their next flush. A flush drops the cached counts
+#   of the repositories it updated before it drops their pending increments, so
+#   a count read right after it includes the flushed downloads (see repo/repo_cache.py).
+#
+# Every worker process counts and flushes its own pulls, so no coordination is
+# needed between them. A worker that's killed loses at most its last
+# DOWNLOADS_FLUSH_SECONDS of pulls.
+
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List
+
+from sqlalchemy import bindparam, update
+from sqlmodel import Session, select
+
+from app.api.config.database import SessionLocal
+from app.api.repo.repo_model import Repository
+from app.api.repo.repo_cache import repo_cache
+
+DOWNLOADS_FLUSH_SECONDS = float(os.getenv('DOWNLOADS_FLUSH_SECONDS', '5'))
+DOWNLOADS_FLUSH_BATCH = int(os.getenv('DOWNLOADS_FLUSH_BATCH', '500'))
+DOWNLOADS_COUNTER_SHARDS = int(os.getenv('DOWNLOADS_COUNTER_SHARDS', '16'))
+
+
+class DownloadCounter:
+    def __init__(self, shards: int):
+        self._shards = [(threading.Lock(), defaultdict(int)) for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._thread_shard = threading.local()
+
+        # Increments taken by a flush that isn't committed yet. Reads still count them.
+        self._flushing: Dict[int, int] = {}
+        self._flushing_lock = threading.Lock()
+
+    def _shard(self):
+        index = getattr(self._thread_shard, "index", None)
+        if index is None:
+            index = self._thread_shard.index = next(self._next_shard) % len(self._shards)
+        return self._shards[index]
+
+    def incr(self, repo_id: int, n: int = 1):
+        lock, deltas = self._shard()
+        with lock:
+            deltas[repo_id] += n
+
+    def pending(self, repo_ids: Iterable[int]) -> Dict[int, int]:
+        """
+        Increments of `repo_ids` which aren't in the database yet. Repositories without any are left out.
+        """
+        repo_ids = list(repo_ids)
+        result = defaultdict(int)
+        for lock, deltas in self._shards:
+            with lock:
+                for id in repo_ids:
+                    if id in deltas:
+                        result[id] += deltas[id]
+        with self._flushing_lock:
+            for id in repo_ids:
+                if id in self._flushing:
+                    result[id] += self._flushing[id]
+        return dict(result)
+
+    def has_pending(self) -> bool:
+        return any(deltas for _, deltas in self._shards) or bool(self._flushing)
+
+    def pending_repositories(self) -> int:
+        with self._flushing_lock:
+            ids = set(self._flushing)
+        for lock, deltas in self._shards:
+            with lock:
+                ids.update(deltas)
+        return len(ids)
+
+    def begin_flush(self) -> Dict[int, int]:
+        """
+        Takes all pending increments. Call `end_flush` after they're committed, or `abort_flush` if that failed.
+        """
+        taken = defaultdict(int)
+        for lock, deltas in self._shards:
+            with lock:
+                shard_deltas = dict(deltas)
+                deltas.clear()
+            for id, delta in shard_deltas.items():
+                taken[id] += delta
+
+        with self._flushing_lock:
+            self._flushing = dict(taken)
+        return self._flushing
+
+    def end_flush(self):
+        with self._flushing_lock:
+            self._flushing = {}
+
+    def abort_flush(self):
+        with self._flushing_lock:
+            flushing, self._flushing = self._flushing, {}
+        for id, delta in flushing.items():
+            self.incr(id, delta)
+
+
+class DownloadFlusher:
+    def __init__(self, counter: DownloadCounter, session_factory: Callable[[], Session], interval: float, batch_size: int):
+        self.counter = counter
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.listeners: List[Callable[[Session, Dict[int, int]], None]] = []
+        self.commit_listeners: List[Callable[[Dict[int, int]], None]] = []
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.flushes = 0
+        self.failures = 0
+        self.flushed_downloads = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="download-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the thread and flushes whatever's pending.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Writes pending increments to the database. Returns the number of repositories updated.
+        """
+        deltas = self.counter.begin_flush()
+        if not deltas:
+            self.counter.end_flush()
+            return 0
+
+        start = time.perf_counter()
+        # Always update rows in the same order, so that concurrent flushes of different workers can't deadlock.
+        ids = sorted(deltas)
+        table = Repository.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("repo_id"))
+            .values(downloads=table.c.downloads + bindparam("delta"))
+        )
+
+        try:
+            canonical_names: List[str] = []
+            with self.session_factory() as session:
+                for batch in _batches(ids, self.batch_size):
+                    session.connection().execute(statement, [{"repo_id": id, "delta": deltas[id]} for id in batch])
+                    canonical_names.extend(session.exec(select(Repository.canonical_name).where(Repository.id.in_(batch))).all())
+                for listener in self.listeners:
+                    listener(session, deltas)
+                session.commit()
+        except Exception as e:
+            print(f"[!] Flushing downloads of {len(ids)} repositories failed, will retry: {e}")
+            self.counter.abort_flush()
+            self.failures += 1
+            return 0
+
+        # Cached repositories have the old total, and their pending increments are about to disappear.
+        repo_cache.invalidate_downloads(ids, canonical_names)
+        self.counter.end_flush()
+        for listener in self.commit_listeners:
+            listener(deltas)
+
+        self.flushes += 1
+        self.flushed_downloads += sum(deltas.values())
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        return len(ids)
+
+    def stats(self) -> dict:
+        return {
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "flushed_downloads": self.flushed_downloads,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "pending_repositories": self.counter.pending_repositories(),
+        }
+
+
+def _batches(items: List[int], size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+download_counter = DownloadCounter(DOWNLOADS_COUNTER_SHARDS)
+download_flusher = DownloadFlusher(download_counter, SessionLocal, DOWNLOADS_FLUSH_SECONDS, DOWNLOADS_FLUSH_BATCH)
@@ -28,7 +28,25 @@ class ReposOfUserDTO(BaseModel):
     user_name: str
     repos: List[RepositoryDTO]
     organization_names: Dict[int, str]
+    next: str | None = None
+    """
+    Cursor of the next page. Only set when paginating (`?limit=...`) and there may be more repositories.
+    """
 
 class RepositoryExtDTO(RepositoryDTO):
     owner_name: str
-    org_name: str | None
\ No newline at end of file
+    org_name: str | None
+
+class RepositorySearchDTO(BaseModel):
+    repos: List[RepositoryDTO]
+    next: str | None = None
+    """
+    Cursor of the next page, if there may be more results.
+    """
+
+class PopularRepositoriesDTO(BaseModel):
+    repos: List[RepositoryDTO]
+    next: str | None = None
+    """
+    Cursor of the next page, if there may be more repositories.
+    """
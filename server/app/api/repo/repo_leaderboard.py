@@ -0,0 +1,203 @@
+# ----------------------------------------------
+# Popular repositories
+# ----------------------------------------------
+#
+# `GET /repositories/popular?badge=` lists public repositories by downloads,
+# most downloaded first. Sorting the repository table on every request doesn't
+# scale, so the order is kept in leaderboards instead: one per badge, plus
+# one with all public repositories (`ALL_BOARD`).
+#
+# Scores are downloads as persisted in the database. They're written:
+#   - when a repository is added (`RepositoryService.add`),
+#   - when downloads are flushed (`record_leaderboard_scores` is a listener of
+#     `DownloadFlusher`), with the new totals read back in the same transaction.
+# A score only ever goes up, so flushes of different workers may be applied in
+# any order. If a flush is rolled back, its scores are a bit too high until it
+# is retried, which then brings the database up to them.
+#
+# Redis
+#   `RedisLeaderboard`, one sorted set per board, shared by all workers. Paging
+#   is ZREVRANGE, O(log n + page size). The sets are filled from the database
+#   on startup if they don't exist yet.
+#
+# Tests (mocker_hub_TEST_ENV)
+#   `MemoryLeaderboard`, sorted lists in process memory, rebuilt on startup.
+#
+# Repositories with the same downloads are ordered by ID in memory and by
+# ID in reverse lexicographic order in Redis.
+
+import bisect
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import redis as redis_sync
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.api.repo.repo_model import Repository, RepositoryBadge
+
+ALL_BOARD = "all"
+
+# Paging deeper than this is not supported. Leaderboards don't care, but the
+# database does when it has to answer instead (see `RepositoryService.find_popular`).
+POPULAR_MAX_OFFSET = 10000
+
+
+def boards_of(badge: RepositoryBadge) -> List[str]:
+    return [ALL_BOARD, badge.value]
+
+
+class Leaderboard:
+    """
+    Used until `init_leaderboard` is called: stores nothing, so popular repositories are read from the database.
+    """
+    def set_scores(self, board: str, scores: Dict[int, int]):
+        """
+        Sets the score of every repository ID in `scores`, unless it's already higher.
+        """
+        pass
+
+    def page(self, board: str, offset: int, limit: int) -> List[Tuple[int, int]] | None:
+        """
+        Up to `limit` (repository ID, score), highest first, skipping the first `offset`.
+        None if the leaderboard isn't available right now.
+        """
+        return None
+
+    def is_empty(self) -> bool:
+        return True
+
+
+class MemoryLeaderboard(Leaderboard):
+    def __init__(self):
+        self._boards: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        """
+        (-score, ID), sorted.
+        """
+        self._scores: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def set_scores(self, board: str, scores: Dict[int, int]):
+        with self._lock:
+            entries, current = self._boards[board], self._scores[board]
+            for id, score in scores.items():
+                old = current.get(id)
+                if old is not None:
+                    if old >= score:
+                        continue
+                    del entries[bisect.bisect_left(entries, (-old, id))]
+                current[id] = score
+                bisect.insort(entries, (-score, id))
+
+    def page(self, board: str, offset: int, limit: int) -> List[Tuple[int, int]]:
+        with self._lock:
+            return [(id, -negative) for negative, id in self._boards[board][offset:offset + limit]]
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return not any(self._scores.values())
+
+
+class RedisLeaderboard(Leaderboard):
+    def __init__(self, client: redis_sync.Redis, prefix: str):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, board: str) -> str:
+        return f"{self.prefix}:{board}"
+
+    def set_scores(self, board: str, scores: Dict[int, int]):
+        if not scores:
+            return
+        try:
+            self.client.zadd(self._key(board), {str(id): score for id, score in scores.items()}, gt=True)
+        except redis_sync.RedisError as e:
+            print(f"[!] Updating leaderboard '{board}' failed: {e}")
+
+    def page(self, board: str, offset: int, limit: int) -> List[Tuple[int, int]] | None:
+        try:
+            entries = self.client.zrevrange(self._key(board), offset, offset + limit - 1, withscores=True)
+        except redis_sync.RedisError:
+            return None
+        return [(int(id), int(score)) for id, score in entries]
+
+    def is_empty(self) -> bool:
+        return not self.client.exists(self._key(ALL_BOARD))
+
+
+def fill_leaderboard(board: Leaderboard, session: Session, batch_size: int = 1000):
+    """
+    Sets the scores of all public repositories, `batch_size` at a time.
+    """
+    scores: Dict[str, Dict[int, int]] = defaultdict(dict)
+
+    def write():
+        for name, board_scores in scores.items():
+            board.set_scores(name, board_scores)
+        scores.clear()
+
+    query = select(Repository.id, Repository.badge, Repository.downloads).where(Repository.public)
+    for i, row in enumerate(session.exec(query.execution_options(yield_per=batch_size)), 1):
+        for name in boards_of(row.badge):
+            scores[name][row.id] = row.downloads
+        if i % batch_size == 0:
+            write()
+    write()
+
+
+def add_repository_to_leaderboard(repo: Repository):
+    """
+    Call after a repository is added.
+    """
+    if repo.public:
+        for name in boards_of(repo.badge):
+            get_leaderboard().set_scores(name, {repo.id: repo.downloads})
+
+
+def record_leaderboard_scores(session: Session, deltas: Dict[int, int]):
+    """
+    `DownloadFlusher` listener. Reads back the new totals of the flushed repositories.
+    """
+    ids = sorted(deltas)
+    scores: Dict[str, Dict[int, int]] = defaultdict(dict)
+    for i in range(0, len(ids), 500):
+        query = select(Repository.id, Repository.badge, Repository.downloads).where(Repository.id.in_(ids[i:i + 500]), Repository.public)
+        for row in session.exec(query):
+            for name in boards_of(row.badge):
+                scores[name][row.id] = row.downloads
+
+    for name, board_scores in scores.items():
+        get_leaderboard().set_scores(name, board_scores)
+
+
+def get_leaderboard() -> Leaderboard:
+    return leaderboard
+
+
+leaderboard: Leaderboard = Leaderboard()
+
+if os.getenv('mocker_hub_TEST_ENV') is not None:
+    def init_leaderboard(engine: Engine):
+        """
+        Every call starts from scratch, so that tests don't see each other's repositories.
+        """
+        global leaderboard
+
+        leaderboard = MemoryLeaderboard()
+        with Session(engine) as session:
+            fill_leaderboard(leaderboard, session)
+else:
+    def init_leaderboard(engine: Engine):
+        global leaderboard
+
+        hostname = os.environ['REDIS_HOST']
+        port = os.environ['REDIS_PORT']
+        leaderboard = RedisLeaderboard(redis_sync.Redis.from_url(f"redis://{hostname}:{port}"), prefix="leaderboard")
+
+        # Every worker runs this on startup, but only the first one has anything to do.
+        # Filling it twice at the same time is harmless.
+        if leaderboard.is_empty():
+            with Session(engine) as session:
+                fill_leaderboard(leaderboard, session)
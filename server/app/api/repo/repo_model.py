@@ -1,5 +1,6 @@
 from datetime import datetime, timezone
 import enum
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship, SQLModel
 
 from app.api.org.org_model import Organization
@@ -7,6 +8,11 @@ from typing import TYPE_CHECKING, Optional
 if TYPE_CHECKING:
     from app.api.user.user_model import User
 
+# Official repositories can't have these names, because their canonical
+# names would clash with routes under /repositories/, e.g. /repositories/search.
+RESERVED_OFFICIAL_NAMES = {"search", "popular"}
+
+
 class RepositoryBadge(str, enum.Enum):
     none = "none"
     official = "official"
@@ -15,6 +21,15 @@ class RepositoryBadge(str, enum.Enum):
 
 
 class Repository(SQLModel, table=True):
+    __table_args__ = (
+        # Repositories of a user, most recently updated first, paged by
+        # (last_updated, id): see `RepositoryRepo.get_repositories_for_user_page`.
+        # Each of the two branches of that query (personal repositories,
+        # organization repositories) is answered by one of these.
+        Index("ix_repository_owner_id_last_updated_id", "owner_id", "last_updated", "id"),
+        Index("ix_repository_organization_id_last_updated_id", "organization_id", "last_updated", "id"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     name: str = Field()
     """
@@ -1,9 +1,112 @@
-from typing import List
-from sqlmodel import Session, or_, select
-from app.api.repo.repo_model import Repository
+from datetime import datetime
+from typing import Dict, List, Tuple
+from sqlalchemy import Row, case, func, literal, literal_column
+from sqlmodel import Session, false, or_, select, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.api.repo.repo_model import Repository, RepositoryBadge
+from app.api.repo.repo_dto import RepositoryDTO
 from app.api.user.user_model import User
 from app.api.org.org_model import Organization, OrganizationMembers
 
+def _repositories_for_user_query(user_id: int):
+    # Personal repositories of the user + repositories of every organization the user is a member of.
+    #
+    # Membership is checked with EXISTS (a semi-join) instead of joining `organization_members`:
+    # a join would emit an organization repository once per matching member row.
+    # The subquery is answered by the (user_id, organization_id) primary key of `organization_members`.
+    return select(Repository).where(
+        (Repository.organization_id.is_(None) & (Repository.owner_id == user_id))
+        | (Repository.organization_id.is_not(None) & _user_is_member_of_repo_org(user_id))
+    )
+
+
+def _user_is_member_of_repo_org(user_id: int):
+    return (
+        select(OrganizationMembers.organization_id)
+        .where(OrganizationMembers.organization_id == Repository.organization_id)
+        .where(OrganizationMembers.user_id == user_id)
+        .exists()
+    )
+
+
+def _visible_to(viewer_id: int | None):
+    # Same rules as `can_read_repo` (repo_service.py), as a WHERE clause.
+    if viewer_id is None:
+        return Repository.public
+    return or_(
+        Repository.public,
+        Repository.organization_id.is_(None) & (Repository.owner_id == viewer_id),
+        Repository.organization_id.is_not(None) & _user_is_member_of_repo_org(viewer_id),
+    )
+
+
+def _ext_by_canonical_name_query(canonical_name: str, viewer_id: int | None):
+    viewer_is_member = false() if viewer_id is None else _user_is_member_of_repo_org(viewer_id)
+
+    return (
+        select(
+            *[getattr(Repository, field) for field in RepositoryDTO.model_fields],
+            User.username.label("owner_name"),
+            Organization.name.label("org_name"),
+            viewer_is_member.label("viewer_is_member"),
+        )
+        .join(User, User.id == Repository.owner_id)
+        .join(Organization, Organization.id == Repository.organization_id, isouter=True)
+        .where(Repository.canonical_name == canonical_name)
+    )
+
+
+def _repositories_for_user_page_query(user_id: int, limit: int, after: Tuple[datetime, int] | None):
+    query = (
+        _repositories_for_user_query(user_id)
+        .order_by(Repository.last_updated.desc(), Repository.id.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(tuple_(Repository.last_updated, Repository.id) < tuple_(*after))
+    return query
+
+
+def _downloads_by_ids_query(ids: List[int]):
+    return select(Repository.id, Repository.downloads).where(Repository.id.in_(ids))
+
+
+def _search_query(query_text: str, words: List[str], viewer_id: int | None, limit: int, offset: int):
+    q = query_text.strip().lower()
+    tsquery = func.to_tsquery("simple", " & ".join(f"{word}:*" for word in words))
+    document = literal_column("repository.search_document")
+    name, canonical_name, desc = func.lower(Repository.name), func.lower(Repository.canonical_name), func.lower(Repository.desc)
+
+    # Each of these is answered by a GIN index, see `init_postgres_search`.
+    matches = or_(
+        document.op("@@")(tsquery),
+        name.op("%")(q),
+        canonical_name.op("%")(q),
+        literal(q).op("<%")(desc),
+    )
+
+    tier = case(
+        (or_(name == q, canonical_name == q), 0),
+        (or_(name.startswith(q, autoescape=True), canonical_name.startswith(q, autoescape=True)), 1),
+        else_=2,
+    )
+    badge_rank = case(
+        (Repository.badge == RepositoryBadge.official, 0),
+        (Repository.badge == RepositoryBadge.verified, 1),
+        else_=2,
+    )
+    relevance = func.ts_rank(document, tsquery) + func.greatest(func.similarity(name, q), func.similarity(canonical_name, q))
+
+    return (
+        select(Repository)
+        .where(matches)
+        .where(_visible_to(viewer_id))
+        .order_by(tier, badge_rank, Repository.downloads.desc(), relevance.desc(), Repository.id)
+        .offset(offset)
+        .limit(limit)
+    )
+
+
 class RepositoryRepo:
     def __init__(self, session: Session):
         self.session = session
@@ -20,15 +123,65 @@ class RepositoryRepo:
     def find_by_canonical_name(self, canonical_name: str) -> Repository | None:
         return self.session.exec(select(Repository).where(Repository.canonical_name == canonical_name)).first()
 
+    def find_ext_by_canonical_name(self, canonical_name: str, viewer_id: int | None) -> Row | None:
+        """
+        Read model for `RepositoryExtDTO`: one SELECT which returns exactly the DTO's
+        columns, plus `viewer_is_member` (is `viewer_id` a member of the repository's organization).
+        """
+        return self.session.exec(_ext_by_canonical_name_query(canonical_name, viewer_id)).first()
+
     def get_repositories_for_user(self, user_id: int):
-        query = (
-            select(Repository)
-            .join(Organization, Organization.id == Repository.organization_id, isouter=True)
-            .join(OrganizationMembers, OrganizationMembers.organization_id == Organization.id, isouter=True)
-            .where(
-                (OrganizationMembers.user_id == user_id) 
-                | (Repository.organization_id.is_(None) & (Repository.owner_id == user_id))  
-            )
-        )
+        return self.session.exec(_repositories_for_user_query(user_id)).all()
+
+    def get_repositories_for_user_page(self, user_id: int, limit: int, after: Tuple[datetime, int] | None) -> List[Repository]:
+        """
+        Same repositories as `get_repositories_for_user`, most recently updated first,
+        at most `limit` of them, starting right after the `(last_updated, id)` position `after`.
+        """
+        return self.session.exec(_repositories_for_user_page_query(user_id, limit, after)).all()
+
+    def search(self, query_text: str, words: List[str], viewer_id: int | None, limit: int, offset: int) -> List[Repository]:
+        """
+        Postgres only, see repo_search.py. `words` are the tokens of `query_text`.
+        """
+        return self.session.exec(_search_query(query_text, words, viewer_id, limit, offset)).all()
+
+    def find_popular(self, badge: RepositoryBadge | None, limit: int, offset: int) -> List[Repository]:
+        """
+        Public repositories, most downloaded first. Sorts the whole table, see repo_leaderboard.py instead.
+        """
+        query = select(Repository).where(Repository.public)
+        if badge is not None:
+            query = query.where(Repository.badge == badge)
+        return self.session.exec(query.order_by(Repository.downloads.desc(), Repository.id).offset(offset).limit(limit)).all()
+
+    def find_downloads_by_ids(self, ids: List[int]) -> Dict[int, int]:
+        return {row.id: row.downloads for row in self.session.exec(_downloads_by_ids_query(ids))}
+
+    def find_visible_by_ids(self, ids: List[int], viewer_id: int | None) -> List[Repository]:
+        """
+        Repositories with these IDs which `viewer_id` can see, in no particular order.
+        """
+        if not ids:
+            return []
+        return self.session.exec(select(Repository).where(Repository.id.in_(ids)).where(_visible_to(viewer_id))).all()
+
+
+class AsyncRepositoryRepo:
+    """
+    The queries of `RepositoryRepo` which async read endpoints need, for an `AsyncSession` (see `get_async_read_database`).
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def find_ext_by_canonical_name(self, canonical_name: str, viewer_id: int | None) -> Row | None:
+        return (await self.session.exec(_ext_by_canonical_name_query(canonical_name, viewer_id))).first()
+
+    async def get_repositories_for_user(self, user_id: int) -> List[Repository]:
+        return (await self.session.exec(_repositories_for_user_query(user_id))).all()
+
+    async def get_repositories_for_user_page(self, user_id: int, limit: int, after: Tuple[datetime, int] | None) -> List[Repository]:
+        return (await self.session.exec(_repositories_for_user_page_query(user_id, limit, after))).all()
 
-        return self.session.exec(query).all()
\ No newline at end of file
+    async def find_downloads_by_ids(self, ids: List[int]) -> Dict[int, int]:
+        return {row.id: row.downloads for row in await self.session.exec(_downloads_by_ids_query(ids))}
@@ -0,0 +1,184 @@
+# ----------------------------------------------
+# Repository search
+# ----------------------------------------------
+#
+# `GET /repositories/search?q=` matches the query against `name`,
+# `canonical_name` and `desc`. Every word of the query must match the start of
+# a word of the repository, e.g. `py fla` finds `python-flask`. On Postgres,
+# names within a small edit distance of the query match too (`pyhton`).
+#
+# Results are ordered by:
+#   1) match quality: exact name > name starts with the query > anything else,
+#   2) badge: official, then verified, then the rest,
+#   3) downloads,
+#   4) on Postgres, text relevance and similarity.
+#
+# Postgres
+#   `init_postgres_search` adds a generated `search_document` tsvector column
+#   to the repository table with a GIN index, and pg_trgm GIN indexes on
+#   `name`, `canonical_name` and `desc`, so that matching is index-only no
+#   matter how many repositories there are. See `RepositoryRepo.search`.
+#   It runs with the rest of the schema creation (`init_create_tables`) and
+#   only touches what's missing: adding the column rewrites the table under
+#   an ACCESS EXCLUSIVE lock, so that happens once, and the indexes are
+#   built CONCURRENTLY so reads and writes keep going meanwhile.
+#
+# Anything else (SQLite in tests and local development)
+#   `MemorySearchIndex`, an inverted index from words to repository IDs kept
+#   in process memory. It's rebuilt on startup and updated when a repository is
+#   added, so it's only correct with a single worker process.
+
+import bisect
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.api.repo.repo_model import Repository, RepositoryBadge
+
+# Paging deeper than this into search results is not supported.
+SEARCH_MAX_OFFSET = 1000
+
+BADGE_RANK = {
+    RepositoryBadge.official: 0,
+    RepositoryBadge.verified: 1,
+}
+OTHER_BADGE_RANK = 2
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def match_tier(query: str, name: str, canonical_name: str) -> int:
+    query, name, canonical_name = query.strip().lower(), name.lower(), canonical_name.lower()
+    if query in (name, canonical_name):
+        return 0
+    if name.startswith(query) or canonical_name.startswith(query):
+        return 1
+    return 2
+
+
+class MemorySearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        self._terms: List[str] = []
+        """
+        Sorted words of `_postings`, for prefix lookups.
+        """
+        self._names: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def rebuild(self, session: Session):
+        with self._lock:
+            self._postings.clear()
+            self._terms = []
+            self._names.clear()
+
+        query = select(Repository.id, Repository.name, Repository.canonical_name, Repository.desc)
+        for row in session.exec(query.execution_options(yield_per=1000)):
+            self.add(row.id, row.name, row.canonical_name, row.desc)
+
+    def add(self, id: int, name: str, canonical_name: str, desc: str):
+        with self._lock:
+            self._names[id] = (name, canonical_name)
+            for term in set(tokenize(f"{name} {canonical_name} {desc}")):
+                if term not in self._postings:
+                    bisect.insort(self._terms, term)
+                self._postings[term].add(id)
+
+    def search(self, query: str) -> Dict[int, int]:
+        """
+        Returns the IDs of matching repositories, with their match tier (see `match_tier`).
+        """
+        words = tokenize(query)
+        if not words:
+            return {}
+
+        with self._lock:
+            ids: Set[int] | None = None
+            for word in words:
+                matches = set()
+                i = bisect.bisect_left(self._terms, word)
+                while i < len(self._terms) and self._terms[i].startswith(word):
+                    matches |= self._postings[self._terms[i]]
+                    i += 1
+                ids = matches if ids is None else ids & matches
+                if not ids:
+                    return {}
+
+            return {id: match_tier(query, *self._names[id]) for id in ids}
+
+
+_SEARCH_DOCUMENT_DDL = """
+ALTER TABLE repository ADD COLUMN search_document tsvector
+GENERATED ALWAYS AS (
+    to_tsvector('simple', regexp_replace(lower(name || ' ' || canonical_name || ' ' || "desc"), '[^a-z0-9]+', ' ', 'g'))
+) STORED
+"""
+
+_SEARCH_INDEXES = {
+    "ix_repository_search_document": "repository USING GIN (search_document)",
+    "ix_repository_name_trgm": "repository USING GIN (lower(name) gin_trgm_ops)",
+    "ix_repository_canonical_name_trgm": "repository USING GIN (lower(canonical_name) gin_trgm_ops)",
+    "ix_repository_desc_trgm": "repository USING GIN (lower(\"desc\") gin_trgm_ops)",
+}
+
+
+def uses_postgres_search(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def init_postgres_search(engine: Engine):
+    """
+    Call after the repository table is created. Does nothing when everything is already there.
+    """
+    with engine.connect() as connection:
+        has_document = connection.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = 'repository' AND column_name = 'search_document'"
+        )).first() is not None
+        existing_indexes = set(connection.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'repository'"
+        )).scalars())
+
+    if not has_document:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            connection.execute(text(_SEARCH_DOCUMENT_DDL))
+
+    missing = [name for name in _SEARCH_INDEXES if name not in existing_indexes]
+    if missing:
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction.
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for name in missing:
+                connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {_SEARCH_INDEXES[name]}"))
+
+
+def init_search(engine: Engine):
+    """
+    Loads the in-memory index, unless Postgres does the searching.
+    """
+    global _memory_index_enabled
+
+    if not uses_postgres_search(engine):
+        with Session(engine) as session:
+            search_index.rebuild(session)
+        _memory_index_enabled = True
+
+
+def index_repository(repo: Repository):
+    """
+    Call after a repository is added.
+    """
+    if _memory_index_enabled:
+        search_index.add(repo.id, repo.name, repo.canonical_name, repo.desc)
+
+
+search_index = MemorySearchIndex()
+_memory_index_enabled = False
@@ -1,14 +1,27 @@
-from typing import List, Optional
+from datetime import datetime
+import orjson
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
 from fastapi import Depends
-from app.api.config.exception_handler import AccessDeniedException, FieldTakenException, NotFoundException
+from fastapi.concurrency import run_in_threadpool
+from app.api.config.exception_handler import AccessDeniedException, FieldTakenException, NotFoundException, UserException
 from sqlmodel import Session
 from app.api.config.database import get_database
+from app.api.config.replicas import blocking, get_async_read_database, get_read_database, read_router
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.api.user.user_model import User, UserRole
-from app.api.user.user_repo import UserRepo
-from app.api.repo.repo_repo import RepositoryRepo
-from app.api.repo.repo_model import Repository, RepositoryBadge
-from app.api.repo.repo_dto import RepositoryCreateDTO
-from app.api.org.org_repo import OrganizationRepo
+from app.api.user.user_repo import AsyncUserRepo, UserRepo
+from app.api.user.user_cache import user_cache
+from app.api.repo.repo_repo import AsyncRepositoryRepo, RepositoryRepo
+from app.api.repo.repo_model import RESERVED_OFFICIAL_NAMES, Repository, RepositoryBadge
+from app.api.repo.repo_dto import RepositoryCreateDTO, RepositoryDTO, RepositoryExtDTO
+from app.api.org.org_repo import AsyncOrganizationRepo, OrganizationRepo
+from app.api.org.org_cache import org_cache
+from app.api.repo.repo_cache import repo_cache
+from app.api.repo.repo_downloads import download_counter
+from app.api.repo.repo_search import BADGE_RANK, OTHER_BADGE_RANK, SEARCH_MAX_OFFSET, index_repository, search_index, tokenize, uses_postgres_search
+from app.api.config.pagination import decode_cursor, encode_cursor
+from app.api.autocomplete.autocomplete_index import autocomplete_index
+from app.api.repo.repo_leaderboard import ALL_BOARD, POPULAR_MAX_OFFSET, add_repository_to_leaderboard, get_leaderboard
  
 class RepositoryService:
     def __init__(self, session: Session):
@@ -17,12 +30,75 @@ class RepositoryService:
         self.user_repo = UserRepo(session)
         self.org_repo = OrganizationRepo(session)
 
+        # Organization IDs of users, looked up at most once per service (= once per request).
+        self._member_org_ids: Dict[int, FrozenSet[int]] = {}
+
     def find_by_canonical_name(self, canonical_name: str) -> Repository:
         repo = self.repo_repo.find_by_canonical_name(canonical_name)
         if repo is None:
             raise NotFoundException(Repository, canonical_name)
         return repo 
 
+    def find_ext_by_canonical_name(self, canonical_name: str, whos_asking_user_id: int | None) -> RepositoryExtDTO:
+        """
+        Finds the repository together with its owner's and organization's name in a single query.
+        Raises `NotFoundException` if it doesn't exist or if `whos_asking_user_id` cannot see it.
+        """
+        return RepositoryExtDTO.model_validate_json(self.find_ext_json_by_canonical_name(canonical_name, whos_asking_user_id))
+
+    def find_ext_json_by_canonical_name(self, canonical_name: str, whos_asking_user_id: int | None) -> bytes:
+        """
+        Same as `find_ext_by_canonical_name`, but returns the JSON of the `RepositoryExtDTO`.
+        """
+        return _with_pending_downloads(self._find_persisted_ext_json_by_canonical_name(canonical_name, whos_asking_user_id))
+
+    def count_pull(self, canonical_name: str, whos_asking_user_id: int | None):
+        """
+        Counts a download of the repository. Raises `NotFoundException` if `whos_asking_user_id` cannot see it.
+        """
+        body = self._find_persisted_ext_json_by_canonical_name(canonical_name, whos_asking_user_id)
+        download_counter.incr(orjson.loads(body)["id"])
+
+    def add_pending_downloads(self, repos: List[RepositoryDTO]):
+        """
+        Adds the downloads which haven't been flushed to the database yet to `repos`.
+        """
+        pending = download_counter.pending(repo.id for repo in repos) if download_counter.has_pending() else {}
+        for repo in repos:
+            repo.downloads += pending.get(repo.id, 0)
+
+    def add_downloads_json(self, body: bytes) -> bytes:
+        """
+        Sets `downloads` of the repositories in the JSON of an object with a `repos` list, e.g. a cached `ReposOfUserDTO`:
+        the persisted count (cached for a few seconds) plus the downloads which haven't been flushed to the database yet.
+        """
+        listing = orjson.loads(body)
+        ids = [repo["id"] for repo in listing["repos"]]
+        if not ids:
+            return body
+        return _set_downloads(listing, repo_cache.load_downloads(ids, self.repo_repo.find_downloads_by_ids))
+
+    def _find_persisted_ext_json_by_canonical_name(self, canonical_name: str, whos_asking_user_id: int | None) -> bytes:
+        # Public repositories look the same to everyone, so they're cached and
+        # concurrent requests for them share a single query. If it turns out
+        # not to be public, waiters have to run their own query.
+        loaded = False
+        row = None
+
+        def load() -> RepositoryExtDTO | None:
+            nonlocal loaded, row
+            loaded = True
+            row = self.repo_repo.find_ext_by_canonical_name(canonical_name, whos_asking_user_id)
+            return None if row is None else RepositoryExtDTO.model_validate(row._mapping)
+
+        cached = repo_cache.load_public_repo_json(canonical_name, load)
+        if cached is not None:
+            return cached
+
+        if not loaded:
+            row = self.repo_repo.find_ext_by_canonical_name(canonical_name, whos_asking_user_id)
+        return _readable_ext_json(row, canonical_name, whos_asking_user_id)
+
     def add(self, user_id: int, dto: RepositoryCreateDTO) -> Repository:
         # Find the User who's creating the repository.
 
@@ -30,6 +106,8 @@ class RepositoryService:
         if owner is None:
             raise NotFoundException(User, user_id)
         repo_is_official = owner.role == UserRole.admin 
+        if repo_is_official and dto.name in RESERVED_OFFICIAL_NAMES:
+            raise UserException(f"'{dto.name}' cannot be the name of an official repository")
 
         # Find the organization this repository is created for (if any).
 
@@ -42,7 +120,7 @@ class RepositoryService:
         # Check if user can add repo to this org (if any).
 
         if org_name is not None:
-            if not self.org_repo.user_is_in_org(user_id, dto.organization_id):
+            if dto.organization_id not in self._member_org_ids_of(user_id):
                 raise AccessDeniedException(f"User {user_id} cannot create repositories in organization {dto.organization_id}")
         
         # Compute the canonical name of the repository.
@@ -65,19 +143,129 @@ class RepositoryService:
             "badge": badge,
         })
 
-        return self.repo_repo.add(new_repo)
+        repo = self.repo_repo.add(new_repo)
+        read_router.mark_write(user_id)
+        index_repository(repo)
+        autocomplete_index.add_repository(repo, owner.username, org_name)
+        add_repository_to_leaderboard(repo)
+
+        # Listings of everyone who can see the repository through its owner/organization are outdated now.
+        affected_user_ids = [user_id] if org_name is None else self.org_repo.find_member_ids(dto.organization_id)
+        repo_cache.invalidate_repo(canonical_name, affected_user_ids)
+
+        return repo
     
     def get_repositories_of_user(self, user_id: int, whos_asking_user_id: int | None) -> List[Repository]:
         user_repos = self.repo_repo.get_repositories_for_user(user_id)
 
         # Filter out repositories which `whos_asking_user_id` cannot see.
+        return self.filter_readable_repos(user_repos, whos_asking_user_id)
+    
+    def filter_readable_repos(self, repos: Iterable[Repository], user_id: int | None) -> List[Repository]:
+        """
+        Same as keeping the repos for which `user_has_read_access_to_repo` is true, but
+        the organizations of `user_id` are loaded with a single query (and only if needed),
+        instead of one query per organization repository.
+        """
         result = []
-        for repo in user_repos:
-            if self.user_has_read_access_to_repo(repo, whos_asking_user_id):
+        for repo in repos:
+            needs_membership = not repo.public and user_id is not None and repo.organization_id is not None
+            member_org_ids = self._member_org_ids_of(user_id) if needs_membership else set()
+
+            if can_read_repo(repo, user_id, member_org_ids):
                 result.append(repo)
 
         return result
     
+    def _member_org_ids_of(self, user_id: int) -> FrozenSet[int]:
+        if user_id not in self._member_org_ids:
+            self._member_org_ids[user_id] = org_cache.load_org_ids_of_user(user_id, lambda: self.org_repo.find_org_ids_of_user(user_id))
+        return self._member_org_ids[user_id]
+    
+    def get_repositories_of_user_page(self, user_id: int, whos_asking_user_id: int | None, limit: int, cursor: str | None) -> Tuple[List[Repository], str | None]:
+        """
+        One page of `get_repositories_of_user`, most recently updated first.
+
+        Returns the repositories and the cursor of the next page (None if this is the last page).
+        """
+        after = _decode_repo_cursor(cursor)
+        result = []
+
+        # Some of the scanned repositories may be hidden from `whos_asking_user_id`,
+        # so keep scanning until the page is full or there's nothing left.
+        while True:
+            batch = self.repo_repo.get_repositories_for_user_page(user_id, limit, after)
+
+            for repo in self.filter_readable_repos(batch, whos_asking_user_id):
+                result.append(repo)
+                if len(result) == limit:
+                    is_last = len(batch) < limit and repo is batch[-1]
+                    return result, None if is_last else _encode_repo_cursor(repo)
+
+            if len(batch) < limit:
+                return result, None
+            after = (batch[-1].last_updated, batch[-1].id)
+
+    def iter_repositories_of_user(self, user_id: int, whos_asking_user_id: int | None, batch_size: int = 500) -> Iterator[Repository]:
+        """
+        All of `get_repositories_of_user`, loaded `batch_size` rows at a time.
+        Repositories are detached from the session once yielded, so memory stays flat.
+        """
+        after = None
+        while True:
+            batch = self.repo_repo.get_repositories_for_user_page(user_id, batch_size, after)
+
+            for repo in self.filter_readable_repos(batch, whos_asking_user_id):
+                yield repo
+            
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].last_updated, batch[-1].id)
+            for repo in batch:
+                self.session.expunge(repo)
+    
+    def search(self, query_text: str, whos_asking_user_id: int | None, limit: int, cursor: str | None) -> Tuple[List[Repository], str | None]:
+        """
+        Repositories matching `query_text` which `whos_asking_user_id` can see, best matches first (see repo_search.py).
+
+        Returns the repositories and the cursor of the next page (None if this is the last page).
+        """
+        offset = _decode_offset_cursor(cursor, SEARCH_MAX_OFFSET)
+        words = tokenize(query_text)
+        if not words:
+            return [], None
+
+        # One more than needed, to know whether there's a next page.
+        if uses_postgres_search(self.session.get_bind()):
+            repos = self.repo_repo.search(query_text, words, whos_asking_user_id, limit + 1, offset)
+        else:
+            tiers = search_index.search(query_text)
+            repos = self.repo_repo.find_visible_by_ids(list(tiers), whos_asking_user_id)
+            repos = sorted(repos, key=lambda r: (tiers[r.id], BADGE_RANK.get(r.badge, OTHER_BADGE_RANK), -r.downloads, r.id))
+            repos = repos[offset:offset + limit + 1]
+
+        has_next = len(repos) > limit and offset + limit < SEARCH_MAX_OFFSET
+        return repos[:limit], encode_cursor([offset + limit]) if has_next else None
+
+    def find_popular(self, badge: RepositoryBadge | None, limit: int, cursor: str | None) -> Tuple[List[Repository], str | None]:
+        """
+        Public repositories with `badge` (any, if None), most downloaded first (see repo_leaderboard.py).
+
+        Returns the repositories and the cursor of the next page (None if this is the last page).
+        """
+        offset = _decode_offset_cursor(cursor, POPULAR_MAX_OFFSET)
+
+        # One more than needed, to know whether there's a next page.
+        entries = get_leaderboard().page(ALL_BOARD if badge is None else badge.value, offset, limit + 1)
+        if entries is None:
+            repos = self.repo_repo.find_popular(badge, limit + 1, offset)
+        else:
+            by_id = {repo.id: repo for repo in self.repo_repo.find_visible_by_ids([id for id, _ in entries], None)}
+            repos = [by_id[id] for id, _ in entries if id in by_id]
+
+        has_next = len(repos) > limit and offset + limit < POPULAR_MAX_OFFSET
+        return repos[:limit], encode_cursor([offset + limit]) if has_next else None
+
     def user_has_read_access_to_repo(self, repo: Repository, user_id: int | None):
         if repo.public:
             return True
@@ -95,14 +283,200 @@ class RepositoryService:
         else:
             # For organization repositories, you must be a member of the same org.
 
-            user_is_in_org = self.org_repo.user_is_in_org(user_id, repo.organization_id)
-            if not user_is_in_org:
+            if repo.organization_id not in self._member_org_ids_of(user_id):
                 return False
             
             # TODO: Teams...
 
         return True # Just in case :)
+
+
+class AsyncRepositoryService:
+    """
+    The reads of `RepositoryService` behind the async endpoints (DATABASE_ASYNC, see config/database.py),
+    with their queries on the event loop. The read cache is synchronous, so it's called from the thread
+    pool; what it loads on a miss comes back to the event loop (see `blocking` in config/replicas.py).
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.repo_repo = AsyncRepositoryRepo(session)
+        self.user_repo = AsyncUserRepo(session)
+        self.org_repo = AsyncOrganizationRepo(session)
+
+        self._member_org_ids: Dict[int, FrozenSet[int]] = {}
+
+    async def find_user_id_by_username(self, username: str) -> int:
+        """
+        Same as `UserService.find_id_by_username`.
+        """
+        async def load():
+            user = await self.user_repo.find_by_username(username)
+            return None if user is None else user.id
+
+        id = await run_in_threadpool(user_cache.load_id_by_username, username, blocking(load))
+        if id is None:
+            raise NotFoundException(User, username)
+        return id
+
+    async def find_ext_json_by_canonical_name(self, canonical_name: str, whos_asking_user_id: int | None) -> bytes:
+        """
+        Same as `RepositoryService.find_ext_json_by_canonical_name`.
+        """
+        loaded = False
+        row = None
+
+        async def load() -> RepositoryExtDTO | None:
+            nonlocal loaded, row
+            loaded = True
+            row = await self.repo_repo.find_ext_by_canonical_name(canonical_name, whos_asking_user_id)
+            return None if row is None else RepositoryExtDTO.model_validate(row._mapping)
+
+        cached = await run_in_threadpool(repo_cache.load_public_repo_json, canonical_name, blocking(load))
+        if cached is None:
+            if not loaded:
+                row = await self.repo_repo.find_ext_by_canonical_name(canonical_name, whos_asking_user_id)
+            cached = _readable_ext_json(row, canonical_name, whos_asking_user_id)
+        return _with_pending_downloads(cached)
+
+    async def get_repositories_of_user(self, user_id: int, whos_asking_user_id: int | None) -> List[Repository]:
+        return await self._filter_readable_repos(await self.repo_repo.get_repositories_for_user(user_id), whos_asking_user_id)
+
+    async def get_repositories_of_user_page(self, user_id: int, whos_asking_user_id: int | None, limit: int, cursor: str | None) -> Tuple[List[Repository], str | None]:
+        """
+        Same as `RepositoryService.get_repositories_of_user_page`.
+        """
+        after = _decode_repo_cursor(cursor)
+        result = []
+
+        while True:
+            batch = await self.repo_repo.get_repositories_for_user_page(user_id, limit, after)
+
+            for repo in await self._filter_readable_repos(batch, whos_asking_user_id):
+                result.append(repo)
+                if len(result) == limit:
+                    is_last = len(batch) < limit and repo is batch[-1]
+                    return result, None if is_last else _encode_repo_cursor(repo)
+
+            if len(batch) < limit:
+                return result, None
+            after = (batch[-1].last_updated, batch[-1].id)
+
+    async def find_org_names_by_ids(self, ids: List[int]) -> Dict[int, str]:
+        return await self.org_repo.find_orgs_by_ids(ids)
+
+    async def add_downloads_json(self, body: bytes) -> bytes:
+        """
+        Same as `RepositoryService.add_downloads_json`.
+        """
+        listing = orjson.loads(body)
+        ids = [repo["id"] for repo in listing["repos"]]
+        if not ids:
+            return body
+        counts = await run_in_threadpool(repo_cache.load_downloads, ids, blocking(self.repo_repo.find_downloads_by_ids))
+        return _set_downloads(listing, counts)
+
+    async def _filter_readable_repos(self, repos: Iterable[Repository], user_id: int | None) -> List[Repository]:
+        # Same as `RepositoryService.filter_readable_repos`.
+        result = []
+        for repo in repos:
+            needs_membership = not repo.public and user_id is not None and repo.organization_id is not None
+            member_org_ids = await self._member_org_ids_of(user_id) if needs_membership else set()
+
+            if can_read_repo(repo, user_id, member_org_ids):
+                result.append(repo)
+
+        return result
+
+    async def _member_org_ids_of(self, user_id: int) -> FrozenSet[int]:
+        if user_id not in self._member_org_ids:
+            load = blocking(lambda: self.org_repo.find_org_ids_of_user(user_id))
+            self._member_org_ids[user_id] = await run_in_threadpool(org_cache.load_org_ids_of_user, user_id, load)
+        return self._member_org_ids[user_id]
+
+
+def _with_pending_downloads(body: bytes) -> bytes:
+    # Downloads which haven't been flushed to the database yet (see repo_downloads.py).
+    if not download_counter.has_pending():
+        return body
+
+    repo = orjson.loads(body)
+    pending = download_counter.pending([repo["id"]]).get(repo["id"], 0)
+    if pending == 0:
+        return body
+    repo["downloads"] += pending
+    return orjson.dumps(repo)
+
+
+def _set_downloads(listing: dict, counts: Dict[int, int]) -> bytes:
+    # `counts` are persisted, the pending downloads are added on top.
+    ids = [repo["id"] for repo in listing["repos"]]
+    pending = download_counter.pending(ids) if download_counter.has_pending() else {}
+    for repo in listing["repos"]:
+        repo["downloads"] = counts.get(repo["id"], 0) + pending.get(repo["id"], 0)
+    return orjson.dumps(listing)
+
+
+def _readable_ext_json(row, canonical_name: str, whos_asking_user_id: int | None) -> bytes:
+    # Row of `find_ext_by_canonical_name`.
+    if row is None:
+        raise NotFoundException(Repository, canonical_name)
+
+    member_org_ids = {row.organization_id} if row.viewer_is_member else set()
+    if not can_read_repo(row, whos_asking_user_id, member_org_ids):
+        raise NotFoundException(Repository, canonical_name)
+
+    return RepositoryExtDTO.model_validate(row._mapping).model_dump_json().encode()
+
+
+def _encode_repo_cursor(repo: Repository) -> str:
+    return encode_cursor([repo.last_updated.isoformat(), repo.id])
+
+
+def _decode_repo_cursor(cursor: str | None) -> Tuple[datetime, int] | None:
+    if cursor is None:
+        return None
+    values = decode_cursor(cursor)
+    try:
+        last_updated, id = values
+        return (datetime.fromisoformat(last_updated), int(id))
+    except (TypeError, ValueError):
+        raise UserException("Invalid cursor")
+
+
+def _decode_offset_cursor(cursor: str | None, max_offset: int) -> int:
+    if cursor is None:
+        return 0
+    values = decode_cursor(cursor)
+    if len(values) != 1 or not isinstance(values[0], int) or not 0 <= values[0] <= max_offset:
+        raise UserException("Invalid cursor")
+    return values[0]
+
+
+def can_read_repo(repo: Repository, user_id: int | None, member_org_ids: Set[int]) -> bool:
+    """
+    Same rules as `RepositoryService.user_has_read_access_to_repo`, but with the
+    organizations that `user_id` is a member of known in advance.
+    """
+    if repo.public:
+        return True
+    if user_id is None:
+        return False
+    if repo.organization_id is None:
+        return repo.owner_id == user_id
+    return repo.organization_id in member_org_ids
         
 
 def get_repo_service(session: Session = Depends(get_database)) -> RepositoryService:
-    return RepositoryService(session)
\ No newline at end of file
+    return RepositoryService(session)
+
+def get_repo_read_service(session: Session = Depends(get_read_database)) -> RepositoryService:
+    """
+    Read-only service, may be backed by a read replica.
+    """
+    return RepositoryService(session)
+
+async def get_async_repo_read_service(session: AsyncSession = Depends(get_async_read_database)) -> AsyncRepositoryService:
+    """
+    Read-only async service, may be backed by a read replica. Requires DATABASE_ASYNC.
+    """
+    return AsyncRepositoryService(session)
@@ -0,0 +1,24 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, Query
+
+from app.api.config.auth import ClaimsDepOptional
+from app.api.repo.repo_service import RepositoryService, get_repo_read_service
+from app.api.stats.stats_dto import PullStatsSeriesDTO
+from app.api.stats.stats_model import StatsGranularity
+from app.api.stats.stats_service import StatsService, get_stats_read_service
+
+router = APIRouter(prefix="/stats", tags=["stats"])
+
+@router.get("/repositories/{repo_canonical_name:path}", response_model=PullStatsSeriesDTO, status_code=200, summary="Downloads of a repository over time")
+def get_repo_pull_series(
+    claims: ClaimsDepOptional,
+    repo_canonical_name: str,
+    granularity: StatsGranularity = Query(default=StatsGranularity.day),
+    since: datetime | None = Query(default=None, description="Defaults to 48 hours, 30 days or a year before `until`, depending on `granularity`."),
+    until: datetime | None = Query(default=None, description="Exclusive. Defaults to now."),
+    repo_service: RepositoryService = Depends(get_repo_read_service),
+    stats_service: StatsService = Depends(get_stats_read_service),
+):
+    user_id = None if claims is None else claims.id
+    repo = repo_service.find_ext_by_canonical_name(repo_canonical_name, user_id)
+    return stats_service.get_pull_series(repo.id, repo.canonical_name, granularity, since, until)
@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import List
+from pydantic import BaseModel
+from app.api.stats.stats_model import StatsGranularity
+
+class PullStatsPointDTO(BaseModel):
+    bucket_start: datetime
+    count: int
+
+class PullStatsSeriesDTO(BaseModel):
+    repository_id: int
+    canonical_name: str
+    granularity: StatsGranularity
+    since: datetime
+    until: datetime
+    points: List[PullStatsPointDTO]
+    """
+    Only buckets with downloads, oldest first.
+    """
@@ -0,0 +1,50 @@
+from datetime import datetime
+import enum
+from sqlmodel import Field, SQLModel
+
+# All times here are naive UTC.
+
+
+class PullEvent(SQLModel, table=True):
+    """
+    Raw, append-only log of downloads: one row per repository per flush of the
+    download counter (see repo/repo_downloads.py), not one per pull.
+    Rolled up into `PullStats` and deleted after STATS_EVENT_RETENTION_DAYS.
+    """
+    __tablename__ = "pull_event"
+
+    id: int | None = Field(default=None, primary_key=True)
+    repository_id: int = Field(foreign_key="repository.id")
+    created_at: datetime = Field(index=True)
+    count: int = Field()
+
+
+class StatsGranularity(str, enum.Enum):
+    hour = "hour"
+    day = "day"
+    month = "month"
+
+
+class PullStats(SQLModel, table=True):
+    """
+    Number of downloads of a repository per hour/day/month.
+
+    The primary key is also the index of series queries: all buckets of one
+    repository and granularity in a time range are a single range scan.
+    """
+    __tablename__ = "pull_stats"
+
+    repository_id: int = Field(foreign_key="repository.id", primary_key=True)
+    granularity: StatsGranularity = Field(primary_key=True)
+    bucket_start: datetime = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
+class StatsRollupState(SQLModel, table=True):
+    """
+    How far `PullEvent`s have been rolled up. There's a single row.
+    """
+    __tablename__ = "stats_rollup_state"
+
+    id: int = Field(default=1, primary_key=True)
+    last_event_id: int = Field(default=0)
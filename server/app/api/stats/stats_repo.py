@@ -0,0 +1,114 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import Row, delete, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.api.stats.stats_model import PullEvent, PullStats, StatsGranularity, StatsRollupState
+
+# NOTE: Unlike other repos, nothing here commits. Events are written in the
+# transaction of the download flush, and rollups commit once at the end of a run.
+
+class StatsRepo:
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add_events(self, deltas: Dict[int, int], at: datetime):
+        """
+        Appends one `PullEvent` per repository. `deltas` maps repository IDs to numbers of downloads.
+        """
+        if not deltas:
+            return
+        rows = [{"repository_id": id, "created_at": at, "count": count} for id, count in deltas.items()]
+        self.session.connection().execute(insert(PullEvent.__table__), rows)
+
+    def find_series(self, repository_id: int, granularity: StatsGranularity, since: datetime, until: datetime) -> List[PullStats]:
+        """
+        Buckets in [since, until), oldest first. Answered by a range scan of the primary key.
+        """
+        query = (
+            select(PullStats)
+            .where(PullStats.repository_id == repository_id)
+            .where(PullStats.granularity == granularity)
+            .where(PullStats.bucket_start >= since)
+            .where(PullStats.bucket_start < until)
+            .order_by(PullStats.bucket_start)
+        )
+        return self.session.exec(query).all()
+
+    def get_rollup_state(self) -> StatsRollupState:
+        """
+        Locks the state row until the end of the transaction, so that only one worker rolls up at a time.
+        """
+        query = select(StatsRollupState).where(StatsRollupState.id == 1).with_for_update()
+        state = self.session.exec(query).first()
+        if state is not None:
+            return state
+
+        try:
+            with self.session.begin_nested():
+                self.session.add(StatsRollupState(id=1, last_event_id=0))
+        except IntegrityError:
+            # Another worker created it in the meantime.
+            pass
+        return self.session.exec(query).one()
+
+    def find_events_to_roll_up(self, after_id: int, created_before: datetime, limit: int) -> List[Row]:
+        """
+        Events after `after_id`, in order, up to the first one created at or after `created_before`.
+
+        Recent events are left alone because an event with a lower ID may still be
+        in an uncommitted transaction, and it would be skipped by the next run.
+        """
+        boundary = self.session.exec(
+            select(func.min(PullEvent.id))
+            .where(PullEvent.id > after_id)
+            .where(PullEvent.created_at >= created_before)
+        ).one()
+
+        query = (
+            select(PullEvent.id, PullEvent.repository_id, PullEvent.created_at, PullEvent.count)
+            .where(PullEvent.id > after_id)
+            .order_by(PullEvent.id)
+            .limit(limit)
+        )
+        if boundary is not None:
+            query = query.where(PullEvent.id < boundary)
+        return self.session.exec(query).all()
+
+    def add_to_buckets(self, totals: Dict[Tuple[int, StatsGranularity, datetime], int]):
+        """
+        Adds `totals[(repository_id, granularity, bucket_start)]` to the buckets, creating missing ones.
+        """
+        if not totals:
+            return
+
+        table = PullStats.__table__
+        dialect = postgresql if self.session.get_bind().dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.repository_id, table.c.granularity, table.c.bucket_start],
+            set_={"count": table.c.count + statement.excluded.count},
+        )
+
+        rows = [
+            {"repository_id": id, "granularity": granularity, "bucket_start": bucket_start, "count": count}
+            for (id, granularity, bucket_start), count in totals.items()
+        ]
+        self.session.connection().execute(statement, rows)
+
+    def delete_events(self, up_to_id: int, created_before: datetime) -> int:
+        result = self.session.exec(
+            delete(PullEvent)
+            .where(PullEvent.id <= up_to_id)
+            .where(PullEvent.created_at < created_before)
+        )
+        return result.rowcount
+
+    def delete_buckets(self, granularity: StatsGranularity, before: datetime) -> int:
+        result = self.session.exec(
+            delete(PullStats)
+            .where(PullStats.granularity == granularity)
+            .where(PullStats.bucket_start < before)
+        )
+        return result.rowcount
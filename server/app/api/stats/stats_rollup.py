@@ -0,0 +1,99 @@
+# ----------------------------------------------
+# Rollups of download statistics
+# ----------------------------------------------
+#
+# Downloads are logged as `PullEvent`s (see `record_pull_events`). Charts read
+# `PullStats` instead, which has one row per repository per hour, day and
+# month. `StatsRollup` is a background thread which, every
+# STATS_ROLLUP_SECONDS:
+#
+# 1) Adds the events logged since its last run to their hour, day and month
+#    buckets (one upsert per bucket), and remembers the last event it rolled up.
+#    Events younger than STATS_ROLLUP_GRACE_SECONDS wait for the next run, see
+#    `StatsRepo.find_events_to_roll_up`.
+# 2) Deletes rolled up events older than STATS_EVENT_RETENTION_DAYS, hourly
+#    buckets older than STATS_HOURLY_RETENTION_DAYS and daily buckets older
+#    than STATS_DAILY_RETENTION_DAYS. Monthly buckets are kept forever.
+#
+# All of it happens in one transaction, with the state row locked, so any
+# number of workers can run it: they just take turns.
+
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlmodel import Session
+
+from app.api.config.database import SessionLocal
+from app.api.stats.stats_model import StatsGranularity
+from app.api.stats.stats_repo import StatsRepo
+from app.api.stats.stats_service import bucket_start, utcnow
+
+STATS_ROLLUP_SECONDS = float(os.getenv('STATS_ROLLUP_SECONDS', '60'))
+STATS_ROLLUP_GRACE_SECONDS = float(os.getenv('STATS_ROLLUP_GRACE_SECONDS', '30'))
+STATS_ROLLUP_BATCH = int(os.getenv('STATS_ROLLUP_BATCH', '50000'))
+STATS_EVENT_RETENTION_DAYS = float(os.getenv('STATS_EVENT_RETENTION_DAYS', '7'))
+STATS_HOURLY_RETENTION_DAYS = float(os.getenv('STATS_HOURLY_RETENTION_DAYS', '90'))
+STATS_DAILY_RETENTION_DAYS = float(os.getenv('STATS_DAILY_RETENTION_DAYS', '1825'))
+
+
+class StatsRollup:
+    def __init__(self, session_factory: Callable[[], Session], interval: float):
+        self.session_factory = session_factory
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-rollup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[!] Rolling up download statistics failed, will retry: {e}")
+
+    def run(self, now: datetime | None = None) -> int:
+        """
+        Returns the number of events rolled up.
+        """
+        now = utcnow() if now is None else now
+
+        with self.session_factory() as session:
+            repo = StatsRepo(session)
+            state = repo.get_rollup_state()
+
+            events = repo.find_events_to_roll_up(state.last_event_id, now - timedelta(seconds=STATS_ROLLUP_GRACE_SECONDS), STATS_ROLLUP_BATCH)
+            totals = defaultdict(int)
+            for event in events:
+                for granularity in StatsGranularity:
+                    totals[(event.repository_id, granularity, bucket_start(event.created_at, granularity))] += event.count
+            repo.add_to_buckets(totals)
+            if events:
+                state.last_event_id = events[-1].id
+                session.add(state)
+
+            repo.delete_events(state.last_event_id, now - timedelta(days=STATS_EVENT_RETENTION_DAYS))
+            repo.delete_buckets(StatsGranularity.hour, now - timedelta(days=STATS_HOURLY_RETENTION_DAYS))
+            repo.delete_buckets(StatsGranularity.day, now - timedelta(days=STATS_DAILY_RETENTION_DAYS))
+
+            session.commit()
+
+        return len(events)
+
+
+stats_rollup = StatsRollup(SessionLocal, STATS_ROLLUP_SECONDS)
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+from fastapi import Depends
+from sqlmodel import Session
+from app.api.config.replicas import get_read_database
+from app.api.config.exception_handler import UserException
+from app.api.stats.stats_dto import PullStatsPointDTO, PullStatsSeriesDTO
+from app.api.stats.stats_model import StatsGranularity
+from app.api.stats.stats_repo import StatsRepo
+
+# Default time range of a series, and the longest one that may be requested.
+DEFAULT_RANGE = {
+    StatsGranularity.hour: timedelta(hours=48),
+    StatsGranularity.day: timedelta(days=30),
+    StatsGranularity.month: timedelta(days=365),
+}
+MAX_RANGE = {
+    StatsGranularity.hour: timedelta(days=31),
+    StatsGranularity.day: timedelta(days=3 * 365),
+    StatsGranularity.month: timedelta(days=50 * 365),
+}
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_naive_utc(at: datetime) -> datetime:
+    if at.tzinfo is None:
+        return at
+    return at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def bucket_start(at: datetime, granularity: StatsGranularity) -> datetime:
+    if granularity == StatsGranularity.hour:
+        return at.replace(minute=0, second=0, microsecond=0)
+    if granularity == StatsGranularity.day:
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+class StatsService:
+    def __init__(self, session: Session):
+        self.session = session
+        self.stats_repo = StatsRepo(session)
+
+    def get_pull_series(self, repository_id: int, canonical_name: str, granularity: StatsGranularity, since: datetime | None, until: datetime | None) -> PullStatsSeriesDTO:
+        """
+        Downloads of the repository per `granularity`, in [since, until).
+        Doesn't check whether anyone may see the repository, do that first.
+        """
+        until = utcnow() if until is None else to_naive_utc(until)
+        since = until - DEFAULT_RANGE[granularity] if since is None else to_naive_utc(since)
+
+        if since >= until:
+            raise UserException("`since` must be before `until`")
+        if until - since > MAX_RANGE[granularity]:
+            raise UserException(f"Time range is too long for granularity '{granularity.value}'")
+
+        # Include the bucket that `since` falls into.
+        since = bucket_start(since, granularity)
+
+        buckets = self.stats_repo.find_series(repository_id, granularity, since, until)
+        return PullStatsSeriesDTO(
+            repository_id=repository_id,
+            canonical_name=canonical_name,
+            granularity=granularity,
+            since=since,
+            until=until,
+            points=[PullStatsPointDTO(bucket_start=b.bucket_start, count=b.count) for b in buckets],
+        )
+
+
+def record_pull_events(session: Session, deltas: Dict[int, int]):
+    """
+    Listener of `DownloadFlusher`: appends the flushed downloads to the event log, in the same transaction.
+    """
+    StatsRepo(session).add_events(deltas, utcnow())
+
+
+def get_stats_read_service(session: Session = Depends(get_read_database)) -> StatsService:
+    """
+    Read-only service, may be backed by a read replica.
+    """
+    return StatsService(session)
@@ -0,0 +1,29 @@
+# ----------------------------------------------
+# Cache of user lookups
+# ----------------------------------------------
+#
+# Usernames never change and users are never deleted, so the ID of a username
+# can be cached for a long time without any invalidation.
+
+from typing import Callable
+
+from app.api.config.cache import get_read_cache
+from app.api.config.replicas import from_primary
+
+
+class UserCache:
+    EXPIRE_SECONDS = 600
+
+    def load_id_by_username(self, username: str, load: Callable[[], int | None]) -> int | None:
+        """
+        Returns the cached ID, or calls `load`. Unknown usernames (`load` returns None) are not cached.
+        """
+        def load_bytes():
+            id = load()
+            return None if id is None else str(id).encode()
+
+        cached = get_read_cache().get_or_load(f"user-id:{username}", from_primary(load_bytes), self.EXPIRE_SECONDS, lock=True)
+        return None if cached is None else int(cached)
+
+
+user_cache = UserCache()
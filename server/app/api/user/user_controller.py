@@ -4,8 +4,8 @@ from fastapi import APIRouter, Depends
 from app.api.user.user_dto import UserDTO, UserPasswordChangeDTO, UserRegisterDTO, UserLoginDTO, UserTokenDTO
 from app.api.user.user_service import UserService, get_user_service
 from app.api.user.user_model import UserRole
-from fastapi_cache.decorator import cache
-from app.api.config.auth import JWTBearer, JWTDep, get_id_from_jwt
+from app.api.config.cache import cache
+from app.api.config.auth import ClaimsDep
 from app.api.config.auth import pre_authorize
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -21,19 +21,18 @@ def login_user(dto: UserLoginDTO, user_service: UserService = Depends(get_user_s
 
 @router.post("/password", status_code=204, summary="Change the user's password")
 @pre_authorize([UserRole.user, UserRole.admin, UserRole.superadmin], ignore_password_change_requirement=True)
-def change_user_password(jwt: JWTDep, dto: UserPasswordChangeDTO, user_service: UserService = Depends(get_user_service)):
-    user_id = get_id_from_jwt(jwt)
-    user_service.change_password(user_id, dto)
+def change_user_password(claims: ClaimsDep, dto: UserPasswordChangeDTO, user_service: UserService = Depends(get_user_service)):
+    user_service.change_password(claims.id, dto)
 
 @router.post("/register-admin", response_model=UserDTO, summary="Register a new admin")
 @pre_authorize([UserRole.superadmin])
-def register_admin(jwt: JWTDep, dto: UserRegisterDTO, user_service: UserService = Depends(get_user_service)):
+def register_admin(claims: ClaimsDep, dto: UserRegisterDTO, user_service: UserService = Depends(get_user_service)):
     return user_service.add_admin(dto)
 
 @router.get("/test")
 @cache(expire=10)
 @pre_authorize([UserRole.superadmin])
-def test(jwt: JWTDep):
+def test(claims: ClaimsDep):
     return [
         { "id": 0, "name": "Aza" },
         { "id": 1, "name": "Bub" },
@@ -1,4 +1,5 @@
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.api.user.user_model import User, UserRole
 from app.api.config.exception_handler import NotFoundException
 
@@ -43,4 +44,15 @@ class UserRepo:
         self.session.add(user)
         self.session.commit()
         self.session.refresh(user)
-        return user
\ No newline at end of file
+        return user
+
+
+class AsyncUserRepo:
+    """
+    The queries of `UserRepo` which async read endpoints need, for an `AsyncSession` (see `get_async_read_database`).
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def find_by_username(self, username: str) -> User | None:
+        return (await self.session.exec(select(User).where(User.username == username))).first()
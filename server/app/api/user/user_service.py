@@ -3,10 +3,13 @@ from app.api.config.security import hash_password, verify_password
 from app.api.config.exception_handler import FieldTakenException, NotFoundException, UserException
 from sqlmodel import Session
 from app.api.config.database import get_database
+from app.api.config.replicas import get_read_database, read_router
 from app.api.user.user_dto import UserPasswordChangeDTO, UserRegisterDTO, UserLoginDTO, UserTokenDTO
 from app.api.user.user_model import User, UserRole
 from app.api.user.user_repo import UserRepo
 from app.api.config.auth import sign_jwt
+from app.api.user.user_cache import user_cache
+from app.api.autocomplete.autocomplete_index import autocomplete_index
 
 class UserService:
     def __init__(self, session: Session):
@@ -24,7 +27,9 @@ class UserService:
             "hashed_password":hashed_password
         })
 
-        return self.user_repo.add(new_user)
+        user = self.user_repo.add(new_user)
+        autocomplete_index.add_user(user)
+        return user
     
     def add_superadmin(self, dto: UserRegisterDTO) -> User:
         user = self.add(dto)
@@ -44,6 +49,7 @@ class UserService:
         
         hashed_password = hash_password(dto.new_password)
         user = self.user_repo.change_password(user, hashed_password)
+        read_router.mark_write(id)
 
         return
 
@@ -68,6 +74,19 @@ class UserService:
         if user is None:
             raise NotFoundException(User, username)
         return user      
+    
+    def find_id_by_username(self, username: str) -> int:
+        """
+        Same as `find_by_username(...).id`, but cached.
+        """
+        def load():
+            user = self.user_repo.find_by_username(username)
+            return None if user is None else user.id
+
+        id = user_cache.load_id_by_username(username, load)
+        if id is None:
+            raise NotFoundException(User, username)
+        return id
       
 
     def add_admin(self, dto: UserRegisterDTO) -> User:
@@ -76,4 +95,10 @@ class UserService:
         return user
 
 def get_user_service(session: Session = Depends(get_database)) -> UserService:
+    return UserService(session)
+
+def get_user_read_service(session: Session = Depends(get_read_database)) -> UserService:
+    """
+    Read-only service, may be backed by a read replica.
+    """
     return UserService(session)
\ No newline at end of file
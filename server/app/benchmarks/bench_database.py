@@ -0,0 +1,181 @@
+# ----------------------------------------------
+# Sync vs. async read endpoints
+# ----------------------------------------------
+#
+# See README.md in this folder for usage.
+#
+# Starts the server twice, without and with DATABASE_ASYNC (see
+# config/database.py), and sends both the same requests to the endpoints which
+# DATABASE_ASYNC moves onto the event loop:
+#
+#   GET /repositories/u/{username}
+#   GET /repositories/{canonical_name}
+#
+# Half of the requests are signed in as the owner, who also sees private
+# repositories: those aren't cached (see repo/repo_cache.py), so every one of
+# them reaches the database. Each mode reads its own, identically shaped users
+# and repositories, so the second run doesn't find the entries of the first
+# one in Redis.
+#
+# The server runs with the environment of the script: POSTGRES_*, REDIS_*
+# and JWT_SECRET must be set like for a real deployment. Seeded rows are left
+# in the database, under a prefix which is new for every run.
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel
+
+from app.api.config.auth import sign_jwt
+from app.api.org.org_model import Organization, OrganizationMembers
+from app.api.repo.repo_model import Repository
+from app.api.user.user_model import User
+
+MODES = ["sync", "async"]
+
+
+def seed(url: str, prefix: str, users: int, repos_per_user: int) -> Dict[str, List[User]]:
+    """
+    Every user has an organization. Every other repository belongs to it, every third one is private.
+    """
+    engine = create_engine(url)
+    SQLModel.metadata.create_all(engine)
+
+    seeded = {}
+    with Session(engine, expire_on_commit=False) as session:
+        for mode in MODES:
+            owners = [User(email=f"{prefix}-{mode}-u{i}@bench.com", username=f"{prefix}-{mode}-u{i}", hashed_password="-") for i in range(users)]
+            session.add_all(owners)
+            session.commit()
+
+            orgs = [Organization(name=f"{user.username}-org", owner_id=user.id) for user in owners]
+            session.add_all(orgs)
+            session.commit()
+
+            session.add_all([OrganizationMembers(user_id=user.id, organization_id=org.id) for user, org in zip(owners, orgs)])
+            for user, org in zip(owners, orgs):
+                for j in range(repos_per_user):
+                    in_org = j % 2 == 0
+                    owner_name = org.name if in_org else user.username
+                    session.add(Repository(
+                        name=f"r{j}",
+                        canonical_name=f"{owner_name}/r{j}",
+                        public=j % 3 != 0,
+                        owner_id=user.id,
+                        organization_id=org.id if in_org else None,
+                    ))
+            session.commit()
+            seeded[mode] = owners
+
+    engine.dispose()
+    return seeded
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_ASYNC"}
+    if mode == "async":
+        env["DATABASE_ASYNC"] = "1"
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.api.main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/v1/repositories/popular").status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+
+    server.terminate()
+    raise RuntimeError(f"The {mode} server didn't start")
+
+
+def random_request(owners: List[User], tokens: Dict[int, str], repos_per_user: int):
+    user = random.choice(owners)
+    headers = {"Authorization": f"Bearer {tokens[user.id]}"} if random.random() < 0.5 else {}
+
+    if random.random() < 0.5:
+        return f"/api/v1/repositories/u/{user.username}", headers
+
+    j = random.randrange(repos_per_user)
+    owner_name = f"{user.username}-org" if j % 2 == 0 else user.username
+    return f"/api/v1/repositories/{owner_name}/r{j}", headers
+
+
+async def run(port: int, owners: List[User], args) -> tuple:
+    tokens = {user.id: sign_jwt(user) for user in owners}
+    limit = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=httpx.Limits(max_connections=args.concurrency)) as client:
+        async def timed():
+            nonlocal errors
+            path, headers = random_request(owners, tokens, args.repos_per_user)
+            async with limit:
+                start = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+            # Private repositories are 404 when signed out.
+            if response.status_code not in (200, 404):
+                errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(timed() for _ in range(args.requests)))
+        wall = time.perf_counter() - start
+
+    return latencies, wall, errors
+
+
+def report(name: str, latencies: List[float], wall: float, errors: int):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{name:>6}: {len(latencies) / wall:8.1f} req/s   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms   mean {statistics.mean(latencies) * 1000:7.2f} ms   errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the sync and the async read endpoints against Postgres.")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes.")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--repos-per-user", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if os.getenv("mocker_hub_TEST_ENV") is not None:
+        parser.error("unset mocker_hub_TEST_ENV: this benchmark needs Postgres and Redis")
+
+    url = "postgresql://{}:{}@{}/{}".format(
+        os.environ["POSTGRES_USER"], os.environ["POSTGRES_PASSWORD"], os.environ.get("POSTGRES_HOST", "db"), os.environ["POSTGRES_DATABASE"],
+    )
+    seeded = seed(url, f"bench{uuid.uuid4().hex[:6]}", args.users, args.repos_per_user)
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.workers} worker(s), {args.users} users x {args.repos_per_user} repositories")
+
+    for mode in MODES:
+        server = start_server(mode, args.port, args.workers)
+        try:
+            report(mode, *asyncio.run(run(args.port, seeded[mode], args)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# ----------------------------------------------
+# Serializing large listings
+# ----------------------------------------------
+#
+# See README.md in this folder for usage.
+#
+# Measures the per-row cost of turning repositories loaded from the database
+# into the JSON body of `GET /repositories/u/{username}`, without the database
+# and the network:
+#
+#   validated   what controllers used to do: `model_validate` every row, then
+#               let FastAPI validate the result against `response_model` and
+#               encode it (`serialize_response` + `JSONResponse`).
+#   orjson      the same, with `ORJSONResponse` (the default response class now).
+#   construct   `model_construct` every row (no validation) and `json_response`.
+#   fast        `to_dtos` and `json_response` (config/fast_json.py).
+#   fast-rows   same as fast, but from rows of a column query instead of ORM objects.
+#
+# Loading rows of a column query instead of ORM objects is cheaper too, which
+# `--load` adds to every row's cost.
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel, select
+
+from app.api.config.fast_json import json_response, to_dtos
+from app.api.repo.repo_dto import ReposOfUserDTO, RepositoryDTO
+from app.api.repo.repo_model import Repository, RepositoryBadge
+from app.api.user.user_model import User
+
+_response_field = create_model_field(name="Response_get_repositories_of_user", type_=ReposOfUserDTO, mode="serialization")
+
+
+def seed(session: Session, rows: int):
+    session.add(User(id=1, email="u@bench.com", username="u", hashed_password="-"))
+    now = datetime.now(timezone.utc)
+    for i in range(rows):
+        session.add(Repository(
+            id=i + 1,
+            name=f"r{i}",
+            canonical_name=f"u/r{i}",
+            desc="A repository with a description of a realistic length." * 2,
+            public=i % 3 != 0,
+            owner_id=1,
+            badge=RepositoryBadge.none,
+            last_updated=now,
+            downloads=i * 7,
+        ))
+    session.commit()
+
+
+def validated(repos: List[Repository], response_class=JSONResponse) -> bytes:
+    dtos = [RepositoryDTO.model_validate(repo, from_attributes=True) for repo in repos]
+    result = ReposOfUserDTO(user_id=1, user_name="u", repos=dtos, organization_names={})
+    content = asyncio.run(serialize_response(field=_response_field, response_content=result, is_coroutine=False))
+    return response_class(content).body
+
+
+def constructed(repos: List[Repository]) -> bytes:
+    dtos = [RepositoryDTO.model_construct(**{name: getattr(repo, name) for name in RepositoryDTO.model_fields}) for repo in repos]
+    return json_response(ReposOfUserDTO.model_construct(user_id=1, user_name="u", repos=dtos, organization_names={}, next=None)).body
+
+
+def fast(repos: list) -> bytes:
+    dtos = to_dtos(RepositoryDTO, repos)
+    return json_response(ReposOfUserDTO.model_construct(user_id=1, user_name="u", repos=dtos, organization_names={}, next=None)).body
+
+
+def measure(fn: Callable[[], bytes], rows: int, rounds: int) -> List[float]:
+    """
+    Microseconds per row, one value per round.
+    """
+    fn()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) / rows * 1e6)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the ways of serializing a listing of repositories.")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--load", action="store_true", help="Load the rows from the database (in-memory SQLite) in every round.")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session, args.rows)
+
+    columns = [getattr(Repository, name) for name in RepositoryDTO.model_fields]
+
+    def load_repos():
+        with Session(engine) as session:
+            return session.exec(select(Repository)).all()
+
+    def load_rows():
+        with Session(engine) as session:
+            return session.exec(select(*columns)).all()
+
+    repos, rows = load_repos(), load_rows()
+    if args.load:
+        repos_of, rows_of = lambda: load_repos(), lambda: load_rows()
+    else:
+        repos_of, rows_of = lambda: repos, lambda: rows
+
+    # Same JSON, or it's not a fair comparison.
+    expected = ReposOfUserDTO.model_validate_json(validated(repos))
+    for body in [constructed(repos), fast(repos), fast(rows)]:
+        assert ReposOfUserDTO.model_validate_json(body) == expected
+
+    print(f"{args.rows} repositories per listing, {args.rounds} rounds, microseconds per row{', including loading' if args.load else ''}")
+    for name, fn in [
+        ("validated", lambda: validated(repos_of())),
+        ("orjson", lambda: validated(repos_of(), ORJSONResponse)),
+        ("construct", lambda: constructed(repos_of())),
+        ("fast", lambda: fast(repos_of())),
+        ("fast-rows", lambda: fast(rows_of())),
+    ]:
+        timings = measure(fn, args.rows, args.rounds)
+        print(f"{name:>10}: median {statistics.median(timings):7.2f} us   min {min(timings):7.2f} us")
+
+
+if __name__ == "__main__":
+    main()
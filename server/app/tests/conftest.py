@@ -0,0 +1,12 @@
+import pytest
+from sqlmodel import SQLModel
+
+
+@pytest.fixture(scope="function", autouse=True)
+def reset_db():
+    """
+    Every test starts with empty tables.
+    """
+    from app.api.config.database import engine
+    SQLModel.metadata.drop_all(bind=engine)
+    SQLModel.metadata.create_all(bind=engine)
@@ -0,0 +1,125 @@
+import time
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+import pytest
+import unittest.mock as mock
+
+
+import app.api.config.auth as auth
+from app.api.config.auth import JWTClaims, pre_authorize, sign_jwt
+from app.api.config.token_cache import VerifiedTokenCache
+from app.api.user.user_model import User, UserRole
+from app.api.main import app
+
+
+def create_claims(role: UserRole, must_change_password: bool = False) -> JWTClaims:
+    user = User(id=1, email="a@email.com", username="a", role=role, hashed_password="", must_change_password=must_change_password)
+    return JWTClaims.from_token(sign_jwt(user))
+
+
+def test_claims_from_token():
+    claims = create_claims(UserRole.admin)
+
+    assert claims.id == 1
+    assert claims.sub == "a"
+    assert claims.role == UserRole.admin.value
+    assert claims.must_change_password == False
+
+
+def test_pre_authorize_with_claims():
+    @pre_authorize([UserRole.admin])
+    def endpoint(claims):
+        return claims.id
+
+    assert endpoint(claims=create_claims(UserRole.admin)) == 1
+
+    with pytest.raises(HTTPException) as e:
+        endpoint(claims=create_claims(UserRole.user))
+    assert e.value.status_code == 403
+
+    with pytest.raises(HTTPException) as e:
+        endpoint(claims=create_claims(UserRole.admin, must_change_password=True))
+    assert e.value.detail == "Password change required"
+
+
+def test_token_decoded_once_per_request___integration():
+    with TestClient(app) as client:
+        data = {
+            "username": "u1",
+            "email": "u1@gmail.com",
+            "password": "1234"
+        }
+        client.post("/api/v1/users/", json=data)
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        auth.token_cache.clear()
+        with mock.patch.object(auth, "decode_jwt", wraps=auth.decode_jwt) as decode:
+            response = client.post("/api/v1/organizations", json={"name": "o1", "desc": "", "image": None}, headers=header)
+            assert response.is_success
+            assert decode.call_count == 1
+
+        auth.token_cache.clear()
+        with mock.patch.object(auth, "decode_jwt", wraps=auth.decode_jwt) as decode:
+            response = client.get("/api/v1/repositories/u/u1", headers=header)
+            assert response.is_success
+            assert decode.call_count == 1
+
+        # `ClaimsDep` of the endpoint and `ClaimsDepOptional` of `get_read_database` share one dependency.
+        with mock.patch.object(auth.JWTClaims, "from_token", wraps=auth.JWTClaims.from_token) as from_token:
+            response = client.get("/api/v1/organizations/my", headers=header)
+            assert response.is_success
+            assert from_token.call_count == 1
+
+
+def test_claims_required___integration():
+    with TestClient(app) as client:
+        response = client.get("/api/v1/organizations/my")
+        assert response.status_code == 403
+        assert response.json()["detail"] == "Invalid authorization code."
+
+
+def test_token_cache_hit_and_miss():
+    cache = VerifiedTokenCache(max_size=2, ttl=60)
+    claims = create_claims(UserRole.user)
+
+    assert cache.get("a") is None
+    cache.put("a", claims)
+    assert cache.get("a") is claims
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = VerifiedTokenCache(max_size=2, ttl=60)
+    claims = create_claims(UserRole.user)
+
+    cache.put("a", claims)
+    cache.put("b", claims)
+    cache.get("a")
+    cache.put("c", claims)
+
+    assert cache.get("a") is claims
+    assert cache.get("b") is None
+    assert cache.get("c") is claims
+
+
+def test_token_cache_respects_exp():
+    cache = VerifiedTokenCache(max_size=2, ttl=60)
+    claims = create_claims(UserRole.user)
+
+    cache.put("a", claims, exp=time.time() - 1)
+    assert cache.get("a") is None
+
+
+def test_token_decoded_once_across_requests___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        auth.token_cache.clear()
+        with mock.patch.object(auth, "decode_jwt", wraps=auth.decode_jwt) as decode:
+            for _ in range(3):
+                assert client.get("/api/v1/repositories/u/u1", headers=header).is_success
+            assert decode.call_count == 1
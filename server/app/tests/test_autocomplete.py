@@ -0,0 +1,112 @@
+from fastapi.testclient import TestClient
+import pytest
+
+from app.api.autocomplete.autocomplete_index import PrefixIndex, autocomplete_index
+from app.api.config.database import SessionLocal
+from app.api.main import app
+from app.api.repo.repo_downloads import download_counter, download_flusher
+from app.api.repo.repo_model import Repository
+from app.api.user.user_model import User
+from app.api.user.user_repo import UserRepo
+
+
+def test_prefix_index():
+    index = PrefixIndex(top_k=2, max_depth=3)
+    index.add("python", 10)
+    index.add("Pytorch", 30)
+    index.add("pypy", 20)
+    index.add("java", 5)
+
+    assert index.search("py", 5) == [("Pytorch", 30), ("pypy", 20)]
+    assert index.search("PY", 1) == [("Pytorch", 30)]
+    assert index.search("j", 5) == [("java", 5)]
+    assert index.search("rust", 5) == []
+
+    # Deeper than `max_depth`, all names below the node are considered.
+    assert index.search("pyth", 5) == [("python", 10)]
+    assert index.search("pyt", 5) == [("Pytorch", 30), ("python", 10)]
+    assert index.search("pytx", 5) == []
+
+    # Names which weren't in the top list get in when they're more popular.
+    index.incr("python", 100)
+    assert index.search("py", 5) == [("python", 110), ("Pytorch", 30)]
+
+    # Already there, so it's not reset.
+    index.add("python", 0)
+    assert index.popularity("python") == 110
+
+    index.incr("missing", 1)
+    assert "missing" not in index
+
+
+def test_autocomplete___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "pyuser", "email": "u1@gmail.com", "password": "1234"})
+        client.post("/api/v1/users/", json={"username": "pyother", "email": "u2@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "pyuser", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        # Created directly, to control downloads. The index is rebuilt on startup.
+        with SessionLocal() as session:
+            user_id = UserRepo(session).find_by_username("pyuser").id
+            for name, public, downloads in [("python", True, 10), ("pypy", True, 50), ("pysecret", False, 1000)]:
+                session.add(Repository(name=name, canonical_name=f"pyuser/{name}", public=public, downloads=downloads, owner_id=user_id))
+            session.commit()
+
+    with TestClient(app) as client:
+        def autocomplete(q, **params):
+            response = client.get("/api/v1/autocomplete", params={"q": q, **params})
+            assert response.status_code == 200
+            return {kind: [(item["name"], item["popularity"]) for item in items] for kind, items in response.json().items()}
+
+        assert autocomplete("PY") == {
+            "repositories": [("pyuser/pypy", 50), ("pyuser/python", 10)],
+            "users": [("pyuser", 2), ("pyother", 0)],
+            "organizations": [],
+        }
+        assert autocomplete("pyuser/p")["repositories"] == [("pyuser/pypy", 50), ("pyuser/python", 10)]
+        assert autocomplete("pyuser/p", limit=1)["repositories"] == [("pyuser/pypy", 50)]
+
+        # Added right away.
+        data = {"name": "pyextra", "desc": "", "public": True, "organization_id": None}
+        assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+        assert client.post("/api/v1/organizations/", json={"name": "pyorg", "desc": ""}, headers=header).is_success
+        client.post("/api/v1/users/", json={"username": "pynew", "email": "u3@gmail.com", "password": "1234"})
+
+        result = autocomplete("py")
+        assert result["users"] == [("pyuser", 3), ("pynew", 0), ("pyother", 0)]
+        assert result["organizations"] == [("pyorg", 0)]
+        assert autocomplete("pyuser/pye")["repositories"] == [("pyuser/pyextra", 0)]
+
+        # Flushed downloads count.
+        for _ in range(60):
+            assert client.post("/api/v1/repositories/pyuser/python/pulls").status_code == 204
+        download_flusher.flush()
+        assert autocomplete("pyuser/p")["repositories"][0] == ("pyuser/python", 70)
+
+        assert client.get("/api/v1/autocomplete", params={"q": ""}).status_code == 400
+        assert client.get("/api/v1/autocomplete", params={"q": "py", "limit": 100}).status_code == 400
+
+    assert not download_counter.has_pending()
+
+
+def test_autocomplete_refresh():
+    with SessionLocal() as session:
+        autocomplete_index.rebuild(session)
+        assert autocomplete_index.users.search("late", 5) == []
+
+    # As if added by another worker.
+    with SessionLocal() as session:
+        session.add(User(username="late", email="late@gmail.com", hashed_password="x"))
+        session.commit()
+        user_id = UserRepo(session).find_by_username("late").id
+        session.add(Repository(name="r", canonical_name="late/r", owner_id=user_id))
+        session.commit()
+
+        autocomplete_index.refresh(session)
+        assert autocomplete_index.users.search("late", 5) == [("late", 1)]
+        assert autocomplete_index.repositories.search("late/", 5) == [("late/r", 0)]
+
+        # Nothing is counted twice.
+        autocomplete_index.refresh(session)
+        assert autocomplete_index.users.search("late", 5) == [("late", 1)]
@@ -0,0 +1,319 @@
+import threading
+import time
+import unittest.mock as mock
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.api.config.cache import MemoryBackend, TwoTierBackend
+from app.api.config.read_cache import InvalidationBus, LocalLRU, MemoryReadCache, TwoTierReadCache
+from app.api.config.single_flight import SingleFlight
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeBus:
+    """
+    Stands in for `InvalidationBus`: delivers every message to all workers' LRUs right away.
+    """
+    def __init__(self):
+        self.locals = []
+        self.published = []
+
+    def join(self, local: LocalLRU):
+        self.locals.append(local)
+
+    def publish(self, keys=None, prefixes=None):
+        keys = keys or []
+        prefixes = prefixes or []
+        self.published.append((keys, prefixes))
+        for local in self.locals:
+            local.delete(*keys)
+            for prefix in prefixes:
+                local.delete_prefix(prefix)
+
+
+class FakeRemote:
+    """
+    Stands in for `RedisReadCache`.
+    """
+    prefix = "read-cache"
+
+    def __init__(self):
+        self.inner = MemoryReadCache(100)
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.inner.get(key)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+def test_local_lru_evicts_least_recently_used():
+    lru = LocalLRU(2)
+    lru.set("a", 1, 10)
+    lru.set("b", 2, 10)
+    lru.get("a")
+    lru.set("c", 3, 10)
+
+    assert lru.get("a") == 1
+    assert lru.get("b") is None
+    assert lru.get("c") == 3
+
+
+def test_local_lru_expires_entries():
+    lru = LocalLRU(10)
+    lru.set("a", 1, 5)
+
+    with mock.patch("app.api.config.read_cache.time.monotonic", return_value=10**9):
+        assert lru.get("a") is None
+    assert len(lru) == 0
+
+
+def test_local_lru_delete_prefix():
+    lru = LocalLRU(10)
+    lru.set("ns:a", 1, 10)
+    lru.set("ns:b", 2, 10)
+    lru.set("other", 3, 10)
+
+    assert lru.delete_prefix("ns:") == 2
+    assert lru.get("other") == 3
+
+
+def test_memory_read_cache_versions_survive_eviction():
+    read_cache = MemoryReadCache(1)
+    read_cache.bump_versions(["user:1"])
+    read_cache.set("a", b"1", 10)
+    read_cache.set("b", b"2", 10)
+
+    assert read_cache.get("a") is None
+    assert read_cache.get_versions(["user:1", "user:2"]) == {"user:1": 1, "user:2": 0}
+
+
+def test_two_tier_read_cache_serves_hits_locally():
+    remote, bus = FakeRemote(), FakeBus()
+    local = LocalLRU(10)
+    bus.join(local)
+    read_cache = TwoTierReadCache(remote, local, bus, local_ttl=5)
+
+    remote.inner.set("k", b"v", 60)
+    assert read_cache.get("k") == b"v"
+    assert read_cache.get("k") == b"v"
+    assert remote.gets == 1
+
+
+def test_two_tier_read_cache_invalidates_other_workers():
+    remote, bus = FakeRemote(), FakeBus()
+    worker1 = TwoTierReadCache(remote, LocalLRU(10), bus, local_ttl=5)
+    worker2 = TwoTierReadCache(remote, LocalLRU(10), bus, local_ttl=5)
+    bus.join(worker1.local)
+    bus.join(worker2.local)
+
+    worker1.set("k", b"v1", 60)
+    assert worker2.get("k") == b"v1"
+    assert worker2.get_versions(["user:1"]) == {"user:1": 0}
+
+    worker1.delete("k")
+    worker1.bump_versions(["user:1"])
+
+    assert worker2.get("k") is None
+    assert worker2.get_versions(["user:1"]) == {"user:1": 1}
+
+
+def test_two_tier_read_cache_get_many():
+    remote, bus = FakeRemote(), FakeBus()
+    read_cache = TwoTierReadCache(remote, LocalLRU(10), bus, local_ttl=5)
+
+    read_cache.set_many({"a": b"1", "b": b"2"}, 60)
+    remote.inner.set("c", b"3", 60)
+
+    assert read_cache.get_many(["a", "b", "c", "d"]) == [b"1", b"2", b"3", None]
+    assert read_cache.local.get("read-cache:c") == b"3"
+
+
+def test_two_tier_read_cache_doesnt_broadcast_fills():
+    remote, bus = FakeRemote(), FakeBus()
+    read_cache = TwoTierReadCache(remote, LocalLRU(10), bus, local_ttl=5)
+    bus.join(read_cache.local)
+
+    read_cache.set("k", b"v", 60)
+
+    assert bus.published == []
+    assert read_cache.get("k") == b"v"
+    assert remote.gets == 0
+
+
+def test_invalidation_bus_skips_its_own_messages():
+    local = LocalLRU(10)
+    bus = InvalidationBus(mock.MagicMock(), local)
+    other = InvalidationBus(mock.MagicMock(), LocalLRU(10))
+
+    bus.publish(keys=["a"])
+    sent = bus.client.publish.call_args.args[1]
+
+    local.set("a", b"mine", 10)
+    bus._on_message({"data": sent})
+    assert local.get("a") == b"mine"
+
+    other.publish(keys=["a"])
+    bus._on_message({"data": other.client.publish.call_args.args[1]})
+    assert local.get("a") is None
+
+
+@pytest.mark.anyio
+async def test_memory_backend():
+    backend = MemoryBackend(LocalLRU(10))
+    await backend.set("ns:a", b"1", expire=60)
+
+    ttl, value = await backend.get_with_ttl("ns:a")
+    assert value == b"1"
+    assert 0 < ttl <= 60
+
+    assert await backend.clear(namespace="ns:") == 1
+    assert await backend.get("ns:a") is None
+
+
+@pytest.mark.anyio
+async def test_two_tier_backend_serves_hits_locally_and_keeps_remote_ttl():
+    remote = mock.AsyncMock()
+    remote.get_with_ttl.return_value = (60, b"v")
+    bus = FakeBus()
+    local = LocalLRU(10)
+    bus.join(local)
+    backend = TwoTierBackend(remote, local, bus, local_ttl=5)
+
+    assert await backend.get_with_ttl("k") == (60, b"v")
+    ttl, value = await backend.get_with_ttl("k")
+
+    assert value == b"v"
+    assert 55 <= ttl <= 60
+    assert remote.get_with_ttl.await_count == 1
+
+
+@pytest.mark.anyio
+async def test_two_tier_backend_clear_is_broadcast():
+    remote = mock.AsyncMock()
+    remote.clear.return_value = 1
+    bus = FakeBus()
+    local = LocalLRU(10)
+    bus.join(local)
+    backend = TwoTierBackend(remote, local, bus, local_ttl=5)
+
+    await backend.set("ns:a", b"1", expire=60)
+    await backend.clear(namespace="ns:")
+
+    assert bus.published[-1] == ([], ["ns:"])
+    assert local.get("ns:a") is None
+
+
+def test_single_flight_shares_result():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(flights.do, "k", load) for _ in range(5)]
+        time.sleep(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(value == "value" for value, _ in results)
+    assert flights.in_flight() == 0
+
+
+def test_single_flight_shares_exception():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(flights.do, "k", load) for _ in range(3)]
+        time.sleep(0.2)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+
+    assert flights.in_flight() == 0
+
+
+def test_get_or_load_caches_and_skips_none():
+    read_cache = MemoryReadCache(10)
+    load = mock.MagicMock(return_value=b"v")
+
+    assert read_cache.get_or_load("k", load, expire=60) == b"v"
+    assert read_cache.get_or_load("k", load, expire=60) == b"v"
+    assert load.call_count == 1
+
+    missing = mock.MagicMock(return_value=None)
+    assert read_cache.get_or_load("missing", missing, expire=60) is None
+    assert read_cache.get_or_load("missing", missing, expire=60) is None
+    assert missing.call_count == 2
+
+
+def test_get_or_load_serves_stale_while_one_request_refreshes():
+    read_cache = MemoryReadCache(10)
+    read_cache.get_or_load("k", lambda: b"old", expire=60, stale=60)
+
+    later = time.time() + 90
+    with mock.patch("app.api.config.read_cache.time.time", return_value=later):
+        # Another request is already refreshing it.
+        with mock.patch.object(SingleFlight, "do_unless_in_flight", return_value=(None, False)):
+            assert read_cache.get_or_load("k", lambda: b"new", expire=60, stale=60) == b"old"
+
+        assert read_cache.get_or_load("k", lambda: b"new", expire=60, stale=60) == b"new"
+
+
+def test_get_or_load_waits_for_other_worker_holding_lock():
+    read_cache = MemoryReadCache(10)
+    read_cache.LOCK_POLL_SECONDS = 0.01
+    load = mock.MagicMock(return_value=b"mine")
+
+    def other_worker_loads(key, ttl):
+        threading.Timer(0.05, lambda: read_cache.set(key, b"0\ntheirs", 60)).start()
+        return None
+
+    with mock.patch.object(read_cache, "acquire_lock", side_effect=other_worker_loads):
+        value = read_cache.get_or_load("k", load, expire=60, lock=True)
+
+    # The value was written by the other worker with an expired envelope, but it's still what we waited for.
+    assert value == b"theirs"
+    load.assert_not_called()
+
+
+def test_get_or_load_stops_waiting_when_other_worker_loads_nothing():
+    read_cache = MemoryReadCache(10)
+    read_cache.LOCK_POLL_SECONDS = 0.01
+    load = mock.MagicMock(return_value=None)
+
+    # Locks shared with another worker, which holds the one of "k" for a moment and writes nothing (its `load` returned None).
+    locks = {"k": "theirs"}
+
+    def acquire_lock(key, ttl):
+        return None if key in locks else locks.setdefault(key, "mine")
+
+    threading.Timer(0.05, lambda: locks.pop("k")).start()
+    with mock.patch.object(read_cache, "acquire_lock", side_effect=acquire_lock), \
+            mock.patch.object(read_cache, "release_lock", side_effect=lambda key, token: locks.pop(key)):
+        started = time.monotonic()
+        value = read_cache.get_or_load("k", load, expire=60, lock=True)
+
+    assert value is None
+    assert time.monotonic() - started < read_cache.LOCK_SECONDS / 2
+    load.assert_called_once()
+    assert locks == {}
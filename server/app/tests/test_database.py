@@ -0,0 +1,51 @@
+import unittest.mock as mock
+
+from app.api.config.replicas import ReadRouter
+
+
+def test_read_router_without_replicas():
+    primary = mock.MagicMock()
+    router = ReadRouter(primary, [], sticky_seconds=5)
+
+    assert router.engine_for(None) is primary
+    assert router.engine_for(1) is primary
+
+
+def test_read_router_round_robin():
+    primary, replica1, replica2 = mock.MagicMock(), mock.MagicMock(), mock.MagicMock()
+    router = ReadRouter(primary, [replica1, replica2], sticky_seconds=5)
+
+    engines = [router.engine_for(1) for _ in range(4)]
+    assert engines == [replica1, replica2, replica1, replica2]
+
+
+def test_read_router_sticky_after_write():
+    primary, replica = mock.MagicMock(), mock.MagicMock()
+    router = ReadRouter(primary, [replica], sticky_seconds=5)
+
+    router.mark_write(1)
+    assert router.engine_for(1) is primary
+    assert router.engine_for(2) is replica
+    assert router.engine_for(None) is replica
+
+    with mock.patch("app.api.config.replicas.time.monotonic", return_value=10**9):
+        assert router.engine_for(1) is replica
+
+
+def test_cache_fills_read_from_primary():
+    from sqlalchemy import create_engine, text
+    import app.api.config.replicas as replicas
+
+    primary, replica = create_engine("sqlite://"), create_engine("sqlite://")
+    for engine, version in [(primary, 2), (replica, 1)]:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE t (version INTEGER)"))
+            connection.execute(text("INSERT INTO t VALUES (:version)"), {"version": version})
+
+    with mock.patch.object(replicas, "read_router", ReadRouter(primary, [replica], sticky_seconds=5)):
+        with replicas.read_session(1) as session:
+            load = lambda: session.execute(text("SELECT version FROM t")).scalar()
+
+            assert load() == 1
+            assert replicas.from_primary(load)() == 2
+            assert load() == 1
@@ -0,0 +1,470 @@
+import asyncio
+import base64
+from datetime import datetime
+import io
+import os
+import threading
+import time
+import unittest.mock as mock
+from fastapi.testclient import TestClient
+import pytest
+from PIL import Image
+
+from app.api.config.database import SessionLocal, get_database
+from app.api.config.exception_handler import PayloadTooLargeException, UserException
+from app.api.config.images import decode_inline_image, detect_image_format, generate_identicon, identicon_bitmask
+from app.api.image.image_repo import ImageRepo
+from app.api.image.image_service import ImageGarbageCollector, ImageService
+from app.api.image.image_store import ImageStore, digest_of, image_key, image_store
+from app.api.image.image_thumbnails import IMAGES_THUMBNAIL_SIZES, THUMBNAIL_FORMAT, ThumbnailWorker, make_thumbnails, thumbnail_key
+from app.api.image.image_upload import ImageUpload, receive_image
+from app.api.org.org_dto import OrganizationDTOBasic
+from app.api.main import app
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(str(tmp_path))
+
+
+@pytest.fixture
+def thumbnails(store):
+    return ThumbnailWorker(store, [16], workers=0)
+
+
+PNG = generate_identicon("some org")
+
+
+def test_identicon_bitmask():
+    # Even digits are filled, each half-row is mirrored.
+    assert identicon_bitmask("0123", 4) == bytes([
+        1, 0, 0, 1,
+        1, 0, 0, 1,
+        1, 0, 0, 1,
+        1, 0, 0, 1,
+    ])
+    assert identicon_bitmask("2244", 3) == bytes([
+        1, 0, 1,
+        1, 0, 1,
+        1, 0, 1,
+    ])
+    # Rows start where the previous one would end, wrapping around the digits.
+    assert identicon_bitmask("01", 5)[0:5] == bytes([1, 0, 0, 0, 1])
+    assert identicon_bitmask("01", 5)[5:10] == bytes([0, 1, 0, 1, 0])
+
+
+def test_identicon():
+    png = generate_identicon("some org", size=100, block_size=16)
+    assert detect_image_format(png) == "png"
+    assert generate_identicon("some org", size=100, block_size=16) is png
+
+    image = Image.open(io.BytesIO(png)).convert("RGB")
+    assert image.size == (100, 100)
+    # 6 blocks of 16 pixels, the last 4 pixels are white.
+    assert image.getpixel((99, 50)) == (255, 255, 255)
+    assert image.getpixel((50, 99)) == (255, 255, 255)
+    assert generate_identicon("some org") != png
+
+
+def test_detect_image_format():
+    assert detect_image_format(PNG) == "png"
+    assert detect_image_format(b"\xff\xd8\xff\xe0" + b"\0" * 16) == "jpeg"
+    assert detect_image_format(b"GIF89a" + b"\0" * 16) == "gif"
+    assert detect_image_format(b"RIFF\0\0\0\0WEBPVP8 ") == "webp"
+    assert detect_image_format(b"<svg></svg>") is None
+    assert detect_image_format(b"") is None
+
+
+def test_decode_inline_image():
+    assert decode_inline_image("data:image/png;base64,aGk=") == b"hi"
+
+    for invalid in ["aGk=", "data:image/png;base64,***"]:
+        with pytest.raises(UserException):
+            decode_inline_image(invalid)
+
+
+def test_add_deduplicates(store, thumbnails):
+    with SessionLocal() as session:
+        service = ImageService(session, store, thumbnails)
+        key = service.add(PNG)
+        assert service.add(PNG) == key
+        session.commit()
+
+        digest = key.rsplit("/", 1)[1].split(".")[0]
+        assert key == f"{digest[:2]}/{digest[2:4]}/{digest}.png"
+        assert ImageRepo(session).find(digest).refcount == 2
+
+    with open(store.path_of(key), "rb") as f:
+        assert f.read() == PNG
+    # Nothing but the image and its thumbnail: no leftover temporary files.
+    assert sorted(os.listdir(os.path.dirname(store.path_of(key)))) == [f"{digest}.png", f"{digest}.png.16.{THUMBNAIL_FORMAT}"]
+
+
+def test_add_not_an_image(store, thumbnails):
+    with SessionLocal() as session:
+        with pytest.raises(UserException):
+            ImageService(session, store, thumbnails).add(b"<svg></svg>")
+
+
+def test_collect_garbage(store, thumbnails):
+    other = generate_identicon("other org")
+
+    with SessionLocal() as session:
+        service = ImageService(session, store, thumbnails)
+        key, other_key = service.add(PNG), service.add(other)
+        service.add(PNG)
+        session.commit()
+
+        service.release(key)
+        service.release(other_key)
+        session.commit()
+
+        # Still referenced once, or not long enough ago.
+        assert service.collect_garbage(grace_seconds=3600) == 0
+        assert service.collect_garbage(grace_seconds=-1) == 1
+        assert store.exists(key)
+        assert not store.exists(other_key)
+        assert not store.exists(thumbnail_key(other_key, 16))
+
+        # Stored again after it was deleted.
+        assert service.add(other) == other_key
+        session.commit()
+        assert store.exists(other_key)
+
+
+def _add_unused_images(store, thumbnails, count: int):
+    keys = []
+    with SessionLocal() as session:
+        service = ImageService(session, store, thumbnails)
+        keys = [service.add(generate_identicon(f"unused {i}")) for i in range(count)]
+        session.commit()
+        for key in keys:
+            service.release(key)
+        session.commit()
+    return keys
+
+
+def test_image_garbage_collector_deletes_every_batch(store, thumbnails):
+    keys = _add_unused_images(store, thumbnails, 5)
+    collector = ImageGarbageCollector(SessionLocal, interval=3600, batch_size=2, store=store, thumbnails=thumbnails)
+
+    assert collector.collect(grace_seconds=-1) == 5
+    assert not any(store.exists(key) for key in keys)
+    with SessionLocal() as session:
+        assert ImageRepo(session).lock_garbage(datetime.max, 100) == []
+    assert collector.collect(grace_seconds=-1) == 0
+    assert collector.stats() == {"runs": 2, "failures": 0, "deleted": 5}
+
+
+def test_image_garbage_collector_runs_periodically(store, thumbnails):
+    collector = ImageGarbageCollector(SessionLocal, interval=0.01, batch_size=10, store=store, thumbnails=thumbnails)
+    collector.collect = mock.MagicMock(return_value=0)
+
+    collector.start()
+    deadline = time.time() + 5
+    while collector.collect.call_count < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    collector.stop()
+
+    assert collector.collect.call_count >= 3
+    calls = collector.collect.call_count
+    time.sleep(0.05)
+    assert collector.collect.call_count == calls
+
+
+def _register_with_org(client: TestClient, username: str) -> tuple:
+    client.post("/api/v1/users/", json={"username": username, "email": f"{username}@gmail.com", "password": "1234"})
+    response = client.post("/api/v1/users/login", json={"username": username, "password": "1234"})
+    headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    org = client.post("/api/v1/organizations", json={"name": f"{username}-org", "desc": ""}, headers=headers).json()
+    return headers, org
+
+
+def test_upload_org_image_holds_no_connection_while_receiving():
+    sessions = []
+
+    def recording_get_database():
+        for session in get_database():
+            sessions.append(session)
+            yield session
+
+    in_transaction = []
+
+    async def recording_receive_image(request):
+        in_transaction.append([session.in_transaction() for session in sessions])
+        return await receive_image(request)
+
+    with TestClient(app) as client:
+        headers, org = _register_with_org(client, "u1")
+
+        app.dependency_overrides[get_database] = recording_get_database
+        try:
+            with mock.patch("app.api.org.org_controller.receive_image", recording_receive_image):
+                image = generate_identicon("some other image")
+                response = client.put(f"/api/v1/organizations/{org['id']}/image", files={"image": ("a.png", image, "image/png")}, headers=headers)
+        finally:
+            del app.dependency_overrides[get_database]
+
+        assert response.status_code == 200
+        # The ownership check ran on the session, and gave its connection back before the body was read.
+        assert in_transaction == [[False]]
+
+
+def test_upload_org_image_stores_nothing_when_the_commit_fails():
+    with TestClient(app) as client:
+        headers, org = _register_with_org(client, "u1")
+
+        image = generate_identicon("never committed")
+        with mock.patch("app.api.org.org_repo.OrganizationRepo.set_image", side_effect=RuntimeError("commit failed")):
+            with pytest.raises(RuntimeError):
+                client.put(f"/api/v1/organizations/{org['id']}/image", files={"image": ("a.png", image, "image/png")}, headers=headers)
+
+        assert not image_store.exists(image_key(digest_of(image), "png"))
+        assert not [name for name in os.listdir(image_store.root) if name.startswith(".upload-")]
+        with SessionLocal() as session:
+            assert ImageRepo(session).find(digest_of(image)) is None
+
+
+def png_of_size(width: int, height: int) -> bytes:
+    buffered = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def test_make_thumbnails(store):
+    big, small = "aa/bb/big.png", "aa/bb/small.png"
+    store.write(big, png_of_size(300, 150))
+    store.write(small, png_of_size(20, 20))
+
+    assert make_thumbnails(store, big, [32, 128]) == 2
+    assert make_thumbnails(store, small, [32, 128]) == 2
+    # Made once.
+    assert make_thumbnails(store, big, [32, 128]) == 0
+
+    for key, size, expected in [(big, 128, (128, 64)), (big, 32, (32, 16)), (small, 128, (20, 20))]:
+        with Image.open(store.path_of(thumbnail_key(key, size))) as image:
+            assert image.format == THUMBNAIL_FORMAT.upper()
+            assert image.size == expected
+
+    # Deleted with the image.
+    store.delete(big)
+    assert not store.exists(thumbnail_key(big, 32))
+    assert store.exists(thumbnail_key(small, 32))
+
+
+def test_make_thumbnails_skips_huge_images(store):
+    import app.api.image.image_thumbnails as image_thumbnails
+
+    key = "aa/bb/huge.png"
+    store.write(key, png_of_size(300, 300))
+
+    # Refused before decoding, by our limit or by Pillow's.
+    with mock.patch.object(image_thumbnails, "IMAGES_THUMBNAIL_MAX_PIXELS", 200 * 200), mock.patch.object(Image.Image, "load") as load:
+        assert make_thumbnails(store, key, [32]) == 0
+        load.assert_not_called()
+    with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 100 * 100):
+        assert make_thumbnails(store, key, [32]) == 0
+    assert not store.exists(thumbnail_key(key, 32))
+
+    assert make_thumbnails(store, key, [32]) == 1
+
+
+def test_make_thumbnails_of_other_formats(store):
+    for key, format, mode in [("aa/bb/photo.jpg", "JPEG", "RGB"), ("aa/bb/palette.gif", "GIF", "P")]:
+        buffered = io.BytesIO()
+        Image.new(mode, (400, 200)).save(buffered, format=format)
+        store.write(key, buffered.getvalue())
+
+        assert make_thumbnails(store, key, [64]) == 1
+        with Image.open(store.path_of(thumbnail_key(key, 64))) as image:
+            assert image.size == (64, 32)
+
+
+def test_thumbnail_worker(store):
+    key = "aa/bb/image.png"
+    store.write(key, png_of_size(100, 100))
+
+    worker = ThumbnailWorker(store, [16, 32], workers=2)
+    worker.submit(key)
+    assert not store.exists(thumbnail_key(key, 16))
+
+    worker.start()
+    worker.submit(key)
+    deadline = time.monotonic() + 10
+    while not store.exists(thumbnail_key(key, 16)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    assert store.exists(thumbnail_key(key, 16)) and store.exists(thumbnail_key(key, 32))
+
+    # A broken image doesn't stop the worker.
+    store.write("aa/bb/broken.png", b"\x89PNG\r\n\x1a\n")
+    ThumbnailWorker(store, [16], workers=0).submit("aa/bb/broken.png")
+
+
+def test_org_dto_image_variants():
+    org = OrganizationDTOBasic(id=1, name="o", desc="", image="aa/bb/image.png", owner_id=1)
+    assert org.image_variants == {size: thumbnail_key("aa/bb/image.png", size) for size in IMAGES_THUMBNAIL_SIZES}
+    assert org.model_dump()["image_variants"] == org.image_variants
+
+    # Older images don't have any.
+    assert OrganizationDTOBasic(id=1, name="o", desc="", image="org-o.png", owner_id=1).image_variants == {}
+
+
+def test_org_images_integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        # The same image, claimed to be a JPEG by one of them.
+        inline_image = base64.b64encode(generate_identicon("x")).decode()
+        images = []
+        for name, image in [("org-a", f"data:image/png;base64,{inline_image}"), ("org-b", f"data:image/jpeg;base64,{inline_image}")]:
+            response = client.post("/api/v1/organizations", json={"name": name, "desc": "", "image": image}, headers=header)
+            assert response.status_code == 200
+            images.append(response.json()["image"])
+
+        assert images[0] == images[1]
+        assert images[0].endswith(".png")
+        assert image_store.exists(images[0])
+
+        response = client.post("/api/v1/organizations", json={"name": "org-c", "desc": "", "image": "data:image/png;base64,aGk="}, headers=header)
+        assert response.status_code == 400
+
+
+class FakeRequest:
+    """
+    Just enough of a `Request` for `receive_image`: sends the body in small chunks and counts how many were read.
+    """
+    def __init__(self, body: bytes, content_type: str, content_length: int | None = None, chunk_size: int = 7):
+        self.headers = {"content-type": content_type}
+        if content_length is not None:
+            self.headers["content-length"] = str(content_length)
+        self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+        self.read = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+def multipart_body(fields: list) -> bytes:
+    body = b""
+    for name, content in fields:
+        body += b"--BOUNDARY\r\n"
+        body += f'Content-Disposition: form-data; name="{name}"; filename="{name}.png"\r\n'.encode()
+        body += b"Content-Type: application/octet-stream\r\n\r\n"
+        body += content + b"\r\n"
+    return body + b"--BOUNDARY--\r\n"
+
+
+MULTIPART = "multipart/form-data; boundary=BOUNDARY"
+
+
+def test_receive_image(store):
+    for request in [
+        FakeRequest(multipart_body([("other", b"not this one"), ("image", PNG)]), MULTIPART),
+        FakeRequest(PNG, "image/png"),
+    ]:
+        with asyncio.run(receive_image(request, store=store)) as upload:
+            assert (upload.ext, upload.size, upload.digest) == ("png", len(PNG), digest_of(PNG))
+            with open(upload.path, "rb") as f:
+                assert f.read() == PNG
+        assert os.listdir(store.root) == []
+
+
+def test_receive_image_writes_off_the_event_loop(store):
+    threads = []
+    write = ImageUpload.write
+
+    def traced_write(self, chunk):
+        threads.append(threading.get_ident())
+        write(self, chunk)
+
+    async def receive():
+        with mock.patch.object(ImageUpload, "write", traced_write):
+            with await receive_image(FakeRequest(PNG, "image/png"), store=store):
+                return threading.get_ident()
+
+    loop_thread = asyncio.run(receive())
+    assert threads and loop_thread not in threads
+
+
+def test_receive_image_stops_early(store):
+    # Not an image: found out from the first bytes.
+    request = FakeRequest(b"<svg>" + b" " * 1000 + b"</svg>", "image/svg+xml")
+    with pytest.raises(UserException):
+        asyncio.run(receive_image(request, store=store))
+    assert request.read == 2
+
+    # Too big: found out as soon as it's past the limit, or before reading anything.
+    request = FakeRequest(PNG * 10, "image/png")
+    with pytest.raises(PayloadTooLargeException):
+        asyncio.run(receive_image(request, store=store, max_size=len(PNG)))
+    assert request.read == len(PNG) // 7 + 1
+
+    request = FakeRequest(PNG * 10, "image/png", content_length=len(PNG) * 10)
+    with pytest.raises(PayloadTooLargeException):
+        asyncio.run(receive_image(request, store=store, max_size=len(PNG)))
+    assert request.read == 0
+
+    for body in [multipart_body([("image", PNG), ("image", PNG)]), multipart_body([("other", PNG)]), b"garbage"]:
+        with pytest.raises(UserException):
+            asyncio.run(receive_image(FakeRequest(body, MULTIPART), store=store))
+
+    assert os.listdir(store.root) == []
+
+
+def test_upload_org_image_integration():
+    with TestClient(app) as client:
+        headers = {}
+        for username in ["u1", "u2"]:
+            client.post("/api/v1/users/", json={"username": username, "email": f"{username}@gmail.com", "password": "1234"})
+            response = client.post("/api/v1/users/login", json={"username": username, "password": "1234"})
+            headers[username] = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        response = client.post("/api/v1/organizations", json={"name": "org-a", "desc": ""}, headers=headers["u1"])
+        org = response.json()
+        identicon_key = org["image"]
+        # Cache the organizations of u1.
+        assert client.get("/api/v1/organizations/my", headers=headers["u1"]).json()[0]["image"] == identicon_key
+
+        image = generate_identicon("some other image")
+        response = client.put(f"/api/v1/organizations/{org['id']}/image", files={"image": ("a.png", image, "image/png")}, headers=headers["u1"])
+        assert response.status_code == 200
+        key = response.json()["image"]
+        assert key != identicon_key
+        # Made right away in tests, in the background otherwise.
+        assert response.json()["image_variants"] == {str(size): thumbnail_key(key, size) for size in IMAGES_THUMBNAIL_SIZES}
+        for variant in response.json()["image_variants"].values():
+            assert image_store.exists(variant)
+        with open(image_store.path_of(key), "rb") as f:
+            assert f.read() == image
+        assert client.get("/api/v1/organizations/my", headers=headers["u1"]).json()[0]["image"] == key
+
+        with SessionLocal() as session:
+            assert ImageRepo(session).find(digest_of(generate_identicon("org-a"))).refcount == 0
+            assert ImageRepo(session).find(digest_of(image)).refcount == 1
+
+        # The bare image works too.
+        response = client.put(f"/api/v1/organizations/{org['id']}/image", content=image, headers={**headers["u1"], "Content-Type": "image/png"})
+        assert response.status_code == 200
+        assert response.json()["image"] == key
+        with SessionLocal() as session:
+            assert ImageRepo(session).find(digest_of(image)).refcount == 1
+
+        # Not the owner, not an image, no such organization.
+        with mock.patch("app.api.org.org_controller.receive_image") as receive:
+            response = client.put(f"/api/v1/organizations/{org['id']}/image", files={"image": ("a.png", image, "image/png")}, headers=headers["u2"])
+            assert response.status_code == 400
+            # Refused before reading the body.
+            receive.assert_not_called()
+        response = client.put(f"/api/v1/organizations/{org['id']}/image", files={"image": ("a.svg", b"<svg></svg>", "image/svg+xml")}, headers=headers["u1"])
+        assert response.status_code == 400
+        response = client.put(f"/api/v1/organizations/12345/image", files={"image": ("a.png", image, "image/png")}, headers=headers["u1"])
+        assert response.status_code == 404
+        response = client.put(f"/api/v1/organizations/{org['id']}/image", files={"image": ("a.png", image, "image/png")})
+        assert response.status_code in (401, 403)
+
+        assert not [name for name in os.listdir(image_store.root) if name.startswith(".upload-")]
@@ -0,0 +1,57 @@
+from fastapi.testclient import TestClient
+import pytest
+
+from sqlalchemy import create_engine, text
+
+from app.api.config.pool_metrics import InstrumentedQueuePool, WaitHistogram, pool_stats
+from app.api.config.auth import sign_jwt
+from app.api.user.user_model import User, UserRole
+from app.api.main import app
+
+
+def test_wait_histogram():
+    histogram = WaitHistogram()
+    histogram.observe(0.0005)
+    histogram.observe(0.003)
+    histogram.observe(60)
+    histogram.observe_timeout()
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 3
+    assert snapshot["timeouts"] == 1
+    assert snapshot["buckets"]["le_1ms"] == 1
+    assert snapshot["buckets"]["le_5ms"] == 1
+    assert snapshot["buckets"]["le_inf"] == 1
+
+
+def test_instrumented_pool_stats(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", poolclass=InstrumentedQueuePool, pool_size=2, max_overflow=1)
+
+    with engine.connect() as c1, engine.connect() as c2:
+        c1.execute(text("select 1"))
+        c2.execute(text("select 1"))
+        stats = pool_stats(engine)
+        assert stats["checked_out"] == 2
+        assert stats["size"] == 2
+
+    stats = pool_stats(engine)
+    assert stats["checked_out"] == 0
+    assert stats["wait"]["count"] == 2
+    engine.dispose()
+
+
+def test_stats_requires_superadmin___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        assert client.get("/api/v1/internal/stats", headers=header).status_code == 403
+        assert client.get("/api/v1/internal/stats").status_code == 403
+
+        superadmin = User(id=1, email="admin@gmail.com", username="admin", role=UserRole.superadmin, hashed_password="")
+        header = {"Authorization": f"Bearer {sign_jwt(superadmin)}"}
+        response = client.get("/api/v1/internal/stats", headers=header)
+        assert response.status_code == 200
+        assert response.json()["database"]["primary"]["pool"] == "StaticPool"
+        assert "queue_depth" in response.json()["password_hashing"]
@@ -1,4 +1,4 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from fastapi.testclient import TestClient
 import pytest
 from app.api.org.org_service import OrganizationService
@@ -6,10 +6,15 @@ from app.api.org.org_dto import OrganizationCreateDTO
 from app.api.config.exception_handler import FieldTakenException
 from app.api.config.exception_handler import FieldTakenException
 from app.api.main import app
+from app.api.autocomplete.autocomplete_index import AutocompleteIndex
+from app.api.config.read_cache import MemoryReadCache
+from app.api.org.org_cache import org_cache
 
 
 @pytest.fixture
-def org_service():
+def org_service(monkeypatch):
+    # Mocked organizations must not end up in the shared autocomplete index.
+    monkeypatch.setattr("app.api.org.org_service.autocomplete_index", AutocompleteIndex(10, 12))
     session = MagicMock()
     service = OrganizationService(session)
     
@@ -132,4 +137,67 @@ def test_find_org_names_by_ids_no_matches(org_service):
     result = org_service.find_org_names_by_ids(ids)
 
     assert result == expected_output
-    org_service.org_repo.find_orgs_by_ids.assert_called_once_with(ids)
\ No newline at end of file
+    org_service.org_repo.find_orgs_by_ids.assert_called_once_with(ids)
+
+def test_find_my_orgs_etag_integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "etag-user", "email": "etag-user@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "etag-user", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        client.post("/api/v1/organizations", json={"name": "etag-org-1", "desc": "", "image": None}, headers=header)
+
+        response = client.get("/api/v1/organizations/my", headers=header)
+        assert response.status_code == 200
+        assert [org["name"] for org in response.json()] == ["etag-org-1"]
+        etag = response.headers["ETag"]
+
+        response = client.get("/api/v1/organizations/my", headers={**header, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+        # Joining another organization changes the list.
+        client.post("/api/v1/organizations", json={"name": "etag-org-2", "desc": "", "image": None}, headers=header)
+
+        response = client.get("/api/v1/organizations/my", headers={**header, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        assert response.headers["ETag"] != etag
+
+
+def test_org_ids_of_user_cache():
+    read_cache = MemoryReadCache(100)
+    load = MagicMock(return_value={2, 1})
+
+    with patch("app.api.org.org_cache.get_read_cache", return_value=read_cache):
+        assert org_cache.load_org_ids_of_user(1, load) == frozenset({1, 2})
+        assert org_cache.load_org_ids_of_user(1, load) == frozenset({1, 2})
+        assert load.call_count == 1
+
+        # Memberships changed.
+        read_cache.bump_versions(["user:1"])
+        load.return_value = {3}
+        assert org_cache.load_org_ids_of_user(1, load) == frozenset({3})
+        assert load.call_count == 2
+
+
+def test_org_repo_access_after_joining_integration():
+    with TestClient(app) as client:
+        headers = []
+        for username in ["acl-user-1", "acl-user-2"]:
+            client.post("/api/v1/users/", json={"username": username, "email": f"{username}@gmail.com", "password": "1234"})
+            response = client.post("/api/v1/users/login", json={"username": username, "password": "1234"})
+            headers.append({"Authorization": f"Bearer {response.json()['token']}"})
+
+        org_ids = []
+        for name in ["acl-org-1", "acl-org-2"]:
+            response = client.post("/api/v1/organizations", json={"name": name, "desc": "", "image": None}, headers=headers[0])
+            org_ids.append(response.json()["id"])
+
+            # The creator is a member right away, although their memberships were looked up (and cached) before.
+            data = {"name": "r", "desc": "", "public": False, "organization_id": org_ids[-1]}
+            assert client.post("/api/v1/repositories/", json=data, headers=headers[0]).is_success
+
+        data = {"name": "r2", "desc": "", "public": False, "organization_id": org_ids[0]}
+        assert client.post("/api/v1/repositories/", json=data, headers=headers[1]).status_code == 400
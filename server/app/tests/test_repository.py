@@ -1,7 +1,15 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
 import pytest
 import unittest.mock as mock
 
+from sqlalchemy.dialects import postgresql
 from sqlmodel import SQLModel, Session
 
 from app.api.config.security import hash_password
@@ -9,11 +17,17 @@ from app.api.user.user_model import User, UserRole
 from app.api.user.user_repo import UserRepo
 from app.api.user.user_service import UserService
 from app.api.config.exception_handler import FieldTakenException, NotFoundException, UserException
-from app.api.repo.repo_repo import RepositoryRepo
+from app.api.repo.repo_repo import RepositoryRepo, _search_query
 from app.api.repo.repo_service import RepositoryService
-from app.api.repo.repo_dto import RepositoryCreateDTO
+from app.api.repo.repo_dto import ReposOfUserDTO, RepositoryCreateDTO, RepositoryExtDTO
+from app.api.repo.repo_cache import RepositoryCache
+from app.api.repo.repo_search import MemorySearchIndex, init_postgres_search
+from app.api.repo.repo_leaderboard import Leaderboard, MemoryLeaderboard
+from app.api.repo.repo_downloads import DownloadCounter, DownloadFlusher, download_counter, download_flusher
+from app.api.config.read_cache import MemoryReadCache, ReadCache
 from app.api.repo.repo_model import Repository, RepositoryBadge
 from app.api.main import app
+from app.api.autocomplete.autocomplete_index import AutocompleteIndex
 from app.api.org.org_repo import OrganizationRepo
 
 @pytest.fixture
@@ -39,7 +53,12 @@ def user_service(mock_session, mock_user_repo):
     return service
 
 @pytest.fixture
-def repo_service(mock_session):
+def repo_service(mock_session, monkeypatch):
+    # Mocked users and repositories must not end up in the shared autocomplete index and leaderboard.
+    monkeypatch.setattr("app.api.repo.repo_service.autocomplete_index", AutocompleteIndex(10, 12))
+    monkeypatch.setattr("app.api.repo.repo_leaderboard.leaderboard", Leaderboard())
+    # Nor should memberships of mocked users be cached.
+    monkeypatch.setattr("app.api.org.org_cache.get_read_cache", ReadCache)
     service = RepositoryService(mock_session)
     service.repo_repo = mock.MagicMock(spec=RepositoryRepo)
     service.user_repo = mock.MagicMock(spec=UserRepo)
@@ -51,13 +70,6 @@ def mock_repo():
     return mock.MagicMock(Repository)
 
 
-@pytest.fixture(scope="function", autouse=True)
-def reset_db():
-    from app.api.config.database import engine
-    SQLModel.metadata.drop_all(bind=engine)
-    SQLModel.metadata.create_all(bind=engine)
-    
-
 def create_mock_user(id: int, username: str, role: UserRole):
     return User(id=id, email=f"username@email.com", username=username, role=role, hashed_password=hash_password("1234"))
 
@@ -250,13 +262,13 @@ def test_user_has_read_access_to_repo_private_org_member(repo_service, mock_repo
     mock_repo.owner_id = 1
     mock_repo.organization_id = 1
     
+    repo_service.org_repo.find_org_ids_of_user.side_effect = lambda user_id: {1} if user_id == 1 else {2}
+
     # Member of the org.
-    repo_service.org_repo.user_is_in_org.return_value = True
     assert repo_service.user_has_read_access_to_repo(mock_repo, 1) == True
     
     # Outsider relative to the org.
-    repo_service.org_repo.user_is_in_org.return_value = False
-    assert repo_service.user_has_read_access_to_repo(mock_repo, 1) == False
+    assert repo_service.user_has_read_access_to_repo(mock_repo, 2) == False
 
 
 def test_user_has_read_access_to_repo_private_org_not_member(repo_service, mock_repo):
@@ -266,7 +278,7 @@ def test_user_has_read_access_to_repo_private_org_not_member(repo_service, mock_
     mock_repo.organization_id = 1
     
     # Outsider relative to org.
-    repo_service.org_repo.user_is_in_org.return_value = False
+    repo_service.org_repo.find_org_ids_of_user.return_value = set()
     assert repo_service.user_has_read_access_to_repo(mock_repo, 1) == False
 
 """
@@ -287,16 +299,16 @@ def test_get_repositories_of_user_all_accessible(repo_service, mock_repo):
     """Test case for when all repositories are accessible by whos_asking_user_id."""
     user_id = 1
     whos_asking_user_id = 2
+    mock_repo.public = True
 
     repo_service.repo_repo.get_repositories_for_user.return_value = [mock_repo, mock_repo]
-    repo_service.user_has_read_access_to_repo = mock.MagicMock(return_value=True)
 
     result = repo_service.get_repositories_of_user(user_id, whos_asking_user_id)
 
     assert len(result) == 2
     assert result == [mock_repo, mock_repo]
     repo_service.repo_repo.get_repositories_for_user.assert_called_once_with(user_id)
-    repo_service.user_has_read_access_to_repo.assert_any_call(mock_repo, whos_asking_user_id)
+    repo_service.org_repo.find_org_ids_of_user.assert_not_called()
 
 
 def test_get_repositories_of_user_some_accessible(repo_service):
@@ -306,19 +318,31 @@ def test_get_repositories_of_user_some_accessible(repo_service):
 
     repo1 = mock.MagicMock(Repository)
     repo1.id = 1
+    repo1.public = False
+    repo1.organization_id = 10
     
     repo2 = mock.MagicMock(Repository)
     repo2.id = 2
+    repo2.public = False
+    repo2.organization_id = 20
+
+    repo3 = mock.MagicMock(Repository)
+    repo3.id = 3
+    repo3.public = False
+    repo3.organization_id = None
+    repo3.owner_id = user_id
 
-    repo_service.repo_repo.get_repositories_for_user.return_value = [repo1, repo2]
-    repo_service.user_has_read_access_to_repo = mock.MagicMock(side_effect=[True, False])
+    repo_service.repo_repo.get_repositories_for_user.return_value = [repo1, repo2, repo3]
+    repo_service.org_repo.find_org_ids_of_user.return_value = {10}
 
     result = repo_service.get_repositories_of_user(user_id, whos_asking_user_id)
 
     assert len(result) == 1
     assert result == [repo1]
     repo_service.repo_repo.get_repositories_for_user.assert_called_once_with(user_id)
-    repo_service.user_has_read_access_to_repo.assert_any_call(repo1, whos_asking_user_id)
+    # Memberships are loaded once, no matter how many org repositories there are.
+    repo_service.org_repo.find_org_ids_of_user.assert_called_once_with(whos_asking_user_id)
+    repo_service.org_repo.user_is_in_org.assert_not_called()
 
 
 def test_get_repositories_of_user_no_repositories(repo_service):
@@ -499,4 +523,779 @@ def test_get_repo_by_canonical_name___integration():
         assert get_repo_by_canonical_name("u2", "o1/o1_private").status_code == 404
         assert get_repo_by_canonical_name("u2", "u1/o1_public").status_code == 404
         assert get_repo_by_canonical_name("u2", "u1/o1_private").status_code == 404
-        assert get_repo_by_canonical_name("u2", "u2/u2_private").is_success
\ No newline at end of file
+        assert get_repo_by_canonical_name("u2", "u2/u2_private").is_success
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_async_repository_service(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    from app.api.config.cache import init_cache
+    from app.api.org.org_model import Organization, OrganizationMembers
+    from app.api.repo.repo_service import AsyncRepositoryService
+
+    init_cache()
+    path = tmp_path / "test.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(sync_engine)
+    with Session(sync_engine) as session:
+        u1, u2, u3 = [User(email=f"{name}@gmail.com", username=name, hashed_password="-") for name in ["u1", "u2", "u3"]]
+        session.add_all([u1, u2, u3])
+        session.commit()
+        org = Organization(name="o1", owner_id=u1.id)
+        session.add(org)
+        session.commit()
+        session.add_all([OrganizationMembers(user_id=u1.id, organization_id=org.id), OrganizationMembers(user_id=u2.id, organization_id=org.id)])
+        for name, public, org_id in [("pub", True, None), ("priv", False, None), ("org_priv", False, org.id), ("org_pub", True, org.id)]:
+            prefix = "o1" if org_id else "u1"
+            session.add(Repository(name=name, canonical_name=f"{prefix}/{name}", public=public, owner_id=u1.id, organization_id=org_id, downloads=len(name)))
+        session.commit()
+        u1_id, u2_id, u3_id, org_id = u1.id, u2.id, u3.id, org.id
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    try:
+        async with async_sessionmaker(class_=AsyncSession, bind=engine, expire_on_commit=False)() as async_session:
+            with Session(sync_engine) as session:
+                sync_service, async_service = RepositoryService(session), AsyncRepositoryService(async_session)
+
+                # The same answers as the sync service.
+                assert await async_service.find_user_id_by_username("u2") == u2_id
+                with pytest.raises(NotFoundException):
+                    await async_service.find_user_id_by_username("nobody")
+
+                for name, viewer in [("u1/pub", None), ("u1/priv", u1_id), ("o1/org_priv", u2_id)]:
+                    assert await async_service.find_ext_json_by_canonical_name(name, viewer) == sync_service.find_ext_json_by_canonical_name(name, viewer)
+                for name, viewer in [("u1/priv", u2_id), ("o1/org_priv", u3_id), ("o1/org_priv", None), ("u1/nothing", u1_id)]:
+                    with pytest.raises(NotFoundException):
+                        await async_service.find_ext_json_by_canonical_name(name, viewer)
+
+                for viewer in [None, u1_id, u2_id, u3_id]:
+                    expected = [repo.id for repo in sync_service.get_repositories_of_user(u1_id, viewer)]
+                    assert [repo.id for repo in await async_service.get_repositories_of_user(u1_id, viewer)] == expected
+
+                    cursor, pages, expected_pages = None, [], []
+                    while True:
+                        repos, cursor = await async_service.get_repositories_of_user_page(u1_id, viewer, 1, cursor)
+                        pages.append(([repo.id for repo in repos], cursor))
+                        if cursor is None:
+                            break
+                    while True:
+                        repos, cursor = sync_service.get_repositories_of_user_page(u1_id, viewer, 1, cursor)
+                        expected_pages.append(([repo.id for repo in repos], cursor))
+                        if cursor is None:
+                            break
+                    assert pages == expected_pages
+
+                assert await async_service.find_org_names_by_ids([org_id]) == {org_id: "o1"}
+
+                body = json.dumps({"repos": [{"id": id} for id in expected]}).encode()
+                assert json.loads(await async_service.add_downloads_json(body)) == json.loads(sync_service.add_downloads_json(body))
+    finally:
+        await engine.dispose()
+        sync_engine.dispose()
+
+
+def test_repository_endpoints_in_async_mode():
+    """
+    Runs the integration tests of the endpoints which DATABASE_ASYNC moves onto the event loop in that mode.
+    """
+    if os.getenv("DATABASE_ASYNC") is not None:
+        pytest.skip("Already in async mode")
+
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", os.path.abspath(__file__), "-k", "integration and (repositories_of_user or canonical_name)"],
+        env={**os.environ, "DATABASE_ASYNC": "1"},
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    assert result.returncode == 0, result.stdout[-3000:]
+
+
+def test_get_repositories_of_user_constant_queries___integration():
+    with TestClient(app) as client:
+        def add_user(username):
+            data = {
+                "username": username,
+                "email": f"{username}@gmail.com",
+                "password": "1234"
+            }
+            client.post("/api/v1/users/", json=data)
+            response = client.post("/api/v1/users/login", json={"username": username, "password": "1234"})
+            return {"Authorization": f"Bearer {response.json()['token']}"}
+
+        def add_private_org_repo(header, name: str):
+            org = client.post("/api/v1/organizations", json={"name": name, "desc": "", "image": None}, headers=header).json()
+            data = {
+                "name": name,
+                "desc": "",
+                "public": False,
+                "organization_id": org["id"],
+            }
+            assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+
+        def get_repos(header) -> int:
+            response = client.get("/api/v1/repositories/u/u1", headers=header)
+            assert response.is_success
+            return len(response.json()["repos"]), int(response.headers["X-Query-Count"])
+
+        header = add_user("u1")
+        get_repos(header) # The ID of "u1" is cached from now on.
+
+        add_private_org_repo(header, "o1")
+        count1, queries1 = get_repos(header)
+
+        for i in range(2, 7):
+            add_private_org_repo(header, f"o{i}")
+        count6, queries6 = get_repos(header)
+
+        assert count1 == 1
+        assert count6 == 6
+        assert queries1 == queries6, (queries1, queries6)
+
+
+def test_query_counter_is_off_unless_enabled():
+    from fastapi import FastAPI
+    import app.api.config.query_counter as query_counter
+
+    def make_app():
+        counted = FastAPI()
+        counted.get("/")(lambda: {})
+        query_counter.register_query_counter(counted)
+        return counted
+
+    with mock.patch.object(query_counter, "QUERY_COUNTER", False):
+        assert "X-Query-Count" not in TestClient(make_app()).get("/").headers
+    with mock.patch.object(query_counter, "QUERY_COUNTER", True):
+        assert TestClient(make_app()).get("/").headers["X-Query-Count"] == "0"
+
+
+def test_get_repositories_for_user_no_duplicates():
+    from app.api.config.database import SessionLocal
+    from app.api.org.org_model import Organization, OrganizationMembers
+
+    session = SessionLocal()
+    users = [User(email=f"u{i}@email.com", username=f"u{i}", hashed_password="") for i in range(5)]
+    session.add_all(users)
+    session.commit()
+    user_ids = [u.id for u in users]
+
+    org = Organization(name="o1", owner_id=user_ids[0])
+    session.add(org)
+    session.commit()
+    org_id = org.id
+
+    session.add_all([OrganizationMembers(user_id=id, organization_id=org_id) for id in user_ids])
+    session.add(Repository(name="r1", canonical_name="o1/r1", owner_id=user_ids[0], organization_id=org_id))
+    session.add(Repository(name="r2", canonical_name="u0/r2", owner_id=user_ids[0]))
+    session.add(Repository(name="r3", canonical_name="u1/r3", owner_id=user_ids[1]))
+    session.commit()
+
+    repo_repo = RepositoryRepo(session)
+    assert sorted(r.name for r in repo_repo.get_repositories_for_user(user_ids[0])) == ["r1", "r2"]
+    assert sorted(r.name for r in repo_repo.get_repositories_for_user(user_ids[1])) == ["r1", "r3"]
+    assert sorted(r.name for r in repo_repo.get_repositories_for_user(user_ids[2])) == ["r1"]
+    session.close()
+
+
+def test_get_repositories_of_user_paginated___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        for i in range(7):
+            data = {
+                "name": f"r{i}",
+                "desc": "",
+                "public": i % 3 != 0,
+                "organization_id": None,
+            }
+            assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+
+        def get_all_pages(header: dict | None, limit: int) -> list:
+            names = []
+            cursor = None
+            while True:
+                params = {"limit": limit} if cursor is None else {"limit": limit, "cursor": cursor}
+                response = client.get("/api/v1/repositories/u/u1", params=params, headers=header)
+                assert response.is_success
+                page = response.json()
+                assert len(page["repos"]) <= limit
+                names += [r["name"] for r in page["repos"]]
+                cursor = page["next"]
+                if cursor is None:
+                    return names
+
+        everything = [r["name"] for r in client.get("/api/v1/repositories/u/u1", headers=header).json()["repos"]]
+        public = [r["name"] for r in client.get("/api/v1/repositories/u/u1").json()["repos"]]
+        assert len(everything) == 7
+        assert len(public) == 4
+
+        assert get_all_pages(header, 2) == sorted(everything, reverse=True)
+        assert get_all_pages(header, 7) == sorted(everything, reverse=True)
+        assert get_all_pages(None, 2) == sorted(public, reverse=True)
+        assert get_all_pages(None, 3) == sorted(public, reverse=True)
+
+        response = client.get("/api/v1/repositories/u/u1", params={"limit": 2, "cursor": "garbage"})
+        assert response.status_code == 400
+
+        response = client.get("/api/v1/repositories/u/u1", headers={**header, "Accept": "application/x-ndjson"})
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(r["name"] for r in lines) == sorted(everything)
+
+
+def test_ndjson_stream_has_its_own_session___integration():
+    from sqlmodel import Session as SQLModelSession
+
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        header = {"Authorization": f"Bearer {client.post('/api/v1/users/login', json={'username': 'u1', 'password': '1234'}).json()['token']}"}
+        for i in range(3):
+            client.post("/api/v1/repositories/", json={"name": f"r{i}", "desc": "", "public": True}, headers=header)
+
+        events = []
+        close = SQLModelSession.close
+        page = RepositoryRepo.get_repositories_for_user_page
+
+        def traced_close(self):
+            events.append(("close", self))
+            close(self)
+
+        def traced_page(self, *args, **kwargs):
+            events.append(("query", self.session))
+            return page(self, *args, **kwargs)
+
+        with mock.patch.object(SQLModelSession, "close", traced_close), mock.patch.object(RepositoryRepo, "get_repositories_for_user_page", traced_page):
+            response = client.get("/api/v1/repositories/u/u1", headers={**header, "Accept": "application/x-ndjson"})
+        assert len(response.text.splitlines()) == 3
+
+        # Every session is queried while it's open, and closed in the end.
+        queried = [session for event, session in events if event == "query"]
+        assert queried
+        for session in queried:
+            order = [event for event, s in events if s is session]
+            assert order[-1] == "close" and "close" not in order[:-1], order
+
+
+def create_mock_ext_row(public: bool, owner_id: int, organization_id: int | None, viewer_is_member: bool):
+    row = mock.MagicMock()
+    row.public = public
+    row.owner_id = owner_id
+    row.organization_id = organization_id
+    row.viewer_is_member = viewer_is_member
+    row._mapping = {
+        "id": 1,
+        "name": "r",
+        "canonical_name": "o1/r",
+        "desc": "",
+        "public": public,
+        "owner_id": owner_id,
+        "organization_id": organization_id,
+        "badge": RepositoryBadge.none,
+        "last_updated": "2024-01-01T00:00:00",
+        "downloads": 0,
+        "owner_name": "u1",
+        "org_name": None if organization_id is None else "o1",
+        "viewer_is_member": viewer_is_member,
+    }
+    return row
+
+
+def test_find_ext_by_canonical_name(repo_service):
+    repo_service.repo_repo.find_ext_by_canonical_name.return_value = create_mock_ext_row(False, 1, 5, True)
+
+    result = repo_service.find_ext_by_canonical_name("o1/r", 2)
+
+    assert result.org_name == "o1"
+    assert result.owner_name == "u1"
+    repo_service.repo_repo.find_ext_by_canonical_name.assert_called_once_with("o1/r", 2)
+    repo_service.org_repo.user_is_in_org.assert_not_called()
+
+
+def test_find_ext_by_canonical_name_no_access(repo_service):
+    repo_service.repo_repo.find_ext_by_canonical_name.return_value = create_mock_ext_row(False, 1, 5, False)
+    with pytest.raises(NotFoundException):
+        repo_service.find_ext_by_canonical_name("o1/r", 2)
+
+    repo_service.repo_repo.find_ext_by_canonical_name.return_value = create_mock_ext_row(False, 1, None, False)
+    with pytest.raises(NotFoundException):
+        repo_service.find_ext_by_canonical_name("o1/r", None)
+
+    repo_service.repo_repo.find_ext_by_canonical_name.return_value = None
+    with pytest.raises(NotFoundException):
+        repo_service.find_ext_by_canonical_name("o1/r", 2)
+
+
+def test_get_repo_by_canonical_name_single_query___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        org = client.post("/api/v1/organizations", json={"name": "o1", "desc": "", "image": None}, headers=header).json()
+        data = {
+            "name": "r1",
+            "desc": "",
+            "public": False,
+            "organization_id": org["id"],
+        }
+        assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+
+        response = client.get("/api/v1/repositories/o1/r1", headers=header)
+        assert response.is_success
+        assert response.json()["owner_name"] == "u1"
+        assert response.json()["org_name"] == "o1"
+        assert response.headers["X-Query-Count"] == "1"
+
+
+@pytest.fixture
+def memory_read_cache():
+    read_cache = MemoryReadCache(100)
+    with mock.patch("app.api.repo.repo_cache.get_read_cache", return_value=read_cache):
+        yield read_cache
+
+
+def create_ext_dto(public: bool) -> RepositoryExtDTO:
+    return RepositoryExtDTO.model_validate(create_mock_ext_row(public, 1, None, False)._mapping)
+
+
+def test_repo_cache_public_repo(memory_read_cache):
+    cache = RepositoryCache()
+    dto = create_ext_dto(public=True)
+    load = mock.MagicMock(return_value=dto)
+
+    assert cache.load_public_repo(dto.canonical_name, load) == dto
+    assert cache.load_public_repo(dto.canonical_name, load) == dto
+    assert load.call_count == 1
+
+    cache.invalidate_repo(dto.canonical_name, [1])
+    assert cache.load_public_repo(dto.canonical_name, load) == dto
+    assert load.call_count == 2
+
+
+def test_repo_cache_never_caches_private_repo(memory_read_cache):
+    cache = RepositoryCache()
+    dto = create_ext_dto(public=False)
+    load = mock.MagicMock(return_value=dto)
+
+    assert cache.load_public_repo(dto.canonical_name, load) is None
+    assert cache.load_public_repo(dto.canonical_name, load) is None
+    assert load.call_count == 2
+
+
+def test_repo_cache_listing_per_viewer_class(memory_read_cache):
+    cache = RepositoryCache()
+    listing = ReposOfUserDTO(user_id=1, user_name="u1", repos=[], organization_names={})
+    load = mock.MagicMock(return_value=listing)
+
+    def loads_when(viewer_id, limit=None):
+        before = load.call_count
+        assert ReposOfUserDTO.model_validate_json(cache.load_listing_json(1, viewer_id, limit, None, load)) == listing
+        return load.call_count > before
+
+    assert loads_when(None)
+    assert not loads_when(None)
+    assert loads_when(1)
+    assert loads_when(2)
+    assert loads_when(None, limit=10)
+    assert not loads_when(2)
+    assert loads_when(3)
+
+    # Viewer 2 joined an organization.
+    cache.invalidate_users([2])
+    assert loads_when(2)
+    assert not loads_when(None)
+
+    # A repository was added to user 1.
+    cache.invalidate_repo("u1/r", [1])
+    assert loads_when(None)
+
+
+def test_find_ext_by_canonical_name_cached(repo_service, memory_read_cache):
+    repo_service.repo_repo.find_ext_by_canonical_name.return_value = create_mock_ext_row(True, 1, None, False)
+
+    first = repo_service.find_ext_by_canonical_name("o1/r", None)
+    second = repo_service.find_ext_by_canonical_name("o1/r", 2)
+
+    assert first == second
+    repo_service.repo_repo.find_ext_by_canonical_name.assert_called_once()
+
+
+def test_find_ext_by_canonical_name_coalesces_concurrent_misses(memory_read_cache):
+    release = threading.Event()
+    calls = []
+
+    def slow_find(canonical_name, viewer_id):
+        calls.append(viewer_id)
+        release.wait(5)
+        return create_mock_ext_row(True, 1, None, False)
+
+    services = []
+    for _ in range(8):
+        service = RepositoryService(mock.MagicMock())
+        service.repo_repo = mock.MagicMock()
+        service.repo_repo.find_ext_by_canonical_name.side_effect = slow_find
+        services.append(service)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(service.find_ext_by_canonical_name, "o1/r", i) for i, service in enumerate(services)]
+        time.sleep(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_find_ext_by_canonical_name_private_waiters_query_themselves(memory_read_cache):
+    repo_service = RepositoryService(mock.MagicMock())
+    repo_service.repo_repo = mock.MagicMock()
+    repo_service.repo_repo.find_ext_by_canonical_name.return_value = create_mock_ext_row(False, 1, None, False)
+
+    # Simulate being a waiter: the leader's load found a private repository, so nothing is shared.
+    with mock.patch.object(RepositoryCache, "load_public_repo", return_value=None):
+        result = repo_service.find_ext_by_canonical_name("o1/r", 1)
+
+    assert result.canonical_name == "o1/r"
+    repo_service.repo_repo.find_ext_by_canonical_name.assert_called_once_with("o1/r", 1)
+
+
+def test_get_repo_by_canonical_name_etag___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        for name, public in [("r1", True), ("r2", False)]:
+            data = {"name": name, "desc": "", "public": public, "organization_id": None}
+            assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+
+        for path, headers in [("/api/v1/repositories/u1/r1", {}), ("/api/v1/repositories/u1/r2", header)]:
+            response = client.get(path, headers=headers)
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+
+            response = client.get(path, headers={**headers, "If-None-Match": f'W/"other", {etag}'})
+            assert response.status_code == 304
+            assert response.content == b""
+
+            response = client.get(path, headers={**headers, "If-None-Match": '"other"'})
+            assert response.status_code == 200
+
+        # Answered from the cache without touching the database.
+        etag = client.get("/api/v1/repositories/u1/r1").headers["ETag"]
+        response = client.get("/api/v1/repositories/u1/r1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["X-Query-Count"] == "0"
+        assert response.headers["Cache-Control"] == "no-cache"
+
+
+def test_download_counter_shards_across_threads():
+    counter = DownloadCounter(shards=4)
+
+    def pull(_):
+        for _ in range(1000):
+            counter.incr(1)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(pull, range(8)))
+    counter.incr(2, 5)
+
+    assert counter.pending([1, 2, 3]) == {1: 8000, 2: 5}
+    assert counter.pending_repositories() == 2
+
+
+def test_download_counter_flush():
+    counter = DownloadCounter(shards=2)
+    counter.incr(1, 3)
+
+    assert counter.begin_flush() == {1: 3}
+    counter.incr(1)
+    # Taken but not committed yet: still visible to reads.
+    assert counter.pending([1]) == {1: 4}
+
+    counter.abort_flush()
+    assert counter.pending([1]) == {1: 4}
+
+    assert counter.begin_flush() == {1: 4}
+    counter.end_flush()
+    assert counter.pending([1]) == {}
+    assert not counter.has_pending()
+
+
+def test_download_flusher_failure_keeps_pending():
+    counter = DownloadCounter(shards=2)
+    counter.incr(1, 3)
+    session = mock.MagicMock()
+    session.__enter__.return_value.connection.side_effect = RuntimeError("database is down")
+    flusher = DownloadFlusher(counter, lambda: session, interval=60, batch_size=10)
+
+    assert flusher.flush() == 0
+    assert counter.pending([1]) == {1: 3}
+    assert flusher.stats()["failures"] == 1
+
+
+def test_count_pulls___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        for name, public in [("r1", True), ("r2", False)]:
+            data = {"name": name, "desc": "", "public": public, "organization_id": None}
+            assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+
+        for _ in range(3):
+            response = client.post("/api/v1/repositories/u1/r1/pulls")
+            assert response.status_code == 204
+        # Public repository is cached, so counting a pull doesn't touch the database.
+        assert response.headers["X-Query-Count"] == "0"
+
+        assert client.post("/api/v1/repositories/u1/r2/pulls").status_code == 404
+        assert client.post("/api/v1/repositories/u1/r2/pulls", headers=header).status_code == 204
+
+        # Not flushed yet, but reads include pending downloads.
+        assert client.get("/api/v1/repositories/u1/r1").json()["downloads"] == 3
+        repos = client.get("/api/v1/repositories/u/u1", headers=header).json()["repos"]
+        assert {repo["name"]: repo["downloads"] for repo in repos} == {"r1": 3, "r2": 1}
+
+        assert download_flusher.flush() == 2
+        assert not download_counter.has_pending()
+        assert client.get("/api/v1/repositories/u1/r1").json()["downloads"] == 3
+        assert client.get("/api/v1/repositories/u1/r2", headers=header).json()["downloads"] == 1
+        # The listing is still cached, but its counts don't go back down.
+        repos = client.get("/api/v1/repositories/u/u1", headers=header).json()["repos"]
+        assert {repo["name"]: repo["downloads"] for repo in repos} == {"r1": 3, "r2": 1}
+
+
+def test_add_official_repo_reserved_name(repo_service):
+    repo_service.user_repo.find_by_id.return_value = create_mock_user(1, "admin1", UserRole.admin)
+    dto = RepositoryCreateDTO(name="search", desc="", public=True, organization_id=None)
+
+    with pytest.raises(UserException):
+        repo_service.add(1, dto)
+
+    repo_service.repo_repo.add.assert_not_called()
+
+
+def test_memory_search_index():
+    index = MemorySearchIndex()
+    index.add(1, "python", "python", "The Python language")
+    index.add(2, "python-tools", "u1/python-tools", "")
+    index.add(3, "java", "u1/java", "Has Python bindings")
+
+    assert index.search("python") == {1: 0, 2: 1, 3: 2}
+    assert index.search("PYT") == {1: 1, 2: 1, 3: 2}
+    assert index.search("pyth too") == {2: 2}
+    assert index.search("u1/java") == {3: 0}
+    assert index.search("rust") == {}
+    assert index.search("--") == {}
+
+
+def test_postgres_search_query_compiles():
+    query = _search_query("Py fla", ["py", "fla"], 7, 21, 40)
+    compiled = query.compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+
+    assert "repository.search_document @@ to_tsquery(" in sql
+    assert "lower(repository.name) %% " in sql
+    assert " <%% lower(repository.\"desc\")" in sql
+    assert "ts_rank(repository.search_document" in sql
+    assert "similarity(lower(repository.canonical_name)" in sql
+    assert "EXISTS (SELECT organization_members.organization_id" in sql
+    assert "LIMIT " in sql and "OFFSET " in sql
+    params = compiled.params
+    assert "simple" in params.values()
+    assert "py:* & fla:*" in params.values()
+    assert "py fla" in params.values()
+    assert 7 in params.values()
+
+
+def _postgres_engine_mock(has_document: bool, indexes):
+    engine = mock.MagicMock()
+    connection = engine.connect.return_value.__enter__.return_value
+    connection.execute.return_value.first.return_value = (1,) if has_document else None
+    connection.execute.return_value.scalars.return_value = indexes
+    return engine
+
+
+def _executed(connection) -> list:
+    return [str(call.args[0]) for call in connection.execute.call_args_list]
+
+
+def test_init_postgres_search_only_creates_whats_missing():
+    engine = _postgres_engine_mock(has_document=True, indexes=[
+        "ix_repository_search_document", "ix_repository_name_trgm",
+        "ix_repository_canonical_name_trgm", "ix_repository_desc_trgm",
+    ])
+    init_postgres_search(engine)
+    engine.begin.assert_not_called()
+    engine.connect.return_value.execution_options.assert_not_called()
+
+    engine = _postgres_engine_mock(has_document=True, indexes=["ix_repository_search_document"])
+    init_postgres_search(engine)
+    engine.begin.assert_not_called()
+    engine.connect.return_value.execution_options.assert_called_once_with(isolation_level="AUTOCOMMIT")
+    autocommit = engine.connect.return_value.execution_options.return_value.__enter__.return_value
+    created = [statement for statement in _executed(autocommit) if "INDEX" in statement]
+    assert created == [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_repository_name_trgm ON repository USING GIN (lower(name) gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_repository_canonical_name_trgm ON repository USING GIN (lower(canonical_name) gin_trgm_ops)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_repository_desc_trgm ON repository USING GIN (lower(\"desc\") gin_trgm_ops)",
+    ]
+
+    engine = _postgres_engine_mock(has_document=False, indexes=[])
+    init_postgres_search(engine)
+    altered = _executed(engine.begin.return_value.__enter__.return_value)
+    assert any("ADD COLUMN search_document" in statement for statement in altered)
+
+
+def test_search___integration():
+    from app.api.config.database import SessionLocal
+
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        # Created directly, to control badges and downloads. The index is rebuilt on startup.
+        with SessionLocal() as session:
+            user_id = UserRepo(session).find_by_username("u1").id
+            for name, canonical_name, desc, public, badge, downloads in [
+                ("python", "python", "", True, RepositoryBadge.official, 10),
+                ("python-tools", "u1/python-tools", "", True, RepositoryBadge.none, 100),
+                ("my-python", "u1/my-python", "", True, RepositoryBadge.verified, 5),
+                ("secret-python", "u1/secret-python", "", False, RepositoryBadge.none, 1000),
+                ("java", "u1/java", "Has Python bindings", True, RepositoryBadge.none, 0),
+                ("rust", "u1/rust", "", True, RepositoryBadge.none, 0),
+            ]:
+                session.add(Repository(name=name, canonical_name=canonical_name, desc=desc, public=public, badge=badge, downloads=downloads, owner_id=user_id))
+            session.commit()
+
+    with TestClient(app) as client:
+        def search(q, headers={}, **params):
+            response = client.get("/api/v1/repositories/search", params={"q": q, **params}, headers=headers)
+            assert response.status_code == 200
+            return [repo["canonical_name"] for repo in response.json()["repos"]], response.json()["next"]
+
+        assert search("python") == (["python", "u1/python-tools", "u1/my-python", "u1/java"], None)
+        assert search("python", header)[0] == ["python", "u1/python-tools", "u1/my-python", "u1/secret-python", "u1/java"]
+        assert search("pyth too") == (["u1/python-tools"], None)
+
+        page1, cursor = search("python", limit=3)
+        assert page1 == ["python", "u1/python-tools", "u1/my-python"]
+        assert search("python", limit=3, cursor=cursor) == (["u1/java"], None)
+
+        # Added repositories are searchable right away.
+        data = {"name": "python-extra", "desc": "", "public": True, "organization_id": None}
+        assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+        assert search("extra") == (["u1/python-extra"], None)
+
+        assert client.get("/api/v1/repositories/search", params={"q": "python", "cursor": "x"}).status_code == 400
+
+
+def test_memory_leaderboard():
+    board = MemoryLeaderboard()
+    board.set_scores("all", {1: 10, 2: 30, 3: 20, 4: 20})
+
+    assert board.page("all", 0, 10) == [(2, 30), (3, 20), (4, 20), (1, 10)]
+    assert board.page("all", 1, 2) == [(3, 20), (4, 20)]
+    assert board.page("all", 4, 2) == []
+    assert board.page("official", 0, 10) == []
+
+    # Scores only go up.
+    board.set_scores("all", {1: 50, 2: 5})
+    assert board.page("all", 0, 2) == [(1, 50), (2, 30)]
+
+
+def test_popular___integration():
+    from app.api.config.database import SessionLocal
+
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        # Created directly, to control badges and downloads. The leaderboard is filled on startup.
+        with SessionLocal() as session:
+            user_id = UserRepo(session).find_by_username("u1").id
+            for name, public, badge, downloads in [
+                ("python", True, RepositoryBadge.official, 10),
+                ("tools", True, RepositoryBadge.none, 100),
+                ("verified", True, RepositoryBadge.verified, 5),
+                ("secret", False, RepositoryBadge.official, 1000),
+                ("node", True, RepositoryBadge.official, 50),
+            ]:
+                session.add(Repository(name=name, canonical_name=f"u1/{name}", public=public, badge=badge, downloads=downloads, owner_id=user_id))
+            session.commit()
+
+    with TestClient(app) as client:
+        def popular(**params):
+            response = client.get("/api/v1/repositories/popular", params=params)
+            assert response.status_code == 200
+            return [(repo["name"], repo["downloads"]) for repo in response.json()["repos"]], response.json()["next"]
+
+        assert popular() == ([("tools", 100), ("node", 50), ("python", 10), ("verified", 5)], None)
+        assert popular(badge="official") == ([("node", 50), ("python", 10)], None)
+        assert popular(badge="sponsored_oss") == ([], None)
+
+        page1, cursor = popular(limit=3)
+        assert page1 == [("tools", 100), ("node", 50), ("python", 10)]
+        assert popular(limit=3, cursor=cursor) == ([("verified", 5)], None)
+
+        # Added repositories are listed right away, flushed downloads move them up.
+        data = {"name": "rising", "desc": "", "public": True, "organization_id": None}
+        assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+        assert popular()[0][-1] == ("rising", 0)
+
+        for _ in range(70):
+            assert client.post("/api/v1/repositories/u1/rising/pulls").status_code == 204
+        download_flusher.flush()
+        assert popular(limit=2)[0] == [("tools", 100), ("rising", 70)]
+
+        assert client.get("/api/v1/repositories/popular", params={"cursor": "x"}).status_code == 400
+        assert client.get("/api/v1/repositories/popular", params={"badge": "x"}).status_code == 400
+
+
+def test_popular_without_leaderboard(repo_service):
+    repo_service.repo_repo.find_popular.return_value = [Repository(id=1), Repository(id=2), Repository(id=3)]
+
+    repos, next_cursor = repo_service.find_popular(RepositoryBadge.official, 2, None)
+
+    repo_service.repo_repo.find_popular.assert_called_once_with(RepositoryBadge.official, 3, 0)
+    assert [repo.id for repo in repos] == [1, 2]
+    assert next_cursor is not None
+
+
+def test_to_dtos_and_json_response():
+    from sqlalchemy import create_engine
+    from sqlmodel import select
+    from app.api.config.fast_json import json_response, to_dtos
+    from app.api.repo.repo_dto import RepositoryDTO, RepositorySearchDTO
+
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, email="u1@gmail.com", username="u1", hashed_password="-"))
+        session.add(Repository(id=1, name="r", canonical_name="u1/r", owner_id=1, downloads=3))
+        session.commit()
+
+        repos = session.exec(select(Repository)).all()
+        rows = session.exec(select(*[getattr(Repository, name) for name in RepositoryDTO.model_fields])).all()
+
+        from_repos = to_dtos(RepositoryDTO, repos)
+        assert from_repos == [RepositoryDTO.model_validate(repos[0], from_attributes=True)]
+        assert to_dtos(RepositoryDTO, rows) == from_repos
+        assert to_dtos(RepositoryDTO, []) == []
+
+    response = json_response(RepositorySearchDTO.model_construct(repos=from_repos, next=None))
+    assert response.media_type == "application/json"
+    assert RepositorySearchDTO.model_validate_json(response.body) == RepositorySearchDTO(repos=from_repos)
+    assert json_response(b'{"a":1}').body == b'{"a":1}'
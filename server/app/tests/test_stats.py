@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+import pytest
+from sqlmodel import select
+
+from app.api.config.database import SessionLocal
+from app.api.main import app
+from app.api.repo.repo_downloads import download_counter, download_flusher
+from app.api.stats.stats_model import PullEvent, PullStats, StatsGranularity
+from app.api.stats.stats_rollup import stats_rollup
+from app.api.stats.stats_service import bucket_start
+
+
+def test_bucket_start():
+    at = datetime(2024, 5, 17, 13, 45, 12, 500)
+
+    assert bucket_start(at, StatsGranularity.hour) == datetime(2024, 5, 17, 13)
+    assert bucket_start(at, StatsGranularity.day) == datetime(2024, 5, 17)
+    assert bucket_start(at, StatsGranularity.month) == datetime(2024, 5, 1)
+
+
+def add_events(repository_id: int, *events):
+    with SessionLocal() as session:
+        for created_at, count in events:
+            session.add(PullEvent(repository_id=repository_id, created_at=created_at, count=count))
+        session.commit()
+
+
+def buckets(granularity: StatsGranularity):
+    with SessionLocal() as session:
+        rows = session.exec(select(PullStats).where(PullStats.granularity == granularity).order_by(PullStats.bucket_start)).all()
+        return [(row.repository_id, row.bucket_start, row.count) for row in rows]
+
+
+def test_rollup():
+    now = datetime(2024, 5, 17, 12)
+    add_events(1,
+        (datetime(2024, 4, 30, 23, 10), 1),
+        (datetime(2024, 5, 17, 10, 5), 2),
+        (datetime(2024, 5, 17, 10, 55), 3),
+        (datetime(2024, 5, 17, 11, 0), 4),
+    )
+
+    assert stats_rollup.run(now) == 4
+    assert buckets(StatsGranularity.hour) == [
+        (1, datetime(2024, 4, 30, 23), 1),
+        (1, datetime(2024, 5, 17, 10), 5),
+        (1, datetime(2024, 5, 17, 11), 4),
+    ]
+    assert buckets(StatsGranularity.day) == [(1, datetime(2024, 4, 30), 1), (1, datetime(2024, 5, 17), 9)]
+    assert buckets(StatsGranularity.month) == [(1, datetime(2024, 4, 1), 1), (1, datetime(2024, 5, 1), 9)]
+
+    # Rolled up events aren't counted twice, new ones are added to existing buckets.
+    add_events(1, (datetime(2024, 5, 17, 11, 30), 10))
+    assert stats_rollup.run(now) == 1
+    assert buckets(StatsGranularity.hour)[-1] == (1, datetime(2024, 5, 17, 11), 14)
+    assert buckets(StatsGranularity.month)[-1] == (1, datetime(2024, 5, 1), 19)
+
+
+def test_rollup_leaves_recent_events_for_later():
+    now = datetime(2024, 5, 17, 12)
+    add_events(1, (now - timedelta(minutes=5), 1), (now - timedelta(seconds=1), 2), (now - timedelta(minutes=10), 3))
+
+    # The second event is too recent, and the third one comes after it.
+    assert stats_rollup.run(now) == 1
+    assert stats_rollup.run(now + timedelta(minutes=1)) == 2
+    assert buckets(StatsGranularity.hour) == [(1, datetime(2024, 5, 17, 11), 6)]
+
+
+def test_rollup_retention():
+    now = datetime(2024, 5, 17, 12)
+    add_events(1, (now - timedelta(days=100), 1), (now - timedelta(days=1), 2))
+
+    stats_rollup.run(now)
+
+    with SessionLocal() as session:
+        remaining = session.exec(select(PullEvent.count)).all()
+    assert remaining == [2]
+    assert [count for _, _, count in buckets(StatsGranularity.hour)] == [2]
+    assert [count for _, _, count in buckets(StatsGranularity.day)] == [1, 2]
+
+
+def test_get_repo_pull_series___integration():
+    with TestClient(app) as client:
+        client.post("/api/v1/users/", json={"username": "u1", "email": "u1@gmail.com", "password": "1234"})
+        response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+        header = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        for name, public in [("r1", True), ("r2", False)]:
+            data = {"name": name, "desc": "", "public": public, "organization_id": None}
+            assert client.post("/api/v1/repositories/", json=data, headers=header).is_success
+
+        for _ in range(3):
+            client.post("/api/v1/repositories/u1/r1/pulls")
+        download_flusher.flush()
+        assert not download_counter.has_pending()
+        stats_rollup.run(datetime.now() + timedelta(days=1))
+
+        response = client.get("/api/v1/stats/repositories/u1/r1", params={"granularity": "hour"})
+        assert response.status_code == 200
+        series = response.json()
+        assert series["canonical_name"] == "u1/r1"
+        assert [point["count"] for point in series["points"]] == [3]
+
+        response = client.get("/api/v1/stats/repositories/u1/r1", params={"granularity": "month"})
+        assert [point["count"] for point in response.json()["points"]] == [3]
+
+        # Private repositories are only visible to those who can see the repository.
+        assert client.get("/api/v1/stats/repositories/u1/r2").status_code == 404
+        response = client.get("/api/v1/stats/repositories/u1/r2", headers=header)
+        assert response.status_code == 200
+        assert response.json()["points"] == []
+
+        # Invalid time ranges.
+        params = {"granularity": "hour", "since": "2024-01-01T00:00:00", "until": "2024-06-01T00:00:00"}
+        assert client.get("/api/v1/stats/repositories/u1/r1", params=params).status_code == 400
+        params = {"since": "2024-06-01T00:00:00", "until": "2024-01-01T00:00:00"}
+        assert client.get("/api/v1/stats/repositories/u1/r1", params=params).status_code == 400
@@ -1,16 +1,21 @@
+import threading
+import time
+import anyio
+import anyio.to_thread
 from fastapi.testclient import TestClient
 import pytest
 import unittest.mock as mock
 
-from sqlmodel import SQLModel, Session
+from sqlmodel import Session
 
-from app.api.config.security import hash_password
+from app.api.config.security import PasswordHasher, hash_password, password_hasher
 from app.api.user.user_dto import UserPasswordChangeDTO, UserRegisterDTO
 from app.api.user.user_model import User, UserRole
 from app.api.user.user_repo import UserRepo
 from app.api.user.user_service import UserService
-from app.api.config.exception_handler import NotFoundException, UserException, FieldTakenException
+from app.api.config.exception_handler import NotFoundException, ServiceUnavailableException, UserException, FieldTakenException
 from app.api.main import app
+from app.api.autocomplete.autocomplete_index import AutocompleteIndex
 
 @pytest.fixture
 def mock_session():
@@ -25,17 +30,13 @@ def mock_user():
     return mock.MagicMock(User)
 
 @pytest.fixture
-def user_service(mock_session, mock_user_repo):
+def user_service(mock_session, mock_user_repo, monkeypatch):
+    # Mocked users must not end up in the shared autocomplete index.
+    monkeypatch.setattr("app.api.user.user_service.autocomplete_index", AutocompleteIndex(10, 12))
     service = UserService(mock_session)
     service.user_repo = mock_user_repo
     return service
 
-@pytest.fixture(scope="function", autouse=True)
-def reset_db():
-    from app.api.config.database import engine
-    SQLModel.metadata.drop_all(bind=engine)
-    SQLModel.metadata.create_all(bind=engine)
-
 def test_change_password(user_service, mock_user_repo):
     dto = UserPasswordChangeDTO(old_password="Password1234", new_password="NewPassword1234")
     user_start = User(id=1, email="a@email.com", username="a", role=UserRole.user, hashed_password=hash_password(dto.old_password))
@@ -271,3 +272,86 @@ def test_add___integration():
         log_in(username, 200)
         
         add_user(username, 400)
+
+
+def test_password_hasher_rejects_when_saturated():
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_work():
+        started.set()
+        release.wait()
+        return True
+
+    worker = threading.Thread(target=hasher.run, args=(blocking_work,))
+    worker.start()
+    started.wait()
+
+    with pytest.raises(ServiceUnavailableException):
+        hasher.run(lambda: True)
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["in_flight"] == 1
+
+    release.set()
+    worker.join()
+    assert hasher.run(lambda: True) == True
+    assert hasher.stats()["in_flight"] == 0
+
+
+def test_password_hasher_queues_up_to_max_queue():
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    first_started = threading.Event()
+    release = threading.Event()
+    running = []
+
+    def blocking_work(name):
+        running.append(name)
+        first_started.set()
+        release.wait()
+
+    first = threading.Thread(target=hasher.run, args=(blocking_work, "first"))
+    first.start()
+    first_started.wait()
+    second = threading.Thread(target=hasher.run, args=(blocking_work, "second"))
+    second.start()
+    while hasher.stats()["in_flight"] < 2:
+        time.sleep(0.001)
+
+    # The second one waits for the first one, in the calling thread.
+    assert running == ["first"]
+    assert hasher.stats()["queue_depth"] == 1
+    with pytest.raises(ServiceUnavailableException):
+        hasher.run(lambda: True)
+
+    release.set()
+    first.join()
+    second.join()
+    assert running == ["first", "second"]
+    assert hasher.stats()["in_flight"] == 0
+
+
+def test_default_password_hasher_leaves_most_threads_to_other_requests():
+    async def budget():
+        return anyio.to_thread.current_default_thread_limiter().total_tokens
+
+    total = anyio.run(budget)
+    assert password_hasher.workers + password_hasher.max_queue <= total // 4
+
+
+def test_login_when_password_hasher_saturated___integration():
+    with TestClient(app) as client:
+        data = {
+            "username": "u1",
+            "email": "u1@gmail.com",
+            "password": "1234"
+        }
+        client.post("/api/v1/users/", json=data)
+
+        saturated = PasswordHasher(workers=1, max_queue=0)
+        saturated._slots.acquire()
+        with mock.patch("app.api.config.security.password_hasher", saturated):
+            response = client.post("/api/v1/users/login", json={"username": "u1", "password": "1234"})
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"